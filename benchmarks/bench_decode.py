@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""单次解码与按模式合成的基准测试
+
+旧版流程把每张图片转换为RGBA，合成后再次 Image.open 检查原图模式，
+RGB图片再转换回RGB；新流程每个文件只解码一次，不透明图片保持RGB，
+只在水印区域内转换。本脚本在 JPEG/PNG/WebP 输入上分别计时两种流程，
+并校验输出像素一致（比较时统一转换为RGBA）。
+
+用法:
+    python benchmarks/bench_decode.py --width 4000 --height 3000 --count 5
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from watermark import WatermarkPlan, calculate_position, paste_watermark, add_watermark
+
+FORMATS = [
+    ('JPEG', '.jpg', 'RGB'),
+    ('PNG', '.png', 'RGB'),
+    ('PNG', '.png', 'RGBA'),
+    ('WEBP', '.webp', 'RGB')
+]
+
+def legacy_add_watermark(input_path, output_path, plan):
+    """旧版流程：整图转换为RGBA，合成后重新打开原图检查模式"""
+    image = Image.open(input_path).convert('RGBA')
+    watermark = plan.prepare(*image.size)
+    position = calculate_position('bottom-right', image.size, watermark.size)
+    paste_watermark(image, watermark, position)
+    result = image
+    if Image.open(input_path).mode == 'RGB':
+        result = result.convert('RGB')
+    result.save(output_path)
+
+def make_image(path, fmt, mode, width, height):
+    """生成测试图片"""
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    ImageDraw.Draw(image).ellipse((width // 4, height // 4, width * 3 // 4, height * 3 // 4), fill=(200, 80, 40))
+    if mode == 'RGBA':
+        image.putalpha(200)
+    image.save(path, fmt)
+
+def make_logo(path):
+    """生成半透明的测试水印图片"""
+    logo = Image.new('RGBA', (400, 160), (0, 0, 0, 0))
+    ImageDraw.Draw(logo).ellipse((0, 0, 399, 159), fill=(255, 255, 255, 200))
+    logo.save(path)
+
+def time_runs(func, paths, output_dir):
+    """对每个输入运行一次，返回总耗时"""
+    # 屏蔽逐个文件的输出
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for path in paths:
+            func(path, os.path.join(output_dir, os.path.basename(path)))
+        return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='单次解码与按模式合成的基准测试')
+    parser.add_argument('--width', type=int, default=4000, help='测试图片宽度')
+    parser.add_argument('--height', type=int, default=3000, help='测试图片高度')
+    parser.add_argument('--count', type=int, default=5, help='每种格式的图片数量')
+    args = parser.parse_args()
+
+    identical = True
+    with tempfile.TemporaryDirectory() as root:
+        logo_path = os.path.join(root, 'logo.png')
+        make_logo(logo_path)
+        plan = WatermarkPlan(logo_path)
+
+        print(f"图片尺寸: {args.width}x{args.height}，每种格式 {args.count} 张")
+        for fmt, ext, mode in FORMATS:
+            name = f"{fmt.lower()}_{mode.lower()}"
+            input_dir = os.path.join(root, name)
+            legacy_dir = os.path.join(root, name + '_legacy')
+            new_dir = os.path.join(root, name + '_new')
+            for directory in (input_dir, legacy_dir, new_dir):
+                os.makedirs(directory)
+            paths = [os.path.join(input_dir, f"image_{i}{ext}") for i in range(args.count)]
+            make_image(paths[0], fmt, mode, args.width, args.height)
+            for path in paths[1:]:
+                with open(paths[0], 'rb') as src, open(path, 'wb') as dst:
+                    dst.write(src.read())
+
+            legacy_time = time_runs(lambda i, o: legacy_add_watermark(i, o, plan), paths, legacy_dir)
+            new_time = time_runs(lambda i, o: add_watermark(i, o, None, plan=plan), paths, new_dir)
+
+            for path in paths:
+                name_only = os.path.basename(path)
+                legacy = Image.open(os.path.join(legacy_dir, name_only))
+                new = Image.open(os.path.join(new_dir, name_only))
+                if legacy.convert('RGBA').tobytes() != new.convert('RGBA').tobytes():
+                    identical = False
+
+            print(f"{fmt:<5} {mode:<5}: 旧流程 {legacy_time / args.count * 1000:8.1f} ms/张  "
+                  f"新流程 {new_time / args.count * 1000:8.1f} ms/张  加速比 {legacy_time / new_time:5.2f}x")
+
+    print(f"像素一致: {'是' if identical else '否'}")
+    return 0 if identical else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
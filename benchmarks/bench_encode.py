@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""编码配置基准测试
+
+对同一张加好水印的测试图片，按每种输出格式和编码配置编码到内存，
+报告编码耗时和输出大小，用于在CPU耗时和文件大小之间选择编码配置。
+
+用法:
+    python benchmarks/bench_encode.py --width 4000 --height 3000 --repeat 3
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter
+from watermark_encode import OUTPUT_FORMATS, PROFILES, Encoder
+
+def make_image(width, height):
+    """生成带噪声和渐变的照片类测试图片，纯色图片的压缩结果没有参考意义"""
+    noise = Image.effect_noise((width, height), 40).filter(ImageFilter.GaussianBlur(1))
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, noise, Image.eval(gradient, lambda v: 255 - v)))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width // 4, height // 4, width * 3 // 4, height * 3 // 4), fill=(200, 80, 40))
+    draw.rectangle((width - width // 5, height - height // 10, width - 20, height - 20), fill=(255, 255, 255))
+    return image
+
+def encode(encoder, image, image_format, repeat):
+    """编码到内存，返回 (最短耗时, 输出字节数)"""
+    best = None
+    size = 0
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        encoder.write(image, buffer, image_format)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        size = buffer.tell()
+    return best, size
+
+def main():
+    parser = argparse.ArgumentParser(description='编码配置基准测试')
+    parser.add_argument('--width', type=int, default=4000, help='测试图片宽度')
+    parser.add_argument('--height', type=int, default=3000, help='测试图片高度')
+    parser.add_argument('--repeat', type=int, default=3, help='每种配置的编码次数，取最短耗时')
+    parser.add_argument('--formats', nargs='+', default=sorted(OUTPUT_FORMATS), choices=sorted(OUTPUT_FORMATS),
+                        help='要测试的输出格式')
+    args = parser.parse_args()
+
+    image = make_image(args.width, args.height)
+    print(f"图片尺寸: {args.width}x{args.height}，每种配置编码 {args.repeat} 次取最短耗时")
+    print(f"{'格式':<6}{'配置':<10}{'耗时(ms)':>10}{'大小(KB)':>12}")
+    for name in args.formats:
+        image_format = OUTPUT_FORMATS[name][0]
+        for profile in PROFILES:
+            encoder = Encoder(profile, name)
+            seconds, size = encode(encoder, encoder.prepare(image, image_format), image_format, args.repeat)
+            print(f"{name:<8}{profile:<12}{seconds * 1000:10.1f}{size / 1024:12.1f}")
+        if image_format == 'WEBP':
+            encoder = Encoder('default', name, lossless=True)
+            seconds, size = encode(encoder, image, image_format, args.repeat)
+            print(f"{name:<8}{'lossless':<12}{seconds * 1000:10.1f}{size / 1024:12.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""水印透明度处理的微基准测试
+
+对比旧版逐像素 getpixel/putpixel 循环与 apply_opacity 的通道查表实现，
+验证两者输出的像素完全一致，并打印耗时与加速比。
+
+用法:
+    python benchmarks/bench_opacity.py --width 6000 --scale 0.2 --opacity 128
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from watermark import apply_opacity
+
+def legacy_apply_opacity(watermark, opacity):
+    """旧版实现：逐像素读取并写回透明度"""
+    watermark_with_opacity = Image.new('RGBA', watermark.size, (0, 0, 0, 0))
+    for x in range(watermark.width):
+        for y in range(watermark.height):
+            r, g, b, a = watermark.getpixel((x, y))
+            new_a = int(a * opacity / 255)
+            watermark_with_opacity.putpixel((x, y), (r, g, b, new_a))
+    return watermark_with_opacity
+
+def make_logo(width, height, seed=0):
+    """生成带随机透明度的测试水印图片"""
+    rng = random.Random(seed)
+    data = bytes(rng.randrange(256) for _ in range(width * height * 4))
+    return Image.frombytes('RGBA', (width, height), data)
+
+def best_of(func, repeat):
+    """多次运行取最短耗时"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='水印透明度处理微基准测试')
+    parser.add_argument('--width', type=int, default=6000, help='模拟原图宽度（像素）')
+    parser.add_argument('--scale', type=float, default=0.2, help='水印缩放比例')
+    parser.add_argument('--aspect', type=float, default=0.5, help='水印高宽比')
+    parser.add_argument('--opacity', type=int, default=128, help='水印透明度（0-255）')
+    parser.add_argument('--repeat', type=int, default=3, help='新实现的重复次数')
+    args = parser.parse_args()
+
+    logo_width = max(1, int(args.width * args.scale))
+    logo_height = max(1, int(logo_width * args.aspect))
+    logo = make_logo(logo_width, logo_height)
+    print(f"水印尺寸: {logo_width}x{logo_height} ({logo_width * logo_height} 像素)")
+
+    # 旧版实现很慢，只运行一次
+    legacy_time, legacy_result = best_of(lambda: legacy_apply_opacity(logo, args.opacity), 1)
+    fast_time, fast_result = best_of(lambda: apply_opacity(logo, args.opacity), args.repeat)
+
+    identical = legacy_result.tobytes() == fast_result.tobytes()
+    print(f"逐像素循环: {legacy_time * 1000:.1f} ms")
+    print(f"通道查表:   {fast_time * 1000:.3f} ms")
+    print(f"加速比:     {legacy_time / fast_time:.0f}x")
+    print(f"像素一致:   {'是' if identical else '否'}")
+    return 0 if identical else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""分阶段流水线的基准测试
+
+模拟网络存储：在当前进程中给输入文件的每次打开和输出文件的每次重命名
+加上固定延迟，分别计时逐张顺序读写（run_batch）和 I/O 线程与计算重叠的
+流水线（run_pipeline），并校验两者输出完全一致。延迟为0时反映本地磁盘上
+流水线本身的开销。
+
+用法:
+    python benchmarks/bench_pipeline.py --count 40 --latency 30 --io_threads 4
+"""
+
+import os
+import sys
+import time
+import hashlib
+import builtins
+import tempfile
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from watermark import WatermarkPlan
+from watermark_batch import run_batch, run_pipeline
+from watermark_files import iter_tasks
+
+@contextlib.contextmanager
+def simulated_latency(root, seconds):
+    """对 root 下文件的打开和重命名加上固定延迟"""
+    original_open = builtins.open
+    original_replace = os.replace
+
+    def slow_open(file, *args, **kwargs):
+        if isinstance(file, str) and file.startswith(root):
+            time.sleep(seconds)
+        return original_open(file, *args, **kwargs)
+
+    def slow_replace(src, dst, *args, **kwargs):
+        time.sleep(seconds)
+        return original_replace(src, dst, *args, **kwargs)
+
+    builtins.open = slow_open
+    os.replace = slow_replace
+    try:
+        yield
+    finally:
+        builtins.open = original_open
+        os.replace = original_replace
+
+def make_corpus(directory, count, width, height):
+    """生成测试图片"""
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    ImageDraw.Draw(image).ellipse((width // 4, height // 4, width * 3 // 4, height * 3 // 4), fill=(200, 80, 40))
+    image.save(os.path.join(directory, 'image_0.jpg'))
+    with open(os.path.join(directory, 'image_0.jpg'), 'rb') as f:
+        data = f.read()
+    for i in range(1, count):
+        with open(os.path.join(directory, f'image_{i}.jpg'), 'wb') as f:
+            f.write(data)
+
+def digest_dir(directory):
+    """输出目录中所有图片的摘要"""
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description='分阶段流水线基准测试')
+    parser.add_argument('--count', type=int, default=40, help='测试图片数量')
+    parser.add_argument('--width', type=int, default=2000, help='测试图片宽度')
+    parser.add_argument('--height', type=int, default=1500, help='测试图片高度')
+    parser.add_argument('--latency', type=float, default=30, help='每次打开或重命名文件的模拟延迟（毫秒）')
+    parser.add_argument('--io_threads', type=int, default=4, help='流水线的读写线程数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        input_dir = os.path.join(root, 'input')
+        os.makedirs(input_dir)
+        make_corpus(input_dir, args.count, args.width, args.height)
+        logo_path = os.path.join(root, 'logo.png')
+        logo = Image.new('RGBA', (400, 160), (0, 0, 0, 0))
+        ImageDraw.Draw(logo).ellipse((0, 0, 399, 159), fill=(255, 255, 255, 200))
+        logo.save(logo_path)
+
+        options = {'watermark_path': logo_path}
+        results = {}
+        for name, run in (('顺序读写', lambda tasks, plan: run_batch(tasks, options, plan)),
+                          ('流水线', lambda tasks, plan: run_pipeline(tasks, options, plan, io_threads=args.io_threads))):
+            output_dir = os.path.join(root, name)
+            os.makedirs(output_dir)
+            plan = WatermarkPlan(logo_path)
+            # 屏蔽逐个文件的输出
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                    simulated_latency(root, args.latency / 1000):
+                start = time.perf_counter()
+                run(iter_tasks(input_dir, output_dir), plan)
+                elapsed = time.perf_counter() - start
+            results[name] = (elapsed, digest_dir(output_dir))
+
+    print(f"{args.count} 张 {args.width}x{args.height} 图片，模拟延迟 {args.latency:g} ms，读写线程 {args.io_threads}")
+    for name, (elapsed, _) in results.items():
+        print(f"{name}: {elapsed:6.2f} s  ({elapsed / args.count * 1000:.1f} ms/张)")
+    identical = len({digest for _, digest in results.values()}) == 1
+    print(f"输出一致: {'是' if identical else '否'}")
+    return 0 if identical else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
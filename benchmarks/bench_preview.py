@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""图形界面预览的基准测试
+
+旧版预览对原图完整运行 add_watermark，把结果写入临时PNG，再重新打开并用
+LANCZOS 缩小到画布大小；新版用 JPEG draft 按缩小的比例解码，在内存中合成
+按比例缩放的水印。本脚本对一张大尺寸JPEG分别计时两种流程。
+
+用法:
+    python benchmarks/bench_preview.py --width 7728 --height 5152 --canvas 600x450
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from watermark import add_watermark
+from watermark_preview import load_preview_base, render_preview
+
+def legacy_preview(input_path, logo_path, temp_dir, canvas_size):
+    """旧版流程：全分辨率处理、写入临时文件、重新打开并缩小"""
+    temp_output = os.path.join(temp_dir, 'preview.png')
+    add_watermark(input_path, temp_output, logo_path)
+    img = Image.open(temp_output)
+    ratio = min(canvas_size[0] / img.width, canvas_size[1] / img.height)
+    return img.resize((int(img.width * ratio), int(img.height * ratio)), Image.LANCZOS)
+
+def new_preview(input_path, logo_path, canvas_size):
+    """新版流程：缩小解码并在内存中合成"""
+    base, ratio = load_preview_base(input_path, canvas_size)
+    return render_preview(base, ratio, logo_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='图形界面预览基准测试')
+    parser.add_argument('--width', type=int, default=7728, help='测试图片宽度（默认约40MP）')
+    parser.add_argument('--height', type=int, default=5152, help='测试图片高度')
+    parser.add_argument('--canvas', default='600x450', help='预览画布尺寸，如 600x450')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最短耗时')
+    args = parser.parse_args()
+    canvas_size = tuple(int(v) for v in args.canvas.lower().split('x'))
+
+    with tempfile.TemporaryDirectory() as root:
+        input_path = os.path.join(root, 'photo.jpg')
+        image = Image.linear_gradient('L').resize((args.width, args.height)).convert('RGB')
+        ImageDraw.Draw(image).ellipse((args.width // 4, args.height // 4, args.width * 3 // 4, args.height * 3 // 4),
+                                      fill=(200, 80, 40))
+        image.save(input_path, quality=90)
+        del image
+        logo_path = os.path.join(root, 'logo.png')
+        logo = Image.new('RGBA', (400, 160), (0, 0, 0, 0))
+        ImageDraw.Draw(logo).ellipse((0, 0, 399, 159), fill=(255, 255, 255, 200))
+        logo.save(logo_path)
+
+        results = {}
+        for name, run in (('旧版', lambda: legacy_preview(input_path, logo_path, root, canvas_size)),
+                          ('新版', lambda: new_preview(input_path, logo_path, canvas_size))):
+            best = None
+            # 屏蔽 add_watermark 的输出
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    preview = run()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+            results[name] = (best, preview.size)
+
+    print(f"原图 {args.width}x{args.height} ({args.width * args.height / 1e6:.1f} MP)，画布 {canvas_size[0]}x{canvas_size[1]}")
+    for name, (seconds, size) in results.items():
+        print(f"{name}: {seconds * 1000:8.1f} ms  预览尺寸 {size[0]}x{size[1]}")
+    print(f"加速比: {results['旧版'][0] / results['新版'][0]:.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
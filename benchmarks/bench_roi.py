@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""局部区域合成与整幅图层合成的对比基准测试
+
+旧版实现为每张图片分配与原图同样大小的透明图层并对整幅图片做 alpha_composite；
+paste_watermark 只在水印及背景所占的区域内分配图层和混合。
+每种实现在独立的子进程中运行，以便分别统计合成阶段新增的峰值内存（RSS），
+同时校验两者输出的像素完全一致。
+
+用法:
+    python benchmarks/bench_roi.py --width 8660 --height 5773
+"""
+
+import os
+import sys
+import json
+import hashlib
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from watermark import draw_rounded_rectangle, background_rect, paste_watermark
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以KB为单位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def legacy_paste_watermark(image, watermark, position, bg_color, corner_radius):
+    """旧版实现：整幅透明图层 + 整幅 alpha_composite"""
+    transparent = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    if bg_color[3] > 0:
+        bg_layer = Image.new('RGBA', image.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(bg_layer)
+        rect_position = background_rect(position, watermark.size)
+        if corner_radius > 0:
+            draw_rounded_rectangle(draw, rect_position, bg_color, corner_radius)
+        else:
+            draw.rectangle(rect_position, fill=bg_color)
+        transparent = Image.alpha_composite(transparent, bg_layer)
+    transparent.paste(watermark, position, watermark)
+    return Image.alpha_composite(image, transparent)
+
+def make_inputs(width, height):
+    """生成测试原图和水印"""
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGBA')
+    watermark = Image.new('RGBA', (width // 5, width // 10), (0, 0, 0, 0))
+    ImageDraw.Draw(watermark).ellipse((0, 0, watermark.width - 1, watermark.height - 1), fill=(255, 255, 255, 160))
+    position = (width - watermark.width - 20, height - watermark.height - 20)
+    return image, watermark, position
+
+def run_child(variant, width, height, repeat):
+    """子进程：运行一种实现并输出JSON结果"""
+    image, watermark, position = make_inputs(width, height)
+    bg_color = (0, 0, 0, 128)
+    # 预先复制好每轮的目标图片，不计入合成阶段的内存
+    targets = [image.copy() for _ in range(repeat)]
+    rss_before = peak_rss_mb()
+
+    best = None
+    for target in targets:
+        start = time.perf_counter()
+        if variant == 'full':
+            result = legacy_paste_watermark(target, watermark, position, bg_color, 12)
+        else:
+            paste_watermark(target, watermark, position, bg_color, 12)
+            result = target
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    rss_after = peak_rss_mb()
+    print(json.dumps({
+        'variant': variant,
+        'seconds': best,
+        'peak_delta_mb': None if rss_before is None else rss_after - rss_before,
+        'digest': hashlib.sha1(result.tobytes()).hexdigest()
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description='局部区域合成基准测试')
+    parser.add_argument('--width', type=int, default=8660, help='测试图片宽度（默认约50MP）')
+    parser.add_argument('--height', type=int, default=5773, help='测试图片高度')
+    parser.add_argument('--repeat', type=int, default=3, help='每种实现的重复次数')
+    parser.add_argument('--child', choices=['full', 'roi'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.width, args.height, args.repeat)
+        return 0
+
+    results = {}
+    for variant in ('full', 'roi'):
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--child', variant,
+            '--width', str(args.width), '--height', str(args.height), '--repeat', str(args.repeat)
+        ])
+        results[variant] = json.loads(output)
+
+    print(f"图片尺寸: {args.width}x{args.height} ({args.width * args.height / 1e6:.1f} MP)")
+    for variant, label in (('full', '整幅图层'), ('roi', '局部区域')):
+        result = results[variant]
+        memory = '不支持' if result['peak_delta_mb'] is None else f"{result['peak_delta_mb']:.1f} MB"
+        print(f"{label}: 耗时 {result['seconds'] * 1000:8.1f} ms  合成阶段新增峰值内存 {memory}")
+    identical = results['full']['digest'] == results['roi']['digest']
+    print(f"像素一致: {'是' if identical else '否'}")
+    return 0 if identical else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""水印处理各阶段的基准测试套件
+
+在 corpus.py 生成的确定性图片集上（多种尺寸，JPEG/PNG/WebP，RGB/RGBA/调色板），
+分别使用图片水印、带背景的图片水印和文字水印（透明度均小于255，带圆角），
+对每张图片分阶段计时：
+
+    decode    解码为工作模式（open_image）
+    prepare   准备水印：缩放、透明度、圆角蒙版或渲染文字贴图（不使用缓存）
+    composite 在原图上合成水印（watermark_image，水印已准备好）
+    encode    编码为输出格式（encode_image）
+    write     原子地写入磁盘（atomic_write）
+
+每个阶段取多次运行的中位数。结果可以保存为JSON，并与之前保存的基线比较，
+某个阶段变慢超过阈值时返回非0退出码，升级Pillow或修改热点代码前后各运行一次即可。
+
+用法:
+    python benchmarks/bench_suite.py --output baseline.json
+    python benchmarks/bench_suite.py --baseline baseline.json --threshold 0.15
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL
+from watermark import open_image, make_plan, watermark_image, encode_image, atomic_write
+from corpus import VARIANTS, DEFAULT_SIZES, parse_dimensions, generate, make_logo
+
+STAGES = ('decode', 'prepare', 'composite', 'encode', 'write')
+
+# 水印设置: 名称 -> make_plan 和 watermark_image 的参数，logo 在运行时替换为水印图片路径
+MARKS = {
+    'image': {'watermark_path': 'logo', 'scale': 0.2, 'font_color': (255, 255, 255, 160),
+              'bg_color': (0, 0, 0, 0), 'corner_radius': 16},
+    'image_bg': {'watermark_path': 'logo', 'scale': 0.2, 'font_color': (255, 255, 255, 200),
+                 'bg_color': (0, 0, 0, 128), 'corner_radius': 12},
+    'text': {'text': '版权所有 © 2024', 'font_size': 40, 'scale': 0.3, 'font_color': (255, 255, 255, 200),
+             'bg_color': (0, 0, 0, 120), 'corner_radius': 10}
+}
+
+def run_case(input_path, output_path, mark, repeat):
+    """对一张图片和一种水印设置分阶段计时
+
+    返回:
+        {阶段: 中位数耗时(ms)}，以及输出字节数 bytes
+    """
+    timings = {stage: [] for stage in STAGES}
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = open_image(input_path)
+        timings['decode'].append(time.perf_counter() - start)
+
+        # 每次使用新的水印计划，计时的是未命中缓存时的准备耗时
+        plan = make_plan(mark.get('watermark_path'), mark['scale'], mark.get('text'), mark.get('font_size', 40),
+                         mark['font_color'], mark['bg_color'], mark['corner_radius'])
+        start = time.perf_counter()
+        plan.prepare(*image.size)
+        timings['prepare'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        watermark_image(image, plan, 'bottom-right', 20, mark['bg_color'], mark['corner_radius'])
+        timings['composite'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        data = encode_image(image, output_path)
+        timings['encode'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        atomic_write(output_path, lambda f: f.write(data))
+        timings['write'].append(time.perf_counter() - start)
+        size = len(data)
+
+    result = {stage: round(statistics.median(values) * 1000, 3) for stage, values in timings.items()}
+    result['total'] = round(sum(result[stage] for stage in STAGES), 3)
+    result['bytes'] = size
+    return result
+
+def compare(results, baseline, threshold, min_ms):
+    """与基线比较，返回变慢的 [(用例, 阶段, 基线ms, 当前ms)]
+
+    变慢超过 threshold（比例）且差值超过 min_ms 才算退化，避免极短阶段的计时噪声。
+    """
+    regressions = []
+    for case, current in results['cases'].items():
+        previous = baseline.get('cases', {}).get(case)
+        if previous is None:
+            continue
+        for stage in STAGES + ('total',):
+            if stage not in previous:
+                continue
+            if current[stage] > previous[stage] * (1 + threshold) and current[stage] - previous[stage] > min_ms:
+                regressions.append((case, stage, previous[stage], current[stage]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='水印处理各阶段的基准测试套件')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='测试图片尺寸，格式为 宽x高')
+    parser.add_argument('--variants', nargs='+', choices=[v[0] for v in VARIANTS], help='格式和模式组合，默认全部')
+    parser.add_argument('--marks', nargs='+', choices=sorted(MARKS), default=sorted(MARKS), help='水印设置')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例的运行次数，取中位数')
+    parser.add_argument('--seed', type=int, default=0, help='图片集的随机种子')
+    parser.add_argument('--corpus_dir', help='图片集目录，默认使用临时目录（已存在的图片不重新生成）')
+    parser.add_argument('--output', help='把结果保存为JSON文件')
+    parser.add_argument('--baseline', help='与之前保存的JSON结果比较')
+    parser.add_argument('--threshold', type=float, default=0.15, help='判定变慢的比例，默认0.15（慢15%%）')
+    parser.add_argument('--min_ms', type=float, default=0.5, help='判定变慢的最小差值（毫秒）')
+    args = parser.parse_args()
+
+    sizes = [parse_dimensions(size) for size in args.sizes]
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'cases': {}
+    }
+
+    with tempfile.TemporaryDirectory() as root:
+        corpus_dir = args.corpus_dir or os.path.join(root, 'corpus')
+        files = generate(corpus_dir, sizes, args.variants, args.seed)
+        logo_path = make_logo(os.path.join(root, 'logo.png'))
+        output_dir = os.path.join(root, 'output')
+        os.makedirs(output_dir)
+
+        print(f"{len(files)} 张测试图片 x {len(args.marks)} 种水印，每个用例运行 {args.repeat} 次取中位数（毫秒）")
+        print(f"{'用例':<32}" + ''.join(f"{stage:>11}" for stage in STAGES + ('total',)))
+        for name, (width, height), path in files:
+            for mark_name in args.marks:
+                mark = dict(MARKS[mark_name])
+                if mark.get('watermark_path') == 'logo':
+                    mark['watermark_path'] = logo_path
+                case = f"{name}/{width}x{height}/{mark_name}"
+                output_path = os.path.join(output_dir, os.path.basename(path))
+                result = run_case(path, output_path, mark, args.repeat)
+                results['cases'][case] = result
+                print(f"{case:<34}" + ''.join(f"{result[stage]:11.2f}" for stage in STAGES + ('total',)))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        meta = baseline.get('meta', {})
+        print(f"基线: Python {meta.get('python')}，Pillow {meta.get('pillow')}，{meta.get('time')}")
+        if not regressions:
+            print(f"与基线相比没有超过 {args.threshold:.0%} 的变慢")
+            return 0
+        print(f"与基线相比变慢超过 {args.threshold:.0%} 的阶段:")
+        for case, stage, before, after in regressions:
+            print(f"  {case} {stage}: {before:.2f} ms -> {after:.2f} ms ({after / before:.2f}x)")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
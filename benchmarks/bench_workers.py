@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""多进程批量处理吞吐量基准测试
+
+在临时目录中生成一批合成图片，分别以不同的进程数运行 process_directory，
+打印每秒处理的图片数和相对单进程的加速比。
+
+用法:
+    python benchmarks/bench_workers.py --count 64 --workers 1 2 4 8
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from watermark import process_directory
+
+def make_corpus(directory, count, width, height, seed=0):
+    """生成带随机色块的JPEG测试图片"""
+    rng = random.Random(seed)
+    for i in range(count):
+        image = Image.new('RGB', (width, height))
+        draw = ImageDraw.Draw(image)
+        for _ in range(20):
+            x0, x1 = sorted(rng.randrange(width) for _ in range(2))
+            y0, y1 = sorted(rng.randrange(height) for _ in range(2))
+            draw.rectangle((x0, y0, x1, y1), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        image.save(os.path.join(directory, f"image_{i:04d}.jpg"), quality=90)
+
+def make_logo(path):
+    """生成半透明的测试水印图片"""
+    logo = Image.new('RGBA', (400, 160), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(logo)
+    draw.ellipse((0, 0, 399, 159), fill=(255, 255, 255, 200))
+    logo.save(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程批量处理吞吐量基准测试')
+    parser.add_argument('--count', type=int, default=64, help='测试图片数量')
+    parser.add_argument('--width', type=int, default=3000, help='测试图片宽度')
+    parser.add_argument('--height', type=int, default=2000, help='测试图片高度')
+    parser.add_argument('--workers', type=int, nargs='+', default=None, help='要测试的进程数列表')
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    workers_list = args.workers or sorted({1, 2, 4, 8, 16, 32, cpu_count} & set(range(1, cpu_count + 1)))
+
+    with tempfile.TemporaryDirectory() as root:
+        input_dir = os.path.join(root, 'input')
+        os.makedirs(input_dir)
+        logo_path = os.path.join(root, 'logo.png')
+        make_corpus(input_dir, args.count, args.width, args.height)
+        make_logo(logo_path)
+        print(f"测试图片: {args.count} 张 {args.width}x{args.height} JPEG，CPU核心数: {cpu_count}")
+
+        baseline = None
+        for workers in workers_list:
+            output_dir = os.path.join(root, f'output_{workers}')
+            start = time.perf_counter()
+            # 屏蔽逐个文件的输出
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                process_directory(input_dir, output_dir, logo_path, font_color=(255, 255, 255, 128), workers=workers)
+            elapsed = time.perf_counter() - start
+            throughput = args.count / elapsed
+            baseline = baseline or throughput
+            print(f"进程数 {workers:>3}: {elapsed:7.2f} s  {throughput:7.1f} 张/秒  加速比 {throughput / baseline:5.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""确定性的合成测试图片集
+
+按固定的随机种子生成照片类测试图片，覆盖常见的格式和模式组合
+（JPEG RGB、PNG RGB/RGBA/调色板、WebP RGB/RGBA）以及不同的尺寸；
+相同的参数总是生成逐字节相同的文件，基准测试的结果可以在不同时间、
+不同机器之间比较。bench_suite.py 使用这里的图片集，也可以单独生成：
+
+用法:
+    python benchmarks/corpus.py --output_dir ./corpus --sizes 1920x1080 4000x3000
+"""
+
+import os
+import sys
+import random
+import argparse
+
+from PIL import Image, ImageDraw
+
+# (名称, Pillow格式名, 扩展名, 图片模式)
+VARIANTS = [
+    ('jpeg_rgb', 'JPEG', '.jpg', 'RGB'),
+    ('png_rgb', 'PNG', '.png', 'RGB'),
+    ('png_rgba', 'PNG', '.png', 'RGBA'),
+    ('png_p', 'PNG', '.png', 'P'),
+    ('webp_rgb', 'WEBP', '.webp', 'RGB'),
+    ('webp_rgba', 'WEBP', '.webp', 'RGBA')
+]
+
+DEFAULT_SIZES = ['800x600', '1920x1080']
+
+def parse_dimensions(value):
+    """解析 宽x高 格式的尺寸"""
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+def make_photo(width, height, seed=0):
+    """生成带渐变和随机色块的RGB测试图片
+
+    Image.effect_noise 的结果不可复现，这里只使用渐变和由 seed 决定的图形。
+    """
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    radial = Image.radial_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, radial, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(24):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(width // 20, width // 4 + 1), rng.randrange(height // 20, height // 4 + 1)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.ellipse((x, y, x + w, y + h), fill=color)
+        else:
+            draw.rectangle((x, y, x + w, y + h), fill=color)
+    return image
+
+def make_variant(image, mode):
+    """把RGB测试图片转换为指定模式，RGBA带有渐变的透明度"""
+    if mode == 'RGBA':
+        rgba = image.copy()
+        rgba.putalpha(Image.linear_gradient('L').rotate(90).resize(image.size).point(lambda v: 96 + v * 159 // 255))
+        return rgba
+    if mode == 'P':
+        return image.quantize(256)
+    return image
+
+def make_logo(path, width=400, height=160):
+    """生成带半透明区域的测试水印图片"""
+    logo = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(logo)
+    draw.rounded_rectangle((0, 0, width - 1, height - 1), radius=height // 4, fill=(20, 20, 20, 140))
+    draw.ellipse((height // 8, height // 8, height * 7 // 8, height * 7 // 8), fill=(255, 255, 255, 220))
+    draw.text((height, height // 3), "WATERMARK", fill=(255, 255, 255, 255))
+    logo.save(path)
+    return path
+
+def generate(output_dir, sizes=None, variants=None, seed=0):
+    """在 output_dir 中生成图片集，已存在的文件不重新生成
+
+    参数:
+        output_dir: 输出目录
+        sizes: (宽, 高) 列表，默认为 DEFAULT_SIZES
+        variants: VARIANTS 中的名称列表，默认全部
+        seed: 随机种子
+    返回:
+        [(变体名称, (宽, 高), 文件路径)]
+    """
+    sizes = sizes or [parse_dimensions(size) for size in DEFAULT_SIZES]
+    selected = [v for v in VARIANTS if variants is None or v[0] in variants]
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = []
+    for width, height in sizes:
+        photo = None
+        for name, image_format, ext, mode in selected:
+            path = os.path.join(output_dir, f"{name}_{width}x{height}_{seed}{ext}")
+            if not os.path.exists(path):
+                if photo is None:
+                    photo = make_photo(width, height, seed)
+                make_variant(photo, mode).save(path, image_format)
+            files.append((name, (width, height), path))
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description='生成确定性的合成测试图片集')
+    parser.add_argument('--output_dir', required=True, help='输出目录')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='图片尺寸，格式为 宽x高')
+    parser.add_argument('--variants', nargs='+', choices=[v[0] for v in VARIANTS], help='要生成的格式和模式组合，默认全部')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    files = generate(args.output_dir, [parse_dimensions(size) for size in args.sizes], args.variants, args.seed)
+    # 水印图片放在子目录中，不会被当作输入图片处理
+    os.makedirs(os.path.join(args.output_dir, 'marks'), exist_ok=True)
+    make_logo(os.path.join(args.output_dir, 'marks', 'logo.png'))
+    print(f"已生成 {len(files)} 张测试图片和水印图片 marks/logo.png: {args.output_dir}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,365 +2,281 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import argparse
-from PIL import Image, ImageDraw, ImageFont
+from watermark_fonts import resolve_font
+from watermark_files import parse_size, iter_tasks, output_path_for, SharedStems
+from watermark_encode import PROFILES, OUTPUT_FORMATS, Encoder
+from watermark_state import MANIFEST_NAME, JOURNAL_NAME, Manifest, Journal, settings_fingerprint
+from watermark_metrics import RunMetrics
+# 水印处理的核心函数在 watermark_core 中，这里继续导出，原有的 from watermark import ... 不受影响
+from watermark_core import draw_rounded_rectangle, apply_opacity, rounded_corner_mask, render_text_sprite
+from watermark_core import PreparedCache, WatermarkPlan, TextWatermarkPlan, make_plan
+from watermark_core import calculate_position, background_rect, clip_region, composite_region, paste_sprite, paste_watermark
+from watermark_core import working_mode, open_image, estimate_memory, set_max_pixels, atomic_write, save_image, encode_image
+from watermark_core import watermark_image, watermark_bytes, watermark_file, add_text_watermark, add_watermark
 
-def draw_rounded_rectangle(draw, rect, color, radius):
-    """绘制圆角矩形
+def process_directory(input_dir, output_dir, watermark_path=None, position='bottom-right', margins=20, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, workers=1, font_path=None, recursive=False, include=None, exclude=None, min_size=None, max_size=None, incremental=False, resume=False, encoder=None, io_threads=0, memory_limit=None, max_pixels=None, report_path=None, prometheus_path=None, watch=False, settle=1.0, poll_interval=None, distributed=False, queue_dir=None, lease=300, chunk_size=500, node_id=None):
+    """批量处理目录下的所有图片
 
-    参数:
-        draw: ImageDraw对象
-        rect: 矩形区域 (left, top, right, bottom)
-        color: 填充颜色，RGBA格式
-        radius: 圆角半径
+    workers 为并行进程数，1表示在当前进程中顺序处理，0表示使用全部CPU核心。
+    recursive、include、exclude、min_size、max_size 为文件查找条件（见 watermark_files.iter_images），
+    递归处理时在输出目录中保持相同的子目录结构。
+    incremental 为True时跳过源文件和水印设置都未变化、且输出已存在的图片。
+    处理结果记录在输出目录的日志中，resume 为True时跳过日志中已完成的图片，从中断处继续。
+    encoder 为可选的Encoder，指定输出格式时输出文件使用该格式的扩展名。
+    io_threads 大于0时使用分阶段流水线，由 io_threads 个线程预读和写出文件，与计算重叠。
+    memory_limit 为并行处理时同时处理的图片估计内存之和的上限（字节），None为物理内存的一半，0表示不限制；
+    max_pixels 为Pillow的解压炸弹保护阈值（像素数），0表示不限制，None保持Pillow默认值。
+    report_path 或 prometheus_path 指定时按阶段计时，结束后写出JSON报告或Prometheus textfile。
+    watch 为True时处理完已有的图片后继续监视输入目录，新增或修改的图片在 settle 秒内不再变化后
+    立即处理，直到按 Ctrl+C；poll_interval 指定时每隔该秒数扫描一次目录，否则优先使用inotify。
+    distributed 为True时作为一个节点参与共享队列（见 watermark_queue），多个节点处理同一个共享目录，
+    每个节点领取 chunk_size 张图片的任务块，租约超过 lease 秒未更新的任务块由其他节点重新处理；
+    queue_dir 默认为输出目录中的 .watermark-queue，node_id 默认为 主机名-进程号。
     """
-    # 限制半径大小，避免超出矩形尺寸
-    x0, y0, x1, y1 = rect
-    width, height = x1 - x0, y1 - y0
-    radius = min(radius, min(width, height) // 2)
+    from watermark_batch import run_batch, run_pipeline, default_memory_limit, resolve_workers, create_executor, BatchControl, cancel_on_signals
+    from watermark_archive import is_archive, process_archive
     
-    # 如果半径为0，直接绘制矩形
-    if radius <= 0:
-        draw.rectangle(rect, fill=color)
+    # 输入或输出为压缩包时在内存中逐个处理，不解压到磁盘
+    archive_output = is_archive(output_dir)
+    archive_mode = archive_output or is_archive(input_dir)
+    
+    # 确保输出目录存在
+    if archive_output:
+        os.makedirs(os.path.dirname(os.path.abspath(output_dir)), exist_ok=True)
+    elif not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # 水印在整个批次中只准备一次
+    try:
+        plan = make_plan(watermark_path, scale, text, font_size, font_color, bg_color, corner_radius, font_path)
+    except Exception as e:
+        print(f"无法准备水印: {e}")
         return
     
-    # 绘制圆角矩形
-    # 绘制中间矩形
-    draw.rectangle((x0, y0 + radius, x1, y1 - radius), fill=color)
-    draw.rectangle((x0 + radius, y0, x1 - radius, y1), fill=color)
+    options = {
+        'watermark_path': watermark_path,
+        'position': position,
+        'margins': margins,
+        'scale': scale,
+        'text': text,
+        'font_size': font_size,
+        'font_color': font_color,
+        'bg_color': bg_color,
+        'corner_radius': corner_radius,
+        'font_path': font_path,
+        'encoder': encoder
+    }
     
-    # 绘制四个圆角
-    # 左上角
-    draw.pieslice((x0, y0, x0 + radius * 2, y0 + radius * 2), 180, 270, fill=color)
-    # 右上角
-    draw.pieslice((x1 - radius * 2, y0, x1, y0 + radius * 2), 270, 0, fill=color)
-    # 左下角
-    draw.pieslice((x0, y1 - radius * 2, x0 + radius * 2, y1), 90, 180, fill=color)
-    # 右下角
-    draw.pieslice((x1 - radius * 2, y1 - radius * 2, x1, y1), 0, 90, fill=color)
-
-def add_text_watermark(input_path, output_path, text, font_size=40, font_color=(255, 255, 255, 128), position='bottom-right', margins=20, scale=0.2, bg_color=(0, 0, 0, 0), corner_radius=0):
-    """
-    给图片添加文字水印
+    # 分阶段计时只在需要报告时开启
+    metrics = RunMetrics() if report_path or prometheus_path else None
+    resumed = 0
+    skipped = 0
     
-    参数：
-        input_path: 输入图片路径
-        output_path: 输出图片路径
-        text: 水印文字内容
-        font_size: 字体大小
-        font_color: 字体颜色，RGBA格式
-        position: 水印位置，可选值：'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'
-        margins: 水印边距，可以是整数（所有边距相同）或字典（指定不同方向的边距）
-        scale: 水印缩放比例，0-1之间的小数
-        bg_color: 水印背景颜色，RGBA格式
-        corner_radius: 背景矩形的圆角半径（像素）
-    """
-    try:
-        # 打开原始图片
-        image = Image.open(input_path).convert('RGBA')
-        width, height = image.size
-        
-        # 创建透明图层用于绘制文字
-        txt = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(txt)
-        
-        # 尝试获取默认字体
-        try:
-            # 尝试加载系统字体
-            system_fonts = [
-                # macOS 常见中文字体
-                '/System/Library/Fonts/PingFang.ttc',
-                '/Library/Fonts/Arial Unicode.ttf',
-                # Windows 常见中文字体
-                'C:\\Windows\\Fonts\\simhei.ttf',
-                'C:\\Windows\\Fonts\\msyh.ttc',
-                # Linux 常见中文字体
-                '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',
-                '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc'
-            ]
-            
-            font = None
-            for font_path in system_fonts:
-                if os.path.exists(font_path):
-                    font = ImageFont.truetype(font_path, font_size)
-                    break
-                    
-            if font is None:
-                # 如果找不到系统字体，使用PIL默认字体
-                font = ImageFont.load_default()
-        except Exception:
-            # 使用默认字体
-            font = ImageFont.load_default()
+    def finish(total, successful):
+        # 打印统计信息
+        print(f"\n处理完成！")
+        print(f"总计图片: {total}")
+        print(f"成功处理: {successful}")
+        print(f"失败数量: {total - successful}")
+        if resume:
+            print(f"断点续传跳过: {resumed}")
+        if incremental:
+            print(f"跳过未变化: {skipped}")
+        print(f"水印缓存命中率: {plan.stats_text()}")
+        print(f"处理后的图片保存在: {output_dir}")
         
-        # 计算文字大小
-        text_width, text_height = draw.textsize(text, font=font) if hasattr(draw, 'textsize') else font.getsize(text)
+        if metrics is not None:
+            metrics.finish(plan)
+            metrics.print_summary()
+            if report_path:
+                metrics.write_report(report_path, {'input_dir': input_dir, 'output_dir': output_dir,
+                                                   'workers': workers, 'io_threads': io_threads,
+                                                   'skipped_unchanged': skipped, 'skipped_resumed': resumed})
+                print(f"运行报告已保存: {report_path}")
+            if prometheus_path:
+                metrics.write_prometheus(prometheus_path)
+                print(f"Prometheus指标已保存: {prometheus_path}")
+    
+    if memory_limit is None:
+        memory_limit = default_memory_limit()
+    
+    if archive_mode:
+        ignored = [flag for flag, enabled in (('--incremental', incremental), ('--resume', resume), ('--watch', watch),
+                                              ('--io_threads', io_threads > 0), ('--distributed', distributed)) if enabled]
+        if ignored:
+            print(f"警告: 输入或输出为压缩包时不支持 {', '.join(ignored)}，已忽略")
+            incremental = resume = False
+        filters = {'recursive': recursive, 'include': include, 'exclude': exclude,
+                   'min_size': min_size, 'max_size': max_size}
+        finish(*process_archive(input_dir, output_dir, options, plan, workers, filters, max_pixels, metrics, memory_limit))
+        return
+    
+    if distributed:
+        from watermark_queue import run_node
+        ignored = [flag for flag, enabled in (('--incremental', incremental), ('--resume', resume), ('--watch', watch)) if enabled]
+        if ignored:
+            print(f"警告: 分布式处理时不支持 {', '.join(ignored)}，已忽略（队列本身记录已完成的任务块，重新运行即可继续）")
+            incremental = resume = False
+        # 各节点上的挂载路径可能不同：水印图片比较内容，字体只比较文件名
+        shared_options = {key: value for key, value in options.items() if key not in ('watermark_path', 'font_path')}
+        shared_options['font'] = os.path.basename(font_path) if font_path else None
+        fingerprint = settings_fingerprint(shared_options, plan if watermark_path else None)
+        # 进程池在租约线程启动之前创建，所有任务块共用
+        executor = create_executor(options, plan, workers, max_pixels) if resolve_workers(workers) > 1 else None
         
-        # 根据缩放比例调整文字大小
-        adjusted_font_size = int(font_size * scale * width / text_width) if text_width > 0 else font_size
+        def run_chunk(tasks, control, on_result):
+            if io_threads > 0:
+                return run_pipeline(tasks, options, plan, workers, io_threads, on_result=on_result, memory_limit=memory_limit,
+                                    max_pixels=max_pixels, control=control, metrics=metrics, executor=executor)
+            return run_batch(tasks, options, plan, workers, on_result, memory_limit, max_pixels, control, metrics, executor)
         
-        # 重新加载字体
         try:
-            for font_path in system_fonts:
-                if os.path.exists(font_path):
-                    font = ImageFont.truetype(font_path, adjusted_font_size)
-                    break
-            if font is None:
-                font = ImageFont.load_default()
-        except Exception:
-            font = ImageFont.load_default()
-        
-        # 重新计算文字大小
-        text_width, text_height = draw.textsize(text, font=font) if hasattr(draw, 'textsize') else font.getsize(text)
-        
-        # 处理边距参数
-        margin_bottom = margin_right = margin_left = margin_top = 20
-        if isinstance(margins, dict):
-            margin_bottom = margins.get('bottom', 20)
-            margin_right = margins.get('right', 20)
-            margin_top = margins.get('top', 20)
-            margin_left = margins.get('left', 20)
-        elif isinstance(margins, int):
-            margin_bottom = margin_right = margin_top = margin_left = margins
-        
-        # 计算水印位置
-        if position == 'top-left':
-            position = (margin_left, margin_top)
-        elif position == 'top-right':
-            position = (width - text_width - margin_right, margin_top)
-        elif position == 'bottom-left':
-            position = (margin_left, height - text_height - margin_bottom)
-        elif position == 'bottom-right':
-            position = (width - text_width - margin_right, height - text_height - margin_bottom)
-        elif position == 'center':
-            position = ((width - text_width) // 2, (height - text_height) // 2)
-        else:
-            position = (width - text_width - margin_right, height - text_height - margin_bottom)  # 默认右下角
-        
-        # 如果设置了背景色
-        if bg_color[3] > 0:  # 如果不是完全透明
-            # 创建背景矩形
-            rect_padding = 10  # 文字周围的内边距
-            rect_position = (
-                position[0] - rect_padding,
-                position[1] - rect_padding,
-                position[0] + text_width + rect_padding,
-                position[1] + text_height + rect_padding
-            )
-            
-            # 根据是否设置圆角决定绘制方式
-            if corner_radius > 0:
-                draw_rounded_rectangle(draw, rect_position, bg_color, corner_radius)
-            else:
-                draw.rectangle(rect_position, fill=bg_color)
-        
-        # 绘制文字
-        draw.text(position, text, font=font, fill=font_color)
-        
-        # 合并图层
-        result = Image.alpha_composite(image, txt)
-        
-        # 如果原图是RGB模式（没有透明通道），转回RGB模式
-        if Image.open(input_path).mode == 'RGB':
-            result = result.convert('RGB')
-        
-        # 保存结果
-        result.save(output_path)
-        print(f"已添加文字水印: {os.path.basename(input_path)} -> {os.path.basename(output_path)}")
-        return True
-    except Exception as e:
-        print(f"处理 {input_path} 时出错: {e}")
-        return False
-
-def add_watermark(input_path, output_path, watermark_path, position='bottom-right', margins=20, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0):
-    """
-    给图片添加水印
+            result = run_node(input_dir, output_dir, run_chunk, fingerprint,
+                              {'recursive': recursive, 'include': include, 'exclude': exclude,
+                               'min_size': min_size, 'max_size': max_size},
+                              encoder.extension if encoder is not None else None,
+                              queue_dir, lease, chunk_size, node_id)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        finish(*result)
+        return
     
-    参数：
-        input_path: 输入图片路径
-        output_path: 输出图片路径
-        watermark_path: 水印图片路径
-        position: 水印位置，可选值：'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'
-        margins: 水印边距，可以是整数（所有边距相同）或字典（指定不同方向的边距）
-        scale: 水印缩放比例，0-1之间的小数
-        text: 文字水印内容，如果指定则使用文字水印，忽略watermark_path
-        font_size: 字体大小
-        font_color: 字体颜色，RGBA格式
-        bg_color: 水印背景颜色，RGBA格式
-        corner_radius: 背景矩形的圆角半径（像素）
-    """
-    # 如果提供了文本，使用文字水印
-    if text:
-        return add_text_watermark(input_path, output_path, text, font_size, font_color, position, margins, scale, bg_color, corner_radius)
+    # 边查找边处理图片
+    tasks = iter_tasks(input_dir, output_dir, recursive=recursive, include=include, exclude=exclude,
+                       min_size=min_size, max_size=max_size,
+                       output_ext=encoder.extension if encoder is not None else None)
     
-    try:
-        # 打开原始图片
-        image = Image.open(input_path).convert('RGBA')
+    # 断点续传：跳过日志中已完成的图片
+    journal = Journal(os.path.join(output_dir, JOURNAL_NAME), resume=resume)
+    if resume:
+        def pending_tasks(tasks):
+            nonlocal resumed
+            for input_path, output_path in tasks:
+                if journal.is_done(input_path, output_path):
+                    resumed += 1
+                    continue
+                yield input_path, output_path
         
-        # 打开水印图片
-        watermark = Image.open(watermark_path).convert('RGBA')
-        
-        # 计算水印的新尺寸
-        width, height = image.size
-        watermark_width, watermark_height = watermark.size
-        new_width = int(width * scale)
-        new_height = int(watermark_height * (new_width / watermark_width))
-        
-        # 调整水印大小
-        watermark = watermark.resize((new_width, new_height), Image.LANCZOS)
-        
-        # 处理边距参数
-        margin_bottom = margin_right = margin_left = margin_top = 20
-        if isinstance(margins, dict):
-            margin_bottom = margins.get('bottom', 20)
-            margin_right = margins.get('right', 20)
-            margin_top = margins.get('top', 20)
-            margin_left = margins.get('left', 20)
-        elif isinstance(margins, int):
-            margin_bottom = margin_right = margin_top = margin_left = margins
-        
-        # 计算水印位置
-        if position == 'top-left':
-            position = (margin_left, margin_top)
-        elif position == 'top-right':
-            position = (width - new_width - margin_right, margin_top)
-        elif position == 'bottom-left':
-            position = (margin_left, height - new_height - margin_bottom)
-        elif position == 'bottom-right':
-            position = (width - new_width - margin_right, height - new_height - margin_bottom)
-        elif position == 'center':
-            position = ((width - new_width) // 2, (height - new_height) // 2)
-        else:
-            position = (width - new_width - margin_right, height - new_height - margin_bottom)  # 默认右下角
-        
-        # 创建透明图层
-        transparent = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        
-        # 调整水印图片的透明度
-        if font_color[3] < 255:  # 使用font_color的透明度作为水印图片的透明度
-            # 创建新的水印图片，应用透明度
-            watermark_with_opacity = Image.new('RGBA', watermark.size, (0, 0, 0, 0))
-            for x in range(watermark.width):
-                for y in range(watermark.height):
-                    r, g, b, a = watermark.getpixel((x, y))
-                    # 应用新的透明度，保持原图像的透明度比例
-                    new_a = int(a * font_color[3] / 255)
-                    watermark_with_opacity.putpixel((x, y), (r, g, b, new_a))
-            watermark = watermark_with_opacity
-        
-        # 如果设置了背景色
-        if bg_color[3] > 0:  # 如果不是完全透明
-            # 创建一个新的图层用于绘制背景
-            bg_layer = Image.new('RGBA', image.size, (0, 0, 0, 0))
-            draw = ImageDraw.Draw(bg_layer)
-            
-            # 绘制背景矩形
-            rect_padding = 10  # 水印周围的内边距
-            rect_position = (
-                position[0] - rect_padding,
-                position[1] - rect_padding,
-                position[0] + new_width + rect_padding,
-                position[1] + new_height + rect_padding
-            )
-            
-            # 根据是否设置圆角决定绘制方式
-            if corner_radius > 0:
-                draw_rounded_rectangle(draw, rect_position, bg_color, corner_radius)
-            else:
-                draw.rectangle(rect_position, fill=bg_color)
-            
-            # 将背景层合并到透明层
-            transparent = Image.alpha_composite(transparent, bg_layer)
-        # 如果设置了圆角但背景是透明的，可以为水印图片添加圆角效果
-        elif corner_radius > 0:
-            # 创建一个与水印大小相同的黑色背景和透明蒙版
-            mask = Image.new('L', (new_width, new_height), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            
-            # 在蒙版上绘制圆角矩形
-            rect_position = (0, 0, new_width, new_height)
-            if corner_radius > min(new_width, new_height) // 2:
-                corner_radius = min(new_width, new_height) // 2
-                
-            # 绘制圆角矩形蒙版
-            if corner_radius > 0:
-                # 绘制中间矩形
-                mask_draw.rectangle((corner_radius, 0, new_width - corner_radius, new_height), fill=255)
-                mask_draw.rectangle((0, corner_radius, new_width, new_height - corner_radius), fill=255)
-                
-                # 绘制四个圆角
-                mask_draw.pieslice((0, 0, corner_radius * 2, corner_radius * 2), 180, 270, fill=255)
-                mask_draw.pieslice((new_width - corner_radius * 2, 0, new_width, corner_radius * 2), 270, 0, fill=255)
-                mask_draw.pieslice((0, new_height - corner_radius * 2, corner_radius * 2, new_height), 90, 180, fill=255)
-                mask_draw.pieslice((new_width - corner_radius * 2, new_height - corner_radius * 2, new_width, new_height), 0, 90, fill=255)
-            
-            # 将蒙版应用到水印图片
-            watermark.putalpha(mask)
-        
-        # 将水印粘贴到透明层
-        transparent.paste(watermark, position, watermark)
-        
-        # 合并图层
-        result = Image.alpha_composite(image, transparent)
+        tasks = pending_tasks(tasks)
+    
+    # 增量模式：根据清单跳过未变化的图片，处理成功后记录到清单
+    manifest = None
+    if incremental:
+        manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+        fingerprint = settings_fingerprint(options, plan)
+        # 检查时读取的源文件状态，处理成功后直接写入清单
+        source_states = {}
         
-        # 如果原图是RGB模式（没有透明通道），转回RGB模式
-        if Image.open(input_path).mode == 'RGB':
-            result = result.convert('RGB')
+        def changed_tasks(tasks):
+            nonlocal skipped
+            for input_path, output_path in tasks:
+                current, state = manifest.check(input_path, output_path, fingerprint)
+                if current:
+                    skipped += 1
+                    continue
+                if state is not None:
+                    source_states[input_path] = state
+                yield input_path, output_path
         
-        # 保存结果
-        result.save(output_path)
-        print(f"已添加水印: {os.path.basename(input_path)} -> {os.path.basename(output_path)}")
-        return True
-    except Exception as e:
-        print(f"处理 {input_path} 时出错: {e}")
-        return False
-
-def process_directory(input_dir, output_dir, watermark_path=None, position='bottom-right', margins=20, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0):
-    """批量处理目录下的所有图片"""
-    # 确保输出目录存在
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        tasks = changed_tasks(tasks)
     
-    # 支持的图片格式
-    image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp']
+    def on_result(input_path, output_path, ok):
+        journal.record(input_path, output_path, ok)
+        if manifest is not None:
+            state = source_states.pop(input_path, None)
+            if ok and state is not None:
+                manifest.record(input_path, fingerprint, state)
     
-    # 统计信息
-    total = 0
-    successful = 0
+    # Ctrl+C 和 SIGTERM 都只取消处理：已开始的图片处理完，之后照常打印统计、写出清单和报告
+    control = BatchControl()
     
-    # 遍历输入目录中的所有文件
-    for filename in os.listdir(input_dir):
-        input_path = os.path.join(input_dir, filename)
-        
-        # 跳过目录和不支持的文件格式
-        if os.path.isdir(input_path):
-            continue
-        
-        ext = os.path.splitext(filename)[1].lower()
-        if ext not in image_extensions:
-            continue
-        
-        total += 1
-        output_path = os.path.join(output_dir, filename)
+    filters = {'recursive': recursive, 'include': include, 'exclude': exclude}
+    watcher = None
+    executor = None
+    if watch:
+        from watermark_watch import create_watcher
+        # 先开始监视再处理已有的图片，处理期间写入的图片不会遗漏
+        watcher = create_watcher(input_dir, skip_dirs=[output_dir], poll_interval=poll_interval, **filters)
+        # 监视期间一直使用同一个进程池，子进程中准备好的水印保持可用
+        if resolve_workers(workers) > 1:
+            executor = create_executor(options, plan, workers, max_pixels)
+    
+    def run(tasks):
+        if io_threads > 0:
+            return run_pipeline(tasks, options, plan, workers, io_threads, on_result=on_result, memory_limit=memory_limit,
+                                max_pixels=max_pixels, control=control, metrics=metrics, executor=executor)
+        return run_batch(tasks, options, plan, workers, on_result, memory_limit, max_pixels, control, metrics, executor)
+    
+    try:
+        # 监视模式下从处理已有的图片开始
+        with cancel_on_signals(control):
+            total, successful = run(tasks)
+        if control.cancelled and not watch:
+            print("\n已取消，尚未开始处理的图片没有处理")
         
-        # 添加水印
-        if add_watermark(input_path, output_path, watermark_path, position, margins, scale, text, font_size, font_color, bg_color, corner_radius):
-            successful += 1
+        if watch:
+            from watermark_watch import watch_directory
+            output_ext = encoder.extension if encoder is not None else None
+            
+            def process_ready(ready):
+                # 写入完成的图片与已有的图片使用相同的过滤条件、增量检查和处理引擎
+                ready_tasks = []
+                # 每批重新列出目录，新增的同名图片会改变输出文件名
+                shared_stems = SharedStems(input_dir) if output_ext else None
+                for input_path, rel_path in ready:
+                    try:
+                        size = os.path.getsize(input_path)
+                    except OSError:
+                        continue
+                    if (min_size is not None and size < min_size) or (max_size is not None and size > max_size):
+                        continue
+                    output_path = output_path_for(output_dir, rel_path, output_ext, shared_stems)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    ready_tasks.append((input_path, output_path))
+                if incremental:
+                    ready_tasks = list(changed_tasks(ready_tasks))
+                result = run(ready_tasks)
+                # 空闲时日志和清单不会再被触发写入，每批处理完立即落盘
+                journal.flush()
+                if manifest is not None:
+                    manifest.commit()
+                return result
+            watched_total, watched_successful = watch_directory(watcher, process_ready, control, settle)
+            total += watched_total
+            successful += watched_successful
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if executor is not None:
+            executor.shutdown(wait=True)
+        journal.close()
+        if manifest is not None:
+            manifest.close()
     
-    # 打印统计信息
-    print(f"\n处理完成！")
-    print(f"总计图片: {total}")
-    print(f"成功处理: {successful}")
-    print(f"失败数量: {total - successful}")
-    print(f"处理后的图片保存在: {output_dir}")
+    finish(total, successful)
 
 def main():
+    # python watermark.py serve ... 启动本地水印服务，参数见 watermark_server.py
+    if sys.argv[1:2] == ['serve']:
+        from watermark_server import main as serve
+        return serve(sys.argv[2:])
+    
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='批量给图片添加水印')
-    parser.add_argument('--input_dir', required=True, help='输入图片文件夹路径')
-    parser.add_argument('--output_dir', required=True, help='输出图片文件夹路径')
+    parser.add_argument('--input_dir', '--input', dest='input_dir', required=True,
+                        help='输入图片文件夹，或zip/tar压缩包（直接在内存中读取，不解压到磁盘）')
+    parser.add_argument('--output_dir', '--output', dest='output_dir', required=True,
+                        help='输出图片文件夹，或以 .zip/.tar/.tar.gz 等结尾的压缩包路径')
     parser.add_argument('--watermark', help='水印图片路径')
     parser.add_argument('--text', help='文字水印内容')
     parser.add_argument('--font_size', type=int, default=40, help='文字水印字体大小')
+    parser.add_argument('--font', help='文字水印字体，可以是字体文件路径、文件名或字体族名，默认自动选择')
     parser.add_argument('--position', default='bottom-right', 
                         choices=['top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'],
                         help='水印位置')
@@ -370,6 +286,39 @@ def main():
     parser.add_argument('--opacity', type=int, default=128, help='水印透明度（0-255）')
     parser.add_argument('--bg_color', default='#000000', help='水印背景颜色（十六进制，如#FF0000）')
     parser.add_argument('--corner_radius', type=int, default=0, help='背景矩形的圆角半径（像素）')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理的进程数，0表示使用全部CPU核心')
+    parser.add_argument('--io_threads', type=int, default=0,
+                        help='读写文件的线程数，大于0时读取、计算、写入分阶段重叠进行，适合网络存储；默认0为逐张顺序读写')
+    parser.add_argument('--memory_limit', type=parse_size,
+                        help='并行处理时同时处理的图片估计内存之和的上限，支持K/M/G后缀，默认为物理内存的一半，0表示不限制')
+    parser.add_argument('--max_pixels', type=int,
+                        help='单张图片的最大像素数（Pillow解压炸弹保护），超过两倍时该图片处理失败，0表示不限制')
+    parser.add_argument('--recursive', action='store_true', help='递归处理子文件夹，输出时保持相同的目录结构')
+    parser.add_argument('--include', action='append', help='只处理匹配的文件（glob规则，如 "*.jpg" 或 "2024/*/*.png"），可重复指定')
+    parser.add_argument('--exclude', action='append', help='排除匹配的文件或文件夹（glob规则），可重复指定')
+    parser.add_argument('--min_size', type=parse_size, help='只处理不小于该大小的文件，支持K/M/G后缀')
+    parser.add_argument('--max_size', type=parse_size, help='只处理不大于该大小的文件，支持K/M/G后缀')
+    parser.add_argument('--incremental', action='store_true', help='增量处理：跳过源文件和水印设置都未变化、且输出已存在的图片')
+    parser.add_argument('--resume', action='store_true', help='从上次中断处继续：跳过处理日志中已完成的图片')
+    parser.add_argument('--output_format', choices=sorted(OUTPUT_FORMATS), help='把输出统一转换为指定格式，默认保持原格式')
+    parser.add_argument('--profile', default='default', choices=list(PROFILES),
+                        help='编码配置：default 为Pillow默认参数，fast 最快，small 文件最小，balanced 折中，quality 画质优先')
+    parser.add_argument('--quality', type=int, help='JPEG/WebP 输出质量（1-100），覆盖编码配置中的质量')
+    parser.add_argument('--lossless', action='store_true', help='WebP 输出使用无损编码')
+    parser.add_argument('--max_bytes', type=parse_size, help='输出文件大小上限，支持K/M/G后缀；JPEG/WebP 自动选择不超过上限的最高质量')
+    parser.add_argument('--report', help='按阶段计时，结束后把运行报告（各阶段分位数、最慢的文件、缓存命中率、峰值内存）写入该JSON文件')
+    parser.add_argument('--prometheus', help='按阶段计时，结束后把指标写入该Prometheus textfile')
+    parser.add_argument('--watch', action='store_true', help='处理完已有的图片后继续监视输入目录，自动处理新增或修改的图片，按 Ctrl+C 停止')
+    parser.add_argument('--settle', type=float, default=1.0, help='监视模式下文件大小和修改时间保持不变多少秒后认为写入完成')
+    parser.add_argument('--poll_interval', type=float,
+                        help='监视模式下每隔该秒数扫描一次输入目录，不使用inotify（输入目录位于网络文件系统时使用）')
+    parser.add_argument('--distributed', action='store_true',
+                        help='分布式处理：多个节点使用相同的参数处理同一个共享目录，通过共享文件系统上的任务队列分工；'
+                             '有失败图片的任务块也标记为已完成，重新运行不会重试，需删除队列中 done 下对应的文件')
+    parser.add_argument('--queue_dir', help='分布式处理的队列目录，所有节点必须相同，默认为输出目录中的 .watermark-queue')
+    parser.add_argument('--lease', type=float, default=300, help='分布式处理时任务块租约的时长（秒），节点超过该时间没有响应时任务块由其他节点重新处理')
+    parser.add_argument('--chunk_size', type=int, default=500, help='分布式处理时每个任务块的图片数')
+    parser.add_argument('--node_id', help='分布式处理时本节点的名称，默认为 主机名-进程号')
     
     args = parser.parse_args()
     
@@ -386,6 +335,25 @@ def main():
         print(f"错误: 水印图片 '{args.watermark}' 不存在")
         return
     
+    # 解析字体，之后所有进程直接使用字体文件路径
+    if args.text and args.font:
+        try:
+            args.font = resolve_font(args.font, args.text)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return
+    
+    # 输出格式与编码参数
+    try:
+        encoder = Encoder(args.profile, args.output_format, args.quality, args.lossless, args.max_bytes)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return
+    
+    if args.distributed and (args.lease <= 0 or args.chunk_size < 1):
+        print(f"错误: 租约时长和任务块大小必须大于0")
+        return
+    
     if args.scale <= 0 or args.scale > 1:
         print(f"警告: 缩放比例应在0-1之间，已自动调整为0.2")
         args.scale = 0.2
@@ -413,7 +381,12 @@ def main():
     # 处理图片
     process_directory(args.input_dir, args.output_dir, args.watermark,
                      args.position, margins, args.scale, args.text, args.font_size, 
-                     font_color, bg_color, args.corner_radius)
+                     font_color, bg_color, args.corner_radius, args.workers, args.font,
+                     args.recursive, args.include, args.exclude, args.min_size, args.max_size,
+                     args.incremental, args.resume, encoder, args.io_threads,
+                     args.memory_limit, args.max_pixels, args.report, args.prometheus,
+                     args.watch, args.settle, args.poll_interval, args.distributed,
+                     args.queue_dir, args.lease, args.chunk_size, args.node_id)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
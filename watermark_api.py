@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""在代码中使用的水印接口
+
+Watermarker 只配置一次水印设置并准备好水印素材，之后可以直接处理已解码的
+PIL图片、内存中的图片数据或文件，不需要写临时文件：
+
+    marker = Watermarker(watermark_path='logo.png', position='bottom-right', scale=0.2)
+    output = marker.apply_bytes(upload_data)
+
+同一个 Watermarker 可以在多个线程中共享。出错时抛出 WatermarkError 的子类，
+不打印任何信息。
+"""
+
+import io
+import os
+from PIL import Image
+
+from watermark_core import make_plan, working_mode, open_image, watermark_image, save_image
+from watermark_encode import OUTPUT_FORMATS, DEFAULT_ENCODER
+
+# 可选的水印位置
+POSITIONS = ('top-left', 'top-right', 'bottom-left', 'bottom-right', 'center')
+
+class WatermarkError(Exception):
+    """水印处理错误的基类"""
+
+class InvalidSettingsError(WatermarkError, ValueError):
+    """水印设置无效，例如缺少水印图片或文字、位置或缩放比例不合法"""
+
+class DecodeError(WatermarkError):
+    """无法读取或解码输入图片"""
+
+class ImageTooLargeError(DecodeError):
+    """输入图片的像素数超过Pillow的解压炸弹保护阈值"""
+
+class CompositeError(WatermarkError):
+    """无法在图片上合成水印"""
+
+class EncodeError(WatermarkError):
+    """无法编码或写出输出图片，例如无法确定输出格式或超出文件大小上限"""
+
+class Watermarker:
+    """配置一次、可重复使用的水印处理器
+
+    水印图片只读取一次，按原图尺寸缩放后的水印或渲染好的文字贴图缓存在内部，
+    多个线程可以同时调用同一个实例的方法。
+
+    参数:
+        watermark_path: 水印图片路径，使用文字水印时可以不指定
+        text: 文字水印内容，指定时使用文字水印
+        position: 水印位置，见 POSITIONS
+        margins: 水印边距，可以是整数（所有边距相同）或字典（指定不同方向的边距）
+        scale: 水印缩放比例（相对于原图宽度），0-1之间
+        font_size: 文字水印的基准字体大小
+        font_color: 字体颜色，RGBA格式，其透明度同时作为水印图片的透明度
+        bg_color: 水印背景颜色，RGBA格式
+        corner_radius: 背景矩形或图片水印的圆角半径（像素）
+        font_path: 文字水印使用的字体，默认自动选择系统字体
+        encoder: 可选的Encoder，决定输出格式和编码参数
+    """
+
+    def __init__(self, watermark_path=None, text=None, position='bottom-right', margins=20, scale=0.2, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, font_path=None, encoder=None):
+        if not text and not watermark_path:
+            raise InvalidSettingsError("必须指定水印图片路径或文字水印内容")
+        if position not in POSITIONS:
+            raise InvalidSettingsError(f"未知的水印位置: {position}")
+        if not 0 < scale <= 1:
+            raise InvalidSettingsError(f"缩放比例必须在0-1之间: {scale}")
+        if corner_radius < 0:
+            raise InvalidSettingsError(f"圆角半径必须大于或等于0: {corner_radius}")
+
+        self.position = position
+        self.margins = margins
+        self.bg_color = tuple(bg_color)
+        self.corner_radius = corner_radius
+        self.encoder = encoder or DEFAULT_ENCODER
+        try:
+            self.plan = make_plan(watermark_path, scale, text, font_size, tuple(font_color), self.bg_color,
+                                  corner_radius, font_path)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise InvalidSettingsError(f"无法准备水印: {e}") from e
+
+    def _decode(self, source):
+        """解码为工作模式的图片，返回 (图片, 原图格式)"""
+        try:
+            image = open_image(source)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(str(e)) from e
+        except (OSError, ValueError, SyntaxError) as e:
+            # Pillow对部分损坏的文件抛出 SyntaxError 或 ValueError
+            raise DecodeError(f"无法解码图片: {e}") from e
+        return image, image.format
+
+    def _composite(self, image):
+        try:
+            watermark_image(image, self.plan, self.position, self.margins, self.bg_color, self.corner_radius)
+        except (OSError, ValueError) as e:
+            raise CompositeError(f"无法合成水印: {e}") from e
+        return image
+
+    def apply(self, image):
+        """给已解码的PIL图片添加水印，返回新图片，不修改传入的图片"""
+        mode = working_mode(image)
+        try:
+            result = image.convert(mode) if image.mode != mode else image.copy()
+        except (OSError, ValueError) as e:
+            raise DecodeError(f"无法读取图片数据: {e}") from e
+        return self._composite(result)
+
+    def apply_bytes(self, data, output_format=None):
+        """给内存中的图片数据添加水印，返回编码后的数据
+
+        参数:
+            data: 图片文件的内容（bytes）
+            output_format: 输出的Pillow格式名（如 'JPEG'、'WEBP'），默认由 encoder
+                的输出格式决定，encoder 未指定输出格式时与输入格式相同
+        """
+        image, source_format = self._decode(io.BytesIO(data))
+        image = self._composite(image)
+        if output_format is None:
+            output_format = OUTPUT_FORMATS[self.encoder.output_format][0] if self.encoder.output_format else source_format
+        output_format = output_format.upper()
+        try:
+            buffer = io.BytesIO()
+            self.encoder.write(self.encoder.prepare(image, output_format), buffer, output_format)
+        except (OSError, ValueError, KeyError) as e:
+            raise EncodeError(f"无法编码为 {output_format}: {e}") from e
+        return buffer.getvalue()
+
+    def apply_file(self, input_path, output_path):
+        """给图片文件添加水印并原子地保存，输出格式由扩展名或 encoder 决定"""
+        image, _ = self._decode(input_path)
+        image = self._composite(image)
+        try:
+            save_image(image, output_path, self.encoder)
+        except (OSError, ValueError, KeyError) as e:
+            raise EncodeError(f"无法保存 {os.path.basename(output_path)}: {e}") from e
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""直接读写zip/tar压缩包，不解压到磁盘
+
+输入和输出都可以是文件夹或压缩包。压缩包中的图片逐个读入内存，
+添加水印后按完成顺序写入输出压缩包，同时在内存中的图片数量有上限，
+磁盘上不会出现解压后的原图或未压缩的结果。
+
+zip输出中JPEG、PNG、WebP、GIF等本身已压缩的格式直接存储，不再重复压缩；
+其他格式使用deflate压缩。tar输出的压缩方式由扩展名决定（.tar 不压缩，
+.tar.gz、.tar.bz2、.tar.xz 整体压缩）。tar输入以流的方式顺序读取，
+压缩包可以远大于内存。
+"""
+
+import io
+import os
+import time
+import tarfile
+import posixpath
+import zipfile
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from watermark_core import atomic_write, set_max_pixels
+from watermark_files import iter_images, is_image, is_excluded_dir, output_path_for, image_stems, SharedStems
+
+# 支持的压缩包扩展名 -> tarfile 写入模式（zip为None）
+ARCHIVE_EXTENSIONS = {
+    '.zip': None,
+    '.tar': 'w|',
+    '.tar.gz': 'w|gz',
+    '.tgz': 'w|gz',
+    '.tar.bz2': 'w|bz2',
+    '.tbz2': 'w|bz2',
+    '.tar.xz': 'w|xz',
+    '.txz': 'w|xz'
+}
+
+# zip输出中直接存储、不再压缩的格式
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+# 压缩包中不处理的目录：macOS打包时附带的资源分支
+_SKIPPED_DIRS = ('__MACOSX',)
+
+def archive_type(path):
+    """返回压缩包的扩展名（见 ARCHIVE_EXTENSIONS），不是压缩包时返回None"""
+    name = path.lower()
+    for ext in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(ext):
+            return ext
+    return None
+
+def is_archive(path):
+    """路径是否为压缩包（按扩展名判断，以压缩包扩展名结尾的文件夹不算）"""
+    return archive_type(path) is not None and not os.path.isdir(path)
+
+def _member_name(name, include=None, exclude=None):
+    """需要处理的压缩包成员的规范化名称，不需要处理时返回None
+
+    规则与文件夹相同，不处理隐藏目录中的文件和不安全的路径。
+    `tar czf x.tgz .` 打包的成员名以 ./ 开头，先规范化再判断。
+    """
+    if name.startswith('/'):
+        return None
+    name = posixpath.normpath(name)
+    parts = name.split('/')
+    if '..' in parts or name == '.':
+        return None
+    for i, part in enumerate(parts[:-1]):
+        if part in _SKIPPED_DIRS or is_excluded_dir('/'.join(parts[:i + 1]), exclude):
+            return None
+    # ._ 开头的是macOS的资源分支文件，扩展名与原图相同但不是图片
+    if parts[-1].startswith('._') or not is_image(name, include, exclude):
+        return None
+    return name
+
+def iter_sources(source, recursive=False, include=None, exclude=None, min_size=None, max_size=None, skip_dirs=None):
+    """逐个产出输入图片: (相对路径, 数据, 修改时间)
+
+    source 为文件夹时按 iter_images 的规则查找；为压缩包时包含所有子目录中的图片，
+    zip按目录顺序读取，tar以流的方式顺序读取。每次只有一张图片的数据在内存中。
+    """
+    def size_ok(size):
+        return (min_size is None or size >= min_size) and (max_size is None or size <= max_size)
+
+    if not is_archive(source):
+        for path, rel_path in iter_images(source, recursive, include, exclude, min_size, max_size, skip_dirs):
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                mtime = os.path.getmtime(path)
+            except OSError as e:
+                print(f"处理 {path} 时出错: {e}")
+                continue
+            yield rel_path, data, mtime
+        return
+
+    if archive_type(source) == '.zip':
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                name = None if info.is_dir() else _member_name(info.filename, include, exclude)
+                if name is None or not size_ok(info.file_size):
+                    continue
+                yield name, archive.read(info), time.mktime(info.date_time + (0, 0, -1))
+        return
+
+    with tarfile.open(source, 'r|*') as archive:
+        for member in archive:
+            name = _member_name(member.name, include, exclude) if member.isfile() else None
+            if name is None or not size_ok(member.size):
+                continue
+            yield name, archive.extractfile(member).read(), member.mtime
+
+def source_stems(source):
+    """输入中被多个图片共用的主干（见 watermark_files.output_path_for）
+
+    文件夹按目录列出；zip读取目录；tar需要先顺序读一遍成员头，只在转换输出格式时调用。
+    """
+    if not is_archive(source):
+        return SharedStems(source)
+    if archive_type(source) == '.zip':
+        with zipfile.ZipFile(source) as archive:
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    else:
+        with tarfile.open(source, 'r|*') as archive:
+            names = [member.name for member in archive if member.isfile()]
+    return image_stems(name for name in map(_member_name, names) if name is not None)
+
+class ZipSink:
+    """把结果写入zip压缩包，已压缩的图片格式直接存储"""
+
+    def __init__(self, f):
+        self.archive = zipfile.ZipFile(f, 'w', allowZip64=True)
+
+    def add(self, name, data, mtime):
+        # zip的时间不能早于1980年
+        info = zipfile.ZipInfo(name, time.localtime(max(mtime, 315619200))[:6])
+        stored = os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+        info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        self.archive.writestr(info, data)
+
+    def close(self):
+        self.archive.close()
+
+class TarSink:
+    """把结果以流的方式写入tar压缩包"""
+
+    def __init__(self, f, mode):
+        self.archive = tarfile.open(fileobj=f, mode=mode)
+
+    def add(self, name, data, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+class DirectorySink:
+    """把结果原子地写入输出文件夹，保持相对路径"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.created = set()
+
+    def add(self, name, data, mtime):
+        output_path = output_path_for(self.output_dir, name)
+        directory = os.path.dirname(output_path)
+        if directory not in self.created:
+            os.makedirs(directory, exist_ok=True)
+            self.created.add(directory)
+        atomic_write(output_path, lambda f: f.write(data))
+
+    def close(self):
+        pass
+
+def process_archive(source, destination, options, plan=None, workers=1, filters=None, max_pixels=None, metrics=None, memory_limit=None):
+    """处理压缩包或文件夹中的图片，结果写入压缩包或文件夹
+
+    参数:
+        source: 输入文件夹或压缩包
+        destination: 输出文件夹或压缩包（见 ARCHIVE_EXTENSIONS），压缩包先写入临时文件，完成后替换
+        options: 传给 watermark_bytes 的关键字参数（见 watermark_batch.run_batch）
+        plan: 水印计划，在所有图片间共享
+        workers: 进程数，1为当前进程顺序处理，0表示使用全部CPU核心
+        filters: iter_images 的过滤参数（recursive、include、exclude、min_size、max_size）
+        max_pixels: Pillow的解压炸弹保护阈值（像素数），0表示不限制，None保持默认值
+        metrics: 可选的RunMetrics，记录每张图片各阶段的耗时
+        memory_limit: 并行处理时同时在内存中的图片估计内存之和的上限（字节），None表示不限制
+    返回:
+        (total, successful)
+    """
+    from watermark_batch import resolve_workers, create_executor, MemoryBudget, _process_data
+
+    workers = resolve_workers(workers)
+    set_max_pixels(max_pixels)
+    filters = dict(filters or {})
+    encoder = options.get('encoder')
+    output_ext = encoder.extension if encoder is not None else None
+    label = '已添加文字水印' if options.get('text') else '已添加水印'
+    timed = metrics is not None
+    counts = [0, 0]
+
+    def run(sink):
+        mtimes = {}
+
+        def collect(result):
+            input_name, output_name, encoded, error, hits, misses, timings = result
+            counts[0] += 1
+            if encoded is not None:
+                start = time.perf_counter()
+                try:
+                    sink.add(output_name, encoded, mtimes.pop(input_name, time.time()))
+                except OSError as e:
+                    error = str(e)
+                if timed:
+                    metrics.add(input_name, 'write', time.perf_counter() - start)
+            if error is None:
+                counts[1] += 1
+                print(f"{label}: {os.path.basename(input_name)} -> {os.path.basename(output_name)}")
+            else:
+                mtimes.pop(input_name, None)
+                print(f"处理 {input_name} 时出错: {error}")
+            if plan is not None and workers > 1:
+                plan.hits += hits
+                plan.misses += misses
+            if timed:
+                metrics.record(input_name, error is None, timings)
+
+        sources = iter_sources(source, skip_dirs=[destination], **filters)
+        executor = create_executor(options, plan, workers, max_pixels) if workers > 1 else None
+        budget = MemoryBudget(memory_limit)
+        costs = {}
+        pending = set()
+
+        def collect_done(done):
+            for future in done:
+                budget.release(costs.pop(future))
+                collect(future.result())
+        try:
+            while True:
+                start = time.perf_counter()
+                item = next(sources, None)
+                if item is None:
+                    break
+                name, data, mtime = item
+                if timed:
+                    metrics.add(name, 'read', time.perf_counter() - start)
+                mtimes[name] = mtime
+                # 输出路径只用来确定输出格式和输出压缩包中的成员名
+                output_name = output_path_for('', name, output_ext, shared_stems).replace(os.sep, '/')
+                if executor is None:
+                    collect(_process_data(name, output_name, data, options, plan, timed))
+                    continue
+                # 同时在内存中的图片数不超过进程数的两倍、估计内存之和不超过预算，结果按完成顺序写入
+                cost = budget.cost(io.BytesIO(data))
+                while pending and (len(pending) >= workers * 2 or not budget.fits(cost)):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect_done(done)
+                budget.acquire(cost)
+                future = executor.submit(_process_data, name, output_name, data, timed=timed)
+                costs[future] = cost
+                pending.add(future)
+                del data
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect_done(done)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            sink.close()
+
+    shared_stems = source_stems(source) if output_ext else None
+    kind = archive_type(destination) if is_archive(destination) else None
+    if kind is None:
+        run(DirectorySink(destination))
+    elif kind == '.zip':
+        atomic_write(destination, lambda f: run(ZipSink(f)))
+    else:
+        atomic_write(destination, lambda f: run(TarSink(f, ARCHIVE_EXTENSIONS[kind])))
+    return counts[0], counts[1]
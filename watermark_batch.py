@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""批量水印处理引擎
+
+命令行的 process_directory 和图形界面的批量处理共用这里的调度逻辑：
+workers 为1时在当前进程中顺序处理，大于1时使用进程池并行处理。
+准备好的水印计划通过进程池的初始化函数在每个子进程中只传递一次，
+任务本身只携带输入输出路径。
+
+run_pipeline 把每张图片拆成读取、计算（解码、合成、编码）和写入三个阶段：
+I/O线程预读原始数据并写出编码结果，计算在当前线程或进程池中进行，
+阶段之间用有界队列限制同时在内存中的图片数量，读写延迟与计算重叠。
+
+两种方式都可以指定内存预算：提交任务前只读取文件头估计每张图片的峰值内存，
+已提交任务的估计值之和不超过预算。小图片可以同时处理很多张，超过预算的
+大图片等到其他任务全部完成后单独处理。
+"""
+
+import os
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+from collections import deque
+from contextlib import nullcontext, contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from watermark_core import add_watermark, watermark_bytes, atomic_write, estimate_memory, set_max_pixels
+
+# 子进程中的水印设置和水印计划，由 _init_worker 设置
+_worker_options = None
+_worker_plan = None
+
+def resolve_workers(workers):
+    """将workers参数转换为实际进程数，0或None表示使用全部CPU核心"""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+def safe_mp_context():
+    """不使用 fork 的多进程上下文：支持时使用 forkserver，否则使用 spawn
+
+    已有其他线程在运行的进程中 fork 出的子进程可能继承被持有的锁而死锁。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def default_memory_limit():
+    """默认内存预算：物理内存的一半，无法获取物理内存大小时不限制"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return None
+
+class MemoryBudget:
+    """正在处理的图片的内存预算
+
+    参数:
+        limit: 预算（字节），None或0表示不限制
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit or None
+        self.used = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+        # 等待预算的线程按到达顺序依次获得，避免大图片一直被后来的小图片插队
+        self._turn = threading.Lock()
+
+    def cost(self, input_path):
+        """估计一张图片的内存占用，超过预算的图片按整个预算计算，只能单独处理"""
+        if self.limit is None:
+            return 0
+        return min(estimate_memory(input_path), self.limit)
+
+    def fits(self, cost):
+        """当前是否可以再接纳占用 cost 字节的任务"""
+        return self.limit is None or self.used + cost <= self.limit
+
+    def acquire(self, cost):
+        """等待预算足够后占用 cost 字节"""
+        with self._turn, self._condition:
+            self._condition.wait_for(lambda: self.fits(cost))
+            self.used += cost
+            self.peak = max(self.peak, self.used)
+
+    def release(self, cost):
+        """任务完成后归还占用的预算"""
+        with self._condition:
+            self.used -= cost
+            self._condition.notify_all()
+
+class BatchControl:
+    """批量处理的暂停与取消，可以在其他线程中调用
+
+    暂停和取消都在两张图片之间生效：已经开始处理的图片会处理完，
+    取消后尚未开始的任务不再处理。
+    """
+
+    def __init__(self):
+        self._running = threading.Event()
+        self._running.set()
+        self.cancelled = False
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self._running.set()
+
+    def wait(self):
+        """暂停时阻塞，返回是否继续处理下一张图片"""
+        self._running.wait()
+        return not self.cancelled
+
+@contextmanager
+def cancel_on_signals(control):
+    """在主线程中使用时，期间收到 Ctrl+C 或 SIGTERM 取消 control，退出后恢复原来的处理函数
+
+    进程池的子进程忽略 Ctrl+C，使用进程池时应在此期间运行，否则 Ctrl+C 之后仍要
+    等待已提交和尚未读取的任务全部处理完。
+    """
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, lambda signum, frame: control.cancel())
+    try:
+        yield control
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+def _init_worker(options, plan, max_pixels=None):
+    """进程池初始化函数，每个子进程只执行一次"""
+    global _worker_options, _worker_plan
+    _worker_options = options
+    _worker_plan = plan
+    set_max_pixels(max_pixels)
+    # 终端中的 Ctrl+C 会发给整个进程组，由主进程决定取消还是退出，子进程处理完当前图片
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _process_task(input_path, output_path, options=None, plan=None, timed=False):
+    """处理单张图片，timed 为True时按阶段计时
+
+    返回:
+        (input_path, output_path, 是否成功, 缓存命中次数增量, 缓存未命中次数增量, 各阶段耗时或None)
+    """
+    if options is None:
+        options = _worker_options
+        plan = _worker_plan
+
+    hits = plan.hits if plan is not None else 0
+    misses = plan.misses if plan is not None else 0
+
+    timings = {} if timed else None
+    ok = add_watermark(input_path, output_path, plan=plan, timings=timings, **options)
+
+    if plan is None:
+        return input_path, output_path, ok, 0, 0, timings
+    return input_path, output_path, ok, plan.hits - hits, plan.misses - misses, timings
+
+def _process_data(input_path, output_path, data, options=None, plan=None, timed=False):
+    """流水线的计算阶段：解码、合成并编码一张图片，timed 为True时按阶段计时
+
+    返回:
+        (input_path, output_path, 编码后的数据或None, 错误信息, 缓存命中次数增量, 缓存未命中次数增量, 各阶段耗时或None)
+    """
+    if options is None:
+        options = _worker_options
+        plan = _worker_plan
+
+    hits = plan.hits if plan is not None else 0
+    misses = plan.misses if plan is not None else 0
+
+    timings = {} if timed else None
+    try:
+        encoded = watermark_bytes(data, output_path, plan=plan, timings=timings, **options)
+        error = None
+    except Exception as e:
+        encoded = None
+        error = str(e)
+
+    if plan is None:
+        return input_path, output_path, encoded, error, 0, 0, timings
+    return input_path, output_path, encoded, error, plan.hits - hits, plan.misses - misses, timings
+
+def create_executor(options, plan=None, workers=1, max_pixels=None, mp_context=None):
+    """创建并启动进程池，可以传给多次 run_batch 或 run_pipeline 调用
+
+    子进程只初始化一次，水印计划中缓存的缩放后水印在多次调用之间保留。
+    应在启动其他线程之前调用，见 run_pipeline 中的说明；无法保证时（例如图形界面）
+    传入 safe_mp_context() 作为 mp_context。
+    """
+    executor = ProcessPoolExecutor(max_workers=resolve_workers(workers), mp_context=mp_context,
+                                   initializer=_init_worker, initargs=(options, plan, max_pixels))
+    executor.submit(os.getpid).result()
+    return executor
+
+def run_batch(tasks, options, plan=None, workers=1, on_result=None, memory_limit=None, max_pixels=None, control=None, metrics=None, executor=None):
+    """批量处理图片
+
+    参数:
+        tasks: 可迭代的 (input_path, output_path) 任务
+        options: 传给 add_watermark 的关键字参数（不含 plan）
+        plan: 可选的WatermarkPlan，图片水印时在所有任务间共享
+        workers: 进程数，1为当前进程顺序处理，0表示使用全部CPU核心
+        on_result: 可选回调 on_result(input_path, output_path, ok)，按完成顺序调用
+        memory_limit: 同时处理的图片估计内存之和的上限（字节），None表示不限制
+        max_pixels: Pillow的解压炸弹保护阈值（像素数），0表示不限制，None保持默认值
+        control: 可选的BatchControl，用于暂停或取消
+        metrics: 可选的RunMetrics，记录每张图片各阶段的耗时
+        executor: 可选的由 create_executor 创建的进程池，workers 大于1时使用，处理完不关闭
+    返回:
+        (total, successful)，取消时只统计已处理的图片
+    """
+    workers = resolve_workers(workers)
+    set_max_pixels(max_pixels)
+    timed = metrics is not None
+    if timed:
+        tasks = metrics.timed_tasks(tasks)
+    total = 0
+    successful = 0
+
+    def collect(result):
+        nonlocal total, successful
+        input_path, output_path, ok, hits, misses, timings = result
+        total += 1
+        if ok:
+            successful += 1
+        # 汇总子进程的缓存统计
+        if plan is not None and workers > 1:
+            plan.hits += hits
+            plan.misses += misses
+        if timed:
+            metrics.record(input_path, ok, timings)
+        if on_result is not None:
+            on_result(input_path, output_path, ok)
+
+    if workers == 1:
+        for input_path, output_path in tasks:
+            if control is not None and not control.wait():
+                break
+            collect(_process_task(input_path, output_path, options, plan, timed))
+        return total, successful
+
+    # 限制同时提交的任务数，避免一次性为大批量任务创建过多Future
+    max_pending = workers * 4
+    budget = MemoryBudget(memory_limit)
+    submitted = {}
+    # 暂停时撤回的尚未开始的任务，继续后优先提交
+    backlog = deque()
+    tasks = iter(tasks)
+
+    def finish(done):
+        for future in done:
+            cost, _ = submitted.pop(future)
+            budget.release(cost)
+            if not future.cancelled():
+                collect(future.result())
+
+    # 传入的进程池由调用方关闭
+    if executor is None:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options, plan, max_pixels))
+    else:
+        pool = nullcontext(executor)
+    with pool as executor:
+        pending = set()
+        while True:
+            if control is not None and control.paused:
+                # 暂停：撤回尚未开始的任务，继续收集正在处理的图片的结果
+                for future in [future for future in pending if future.cancel()]:
+                    pending.discard(future)
+                    cost, task = submitted.pop(future)
+                    budget.release(cost)
+                    backlog.append(task)
+                while control.paused and pending:
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    finish(done)
+            if control is not None and not control.wait():
+                # 取消尚未开始的任务，正在处理的图片处理完
+                for future in pending:
+                    future.cancel()
+                break
+
+            task = backlog.popleft() if backlog else next(tasks, None)
+            if task is None:
+                break
+            input_path, output_path = task
+
+            # 等待已提交的任务完成，直到新任务不超过任务数上限和内存预算
+            cost = budget.cost(input_path)
+            while pending and (len(pending) >= max_pending or not budget.fits(cost)):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                finish(done)
+            budget.acquire(cost)
+            future = executor.submit(_process_task, input_path, output_path, timed=timed)
+            submitted[future] = (cost, task)
+            pending.add(future)
+
+        # 结果按完成顺序收集
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            finish(done)
+
+    return total, successful
+
+# 流水线各阶段之间传递的结束标记
+_DONE = object()
+
+def run_pipeline(tasks, options, plan=None, workers=1, io_threads=4, queue_size=None, on_result=None, memory_limit=None, max_pixels=None, control=None, metrics=None, executor=None):
+    """分阶段流水线批量处理图片，参数和返回值与 run_batch 相同
+
+    参数:
+        io_threads: 读取线程数和写入线程数（各 io_threads 个）
+        queue_size: 每个阶段之间最多排队的图片数，默认为计算进程数的两倍；
+            同时在内存中的图片数量约为两个队列的容量加上正在读写和计算的图片数
+        memory_limit: 从读取到写入完成之间所有图片估计内存之和的上限（字节）
+        executor: 可选的由 create_executor 创建的进程池，workers 大于1时使用，处理完不关闭
+    """
+    workers = resolve_workers(workers)
+    io_threads = max(1, int(io_threads))
+    queue_size = queue_size or workers * 2
+    text = options.get('text')
+    set_max_pixels(max_pixels)
+    timed = metrics is not None
+    if timed:
+        tasks = metrics.timed_tasks(tasks)
+
+    budget = MemoryBudget(memory_limit)
+    # 进程池中正在计算的图片数不超过进程数的两倍
+    slots = threading.BoundedSemaphore(workers * 2)
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    done_queue = queue.Queue()
+    task_lock = threading.Lock()
+    tasks = iter(tasks)
+
+    def reader():
+        """读取阶段：内存预算足够时预读输入文件的原始数据"""
+        while True:
+            with task_lock:
+                task = next(tasks, None) if control is None or control.wait() else None
+            if task is None:
+                read_queue.put(_DONE)
+                return
+            input_path, output_path = task
+            cost = budget.cost(input_path)
+            budget.acquire(cost)
+            start = time.perf_counter()
+            try:
+                with open(input_path, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                write_queue.put(((input_path, output_path, None, str(e), 0, 0, None), cost))
+                continue
+            if timed:
+                metrics.add(input_path, 'read', time.perf_counter() - start)
+            read_queue.put((input_path, output_path, data, cost))
+
+    def writer():
+        """写入阶段：原子地写出编码结果，之后归还内存预算"""
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                done_queue.put(_DONE)
+                return
+            (input_path, output_path, encoded, error, hits, misses, timings), cost = item
+            if encoded is not None:
+                start = time.perf_counter()
+                try:
+                    atomic_write(output_path, lambda f: f.write(encoded))
+                except OSError as e:
+                    error = str(e)
+                if timed:
+                    metrics.add(input_path, 'write', time.perf_counter() - start)
+            # 先释放编码结果再归还预算
+            del encoded, item
+            budget.release(cost)
+            done_queue.put((input_path, output_path, error, hits, misses, timings))
+
+    def computed(future, paths, cost):
+        """进程池任务完成后把结果交给写入阶段"""
+        try:
+            result = future.result()
+        except Exception as e:
+            result = (paths[0], paths[1], None, str(e), 0, 0, None)
+        write_queue.put((result, cost))
+        slots.release()
+
+    def compute():
+        """计算阶段：在当前线程或进程池中解码、合成和编码"""
+        finished_readers = 0
+        try:
+            while finished_readers < io_threads:
+                item = read_queue.get()
+                if item is _DONE:
+                    finished_readers += 1
+                    continue
+                input_path, output_path, data, cost = item
+                if executor is None:
+                    write_queue.put((_process_data(input_path, output_path, data, options, plan, timed), cost))
+                    continue
+                slots.acquire()
+                future = executor.submit(_process_data, input_path, output_path, data, timed=timed)
+                future.add_done_callback(
+                    lambda future, paths=(input_path, output_path), cost=cost: computed(future, paths, cost))
+        finally:
+            if executor is not None and own_executor:
+                executor.shutdown(wait=True)
+            elif executor is not None:
+                # 传入的进程池不关闭；取回全部名额时，所有任务的结果都已交给写入阶段
+                for _ in range(workers * 2):
+                    slots.acquire()
+            for _ in range(io_threads):
+                write_queue.put(_DONE)
+
+    own_executor = executor is None
+    if workers == 1:
+        executor = None
+    elif own_executor:
+        # 子进程在第一次提交任务时才fork，此时读取线程可能正持有导入锁等锁，
+        # 子进程会因继承了被持有的锁而死锁；在启动读写线程之前先创建好子进程
+        executor = create_executor(options, plan, workers, max_pixels)
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(io_threads)]
+    threads += [threading.Thread(target=writer, daemon=True) for _ in range(io_threads)]
+    threads.append(threading.Thread(target=compute, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    # 在调用线程中按完成顺序汇总结果和输出信息，on_result 不需要考虑线程安全
+    total = 0
+    successful = 0
+    finished_writers = 0
+    while finished_writers < io_threads:
+        result = done_queue.get()
+        if result is _DONE:
+            finished_writers += 1
+            continue
+        input_path, output_path, error, hits, misses, timings = result
+        ok = error is None
+        total += 1
+        if ok:
+            successful += 1
+            label = '已添加文字水印' if text else '已添加水印'
+            print(f"{label}: {os.path.basename(input_path)} -> {os.path.basename(output_path)}")
+        else:
+            print(f"处理 {input_path} 时出错: {error}")
+        if plan is not None and workers > 1:
+            plan.hits += hits
+            plan.misses += misses
+        if timed:
+            metrics.record(input_path, ok, timings)
+        if on_result is not None:
+            on_result(input_path, output_path, ok)
+
+    for thread in threads:
+        thread.join()
+    return total, successful
@@ -0,0 +1,709 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""水印处理的核心函数
+
+水印计划、位置计算、合成、编解码和原子写入。命令行入口 watermark.py、批量处理引擎、
+压缩包、服务和GUI都从这里导入，以脚本运行 watermark.py 时这些类也只定义一次。
+"""
+
+import io
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+from watermark_fonts import resolve_font, load_font, measure_text
+from watermark_encode import DEFAULT_ENCODER
+from watermark_metrics import StageClock
+
+def draw_rounded_rectangle(draw, rect, color, radius):
+    """绘制圆角矩形
+
+    参数:
+        draw: ImageDraw对象
+        rect: 矩形区域 (left, top, right, bottom)
+        color: 填充颜色，RGBA格式
+        radius: 圆角半径
+    """
+    # 限制半径大小，避免超出矩形尺寸
+    x0, y0, x1, y1 = rect
+    width, height = x1 - x0, y1 - y0
+    radius = min(radius, min(width, height) // 2)
+    
+    # 如果半径为0，直接绘制矩形
+    if radius <= 0:
+        draw.rectangle(rect, fill=color)
+        return
+    
+    # 绘制圆角矩形
+    # 绘制中间矩形
+    draw.rectangle((x0, y0 + radius, x1, y1 - radius), fill=color)
+    draw.rectangle((x0 + radius, y0, x1 - radius, y1), fill=color)
+    
+    # 绘制四个圆角
+    # 左上角
+    draw.pieslice((x0, y0, x0 + radius * 2, y0 + radius * 2), 180, 270, fill=color)
+    # 右上角
+    draw.pieslice((x1 - radius * 2, y0, x1, y0 + radius * 2), 270, 0, fill=color)
+    # 左下角
+    draw.pieslice((x0, y1 - radius * 2, x0 + radius * 2, y1), 90, 180, fill=color)
+    # 右下角
+    draw.pieslice((x1 - radius * 2, y1 - radius * 2, x1, y1), 0, 90, fill=color)
+
+def apply_opacity(image, opacity):
+    """按比例缩放RGBA图片的透明度通道
+
+    对整个Alpha通道一次性查表运算，替代逐像素的getpixel/putpixel循环，
+    结果与逐像素计算 int(a * opacity / 255) 完全一致。
+
+    参数:
+        image: RGBA格式的PIL图片
+        opacity: 目标透明度，0-255
+    返回:
+        新的RGBA图片，RGB通道保持不变
+    """
+    # 预先计算256项查找表，point()在C层面对整个通道查表
+    lut = [int(a * opacity / 255) for a in range(256)]
+    alpha = image.getchannel('A').point(lut)
+    result = image.copy()
+    result.putalpha(alpha)
+    return result
+
+def rounded_corner_mask(size, radius):
+    """生成圆角矩形蒙版
+
+    参数:
+        size: 蒙版尺寸 (width, height)
+        radius: 圆角半径，超过短边一半时自动收缩
+    返回:
+        L模式蒙版，圆角矩形内为255，外为0
+    """
+    width, height = size
+    mask = Image.new('L', (width, height), 0)
+    mask_draw = ImageDraw.Draw(mask)
+    
+    if radius > min(width, height) // 2:
+        radius = min(width, height) // 2
+    
+    if radius > 0:
+        # 绘制中间矩形
+        mask_draw.rectangle((radius, 0, width - radius, height), fill=255)
+        mask_draw.rectangle((0, radius, width, height - radius), fill=255)
+        
+        # 绘制四个圆角
+        mask_draw.pieslice((0, 0, radius * 2, radius * 2), 180, 270, fill=255)
+        mask_draw.pieslice((width - radius * 2, 0, width, radius * 2), 270, 0, fill=255)
+        mask_draw.pieslice((0, height - radius * 2, radius * 2, height), 90, 180, fill=255)
+        mask_draw.pieslice((width - radius * 2, height - radius * 2, width, height), 0, 90, fill=255)
+    
+    return mask
+
+class PreparedCache:
+    """水印准备结果的LRU缓存及命中率统计
+
+    参数:
+        cache_size: 缓存条目数量上限
+    """
+    
+    def __init__(self, cache_size=16):
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        # 多个线程共享同一个水印计划时保护LRU缓存
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        # 锁不能pickle，传给子进程时去掉，子进程中重新创建
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def _cached(self, key, build):
+        """返回key对应的缓存结果，未命中时调用build()生成并缓存"""
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return value
+            self.misses += 1
+        
+        # 在锁外生成，不同尺寸的水印可以在多个线程中同时准备
+        value = build()
+        with self._lock:
+            self._cache[key] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+    
+    @property
+    def hit_rate(self):
+        """缓存命中率，0-1之间"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def stats_text(self):
+        """缓存统计信息的可读文本"""
+        return f"{self.hit_rate:.1%} (命中 {self.hits} / 未命中 {self.misses})"
+
+class WatermarkPlan(PreparedCache):
+    """批量处理共享的图片水印准备计划
+
+    水印图片只打开并转换一次；按目标尺寸缩放、调整透明度并加圆角蒙版后的
+    结果保存在LRU缓存中，同尺寸的图片只需准备一次水印。
+
+    参数:
+        watermark_path: 水印图片路径
+        scale: 水印缩放比例（相对于原图宽度）
+        font_color: RGBA颜色，其透明度作为水印图片的透明度
+        bg_color: 水印背景颜色，背景透明时圆角应用于水印图片本身
+        corner_radius: 圆角半径（像素）
+        cache_size: 缓存的水印尺寸数量上限
+    """
+    
+    def __init__(self, watermark_path, scale=0.2, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, cache_size=16):
+        super().__init__(cache_size)
+        self.watermark_path = watermark_path
+        self.scale = scale
+        self.opacity = font_color[3]
+        self.corner_radius = corner_radius
+        # 有背景色时圆角画在背景上，否则裁剪水印图片本身
+        self.round_watermark = bg_color[3] == 0 and corner_radius > 0
+        
+        with Image.open(watermark_path) as source:
+            self.source = source.convert('RGBA')
+    
+    def asset_digest(self):
+        """水印图片内容的摘要，用于判断水印素材是否变化"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{self.source.mode}{self.source.size}".encode('ascii'))
+        digest.update(self.source.tobytes())
+        return digest.hexdigest()
+    
+    def target_size(self, width, height):
+        """计算原图尺寸对应的水印尺寸"""
+        watermark_width, watermark_height = self.source.size
+        # 很小的原图按比例缩放后可能不足1像素，至少保留1像素
+        new_width = max(1, int(width * self.scale))
+        new_height = max(1, int(watermark_height * (new_width / watermark_width)))
+        return new_width, new_height
+    
+    def prepare(self, width, height):
+        """返回适用于指定原图尺寸的水印图片（只读，请勿修改）"""
+        new_size = self.target_size(width, height)
+        key = (new_size, self.scale, self.corner_radius, self.opacity)
+        return self._cached(key, lambda: self._build(new_size))
+    
+    def _build(self, new_size):
+        watermark = self.source.resize(new_size, Image.LANCZOS)
+        
+        # 调整水印图片的透明度
+        if self.opacity < 255:
+            watermark = apply_opacity(watermark, self.opacity)
+        
+        # 背景透明时为水印图片添加圆角效果
+        if self.round_watermark:
+            watermark.putalpha(rounded_corner_mask(new_size, self.corner_radius))
+        return watermark
+
+class TextWatermarkPlan(PreparedCache):
+    """批量处理共享的文字水印准备计划
+
+    文字连同背景矩形预先渲染为RGBA贴图，按 (文字, 字体, 字号, 颜色, 圆角) 缓存。
+    字号只取决于原图宽度，同宽度的图片直接复用贴图，不再调用FreeType。
+
+    参数:
+        text: 水印文字内容
+        font_size: 基准字体大小
+        font_color: 字体颜色，RGBA格式
+        scale: 文字宽度占原图宽度的比例
+        bg_color: 水印背景颜色，RGBA格式
+        corner_radius: 背景矩形的圆角半径（像素）
+        font_path: 字体文件路径、文件名或字体族名，默认自动选择系统字体
+        cache_size: 缓存的贴图数量上限
+    """
+    
+    def __init__(self, text, font_size=40, font_color=(255, 255, 255, 128), scale=0.2, bg_color=(0, 0, 0, 0), corner_radius=0, font_path=None, cache_size=16):
+        super().__init__(cache_size)
+        self.text = text
+        self.font_size = font_size
+        self.font_color = tuple(font_color)
+        self.scale = scale
+        self.bg_color = tuple(bg_color)
+        self.corner_radius = corner_radius
+        self.font_file = resolve_font(font_path, text)
+        
+        # 基准字号下的文字宽度，用于按原图宽度换算字号
+        self.base_width = measure_text(load_font(self.font_file, font_size), text)[0]
+    
+    def asset_digest(self):
+        """所用字体文件的标识，用于判断字体是否变化"""
+        if self.font_file is None:
+            return 'default'
+        stat = os.stat(self.font_file)
+        return f"{self.font_file}:{stat.st_size}:{stat.st_mtime_ns}"
+    
+    def font_size_for(self, width):
+        """根据缩放比例计算原图宽度对应的字号"""
+        if self.base_width <= 0:
+            return self.font_size
+        return max(1, int(self.font_size * self.scale * width / self.base_width))
+    
+    def prepare(self, width, height):
+        """返回适用于指定原图尺寸的 (贴图, 贴图相对文字位置的偏移, 文字尺寸)，贴图只读"""
+        size = self.font_size_for(width)
+        key = (self.text, self.font_file, size, self.font_color, self.bg_color, self.corner_radius)
+        return self._cached(key, lambda: render_text_sprite(
+            self.text, load_font(self.font_file, size), self.font_color, self.bg_color, self.corner_radius))
+
+def render_text_sprite(text, font, font_color, bg_color=(0, 0, 0, 0), corner_radius=0):
+    """把文字及其背景矩形渲染为RGBA贴图
+
+    参数:
+        text: 水印文字内容
+        font: 已加载的字体
+        font_color: 字体颜色，RGBA格式
+        bg_color: 水印背景颜色，RGBA格式，完全透明时不绘制背景
+        corner_radius: 背景矩形的圆角半径（像素）
+    返回:
+        (贴图, 贴图左上角相对文字位置的偏移, 文字尺寸)
+    """
+    text_size = measure_text(font, text)
+    
+    # 以文字位置为原点计算文字及背景所占的范围
+    boxes = [ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)]
+    if bg_color[3] > 0:  # 如果不是完全透明
+        rect_position = background_rect((0, 0), text_size)
+        boxes.append((rect_position[0], rect_position[1], rect_position[2] + 1, rect_position[3] + 1))
+    left = min(box[0] for box in boxes)
+    top = min(box[1] for box in boxes)
+    right = max(box[2] for box in boxes)
+    bottom = max(box[3] for box in boxes)
+    
+    sprite = Image.new('RGBA', (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(sprite)
+    
+    # 如果设置了背景色
+    if bg_color[3] > 0:
+        rect_position = background_rect((-left, -top), text_size)
+        
+        # 根据是否设置圆角决定绘制方式
+        if corner_radius > 0:
+            draw_rounded_rectangle(draw, rect_position, bg_color, corner_radius)
+        else:
+            draw.rectangle(rect_position, fill=bg_color)
+    
+    # 绘制文字
+    draw.text((-left, -top), text, font=font, fill=font_color)
+    return sprite, (left, top), text_size
+
+def make_plan(watermark_path=None, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, font_path=None):
+    """根据水印类型创建批量处理共享的水印计划，指定了文字时使用文字水印"""
+    if text:
+        return TextWatermarkPlan(text, font_size, font_color, scale, bg_color, corner_radius, font_path)
+    return WatermarkPlan(watermark_path, scale, font_color, bg_color, corner_radius)
+
+def calculate_position(position, image_size, mark_size, margins=20):
+    """计算水印左上角在原图中的坐标
+
+    参数:
+        position: 水印位置，可选值：'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'
+        image_size: 原图尺寸 (width, height)
+        mark_size: 水印尺寸 (width, height)
+        margins: 水印边距，可以是整数（所有边距相同）或字典（指定不同方向的边距）
+    """
+    width, height = image_size
+    mark_width, mark_height = mark_size
+    
+    # 处理边距参数
+    margin_bottom = margin_right = margin_left = margin_top = 20
+    if isinstance(margins, dict):
+        margin_bottom = margins.get('bottom', 20)
+        margin_right = margins.get('right', 20)
+        margin_top = margins.get('top', 20)
+        margin_left = margins.get('left', 20)
+    elif isinstance(margins, int):
+        margin_bottom = margin_right = margin_top = margin_left = margins
+    
+    if position == 'top-left':
+        return (margin_left, margin_top)
+    elif position == 'top-right':
+        return (width - mark_width - margin_right, margin_top)
+    elif position == 'bottom-left':
+        return (margin_left, height - mark_height - margin_bottom)
+    elif position == 'bottom-right':
+        return (width - mark_width - margin_right, height - mark_height - margin_bottom)
+    elif position == 'center':
+        return ((width - mark_width) // 2, (height - mark_height) // 2)
+    else:
+        return (width - mark_width - margin_right, height - mark_height - margin_bottom)  # 默认右下角
+
+def background_rect(position, mark_size, padding=10):
+    """水印背景矩形的坐标 (left, top, right, bottom)，right/bottom 为包含在内的边界"""
+    return (
+        position[0] - padding,
+        position[1] - padding,
+        position[0] + mark_size[0] + padding,
+        position[1] + mark_size[1] + padding
+    )
+
+def clip_region(boxes, image_size):
+    """合并多个区域并裁剪到图片范围内
+
+    参数:
+        boxes: (left, top, right, bottom) 列表，right/bottom 不包含在内
+        image_size: 图片尺寸 (width, height)
+    返回:
+        裁剪后的区域，区域为空时返回None
+    """
+    left = max(0, min(box[0] for box in boxes))
+    top = max(0, min(box[1] for box in boxes))
+    right = min(image_size[0], max(box[2] for box in boxes))
+    bottom = min(image_size[1], max(box[3] for box in boxes))
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right, bottom)
+
+# 叠加层透明度 -> 二值蒙版，不透明度大于0的像素为255
+_COVERED_LUT = [0] + [255] * 255
+
+def composite_region(image, overlay, origin):
+    """将RGBA叠加层合成到图片的局部区域
+
+    只裁剪叠加层覆盖的区域进行alpha_composite再贴回，避免分配和混合整幅图层。
+    叠加层以外的像素保持不变，结果与整幅透明图层合成完全一致。
+
+    非RGBA的原图只把该区域转换为RGBA混合后再转回原模式。CMYK与RGBA之间的转换有损，
+    只贴回叠加层不透明度大于0的像素，完全透明处的原图像素保持不变。
+
+    参数:
+        image: RGBA、RGB或CMYK格式的原图，原地修改
+        overlay: RGBA叠加层，需完全位于图片范围内
+        origin: 叠加层左上角在图片中的坐标
+    """
+    region = (origin[0], origin[1], origin[0] + overlay.width, origin[1] + overlay.height)
+    base = image.crop(region)
+    if image.mode == 'RGBA':
+        blended = Image.alpha_composite(base, overlay)
+    else:
+        blended = Image.alpha_composite(base.convert('RGBA'), overlay).convert(image.mode)
+    if image.mode == 'CMYK':
+        # 二值蒙版：被覆盖的像素整体替换为混合结果，不再按透明度二次混合
+        image.paste(blended, region, overlay.getchannel('A').point(_COVERED_LUT))
+    else:
+        image.paste(blended, region)
+
+def paste_sprite(image, sprite, origin):
+    """将预先渲染好的RGBA贴图合成到图片上，超出图片范围的部分被裁掉
+
+    参数:
+        image: 工作模式的原图（见 open_image），原地修改
+        sprite: RGBA贴图，只读
+        origin: 贴图左上角在图片中的坐标，可以为负数
+    """
+    region = clip_region([(origin[0], origin[1], origin[0] + sprite.width, origin[1] + sprite.height)], image.size)
+    if region is None:
+        return
+    if region[2] - region[0] != sprite.width or region[3] - region[1] != sprite.height:
+        sprite = sprite.crop((region[0] - origin[0], region[1] - origin[1], region[2] - origin[0], region[3] - origin[1]))
+    composite_region(image, sprite, (region[0], region[1]))
+
+def paste_watermark(image, watermark, position, bg_color=(0, 0, 0, 0), corner_radius=0):
+    """将水印及其背景矩形合成到图片上
+
+    只为水印和背景所占的区域分配图层并混合，结果与整幅透明图层合成完全一致。
+
+    参数:
+        image: 工作模式的原图（见 open_image），原地修改
+        watermark: RGBA格式的水印图片
+        position: 水印左上角坐标
+        bg_color: 水印背景颜色，RGBA格式，完全透明时不绘制背景
+        corner_radius: 背景矩形的圆角半径（像素）
+    """
+    # 水印及背景所占的区域，只在该区域内分配图层并合成
+    boxes = [(position[0], position[1], position[0] + watermark.width, position[1] + watermark.height)]
+    if bg_color[3] > 0:  # 如果不是完全透明
+        rect_position = background_rect(position, watermark.size)
+        boxes.append((rect_position[0], rect_position[1], rect_position[2] + 1, rect_position[3] + 1))
+    region = clip_region(boxes, image.size)
+    
+    if region is not None:
+        left, top = region[0], region[1]
+        region_size = (region[2] - left, region[3] - top)
+        
+        # 创建透明图层
+        transparent = Image.new('RGBA', region_size, (0, 0, 0, 0))
+        
+        # 如果设置了背景色
+        if bg_color[3] > 0:
+            # 创建一个新的图层用于绘制背景
+            bg_layer = Image.new('RGBA', region_size, (0, 0, 0, 0))
+            draw = ImageDraw.Draw(bg_layer)
+            rect_position = background_rect((position[0] - left, position[1] - top), watermark.size)
+            
+            # 根据是否设置圆角决定绘制方式
+            if corner_radius > 0:
+                draw_rounded_rectangle(draw, rect_position, bg_color, corner_radius)
+            else:
+                draw.rectangle(rect_position, fill=bg_color)
+            
+            # 将背景层合并到透明层
+            transparent = Image.alpha_composite(transparent, bg_layer)
+        
+        # 将水印粘贴到透明层
+        transparent.paste(watermark, (position[0] - left, position[1] - top), watermark)
+        
+        # 合并图层
+        composite_region(image, transparent, (left, top))
+
+def working_mode(image):
+    """选择合成水印时使用的图片模式
+
+    带透明通道的图片使用RGBA；RGB和CMYK保持原模式，只在水印区域内转换；
+    其余不透明的模式（L、P等）转换为比RGBA更省内存的RGB。
+    """
+    if image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La'):
+        return 'RGBA'
+    if image.mode == 'P' and 'transparency' in image.info:
+        return 'RGBA'
+    if image.mode in ('RGB', 'CMYK'):
+        return image.mode
+    return 'RGB'
+
+def open_image(input_path):
+    """打开并解码图片，返回工作模式的图片
+
+    input_path 可以是文件路径，也可以是已读入内存的文件对象。
+
+    每个文件只解码一次；原图已经是工作模式时不做任何转换。
+    转换后的图片同样保留原图的 format，供未指定输出格式时使用。
+    """
+    with Image.open(input_path) as source:
+        mode = working_mode(source)
+        if source.mode == mode:
+            source.load()
+            return source
+        image = source.convert(mode)
+        image.format = source.format
+        return image
+
+def _pixel_bytes(mode):
+    """Pillow在内存中保存每个像素占用的字节数，多通道的8位模式按4字节存储"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+def estimate_memory(input_path):
+    """只读取文件头，估计处理一张图片时的峰值内存（字节）
+
+    包括解码后的原图、转换为工作模式的副本（需要转换时）和编码时可能的模式转换。
+    无法读取文件头时返回0，由处理阶段报告错误。
+    """
+    try:
+        with Image.open(input_path) as image:
+            pixels = image.width * image.height
+            source = _pixel_bytes(image.mode)
+            mode = working_mode(image)
+    except Exception:
+        return 0
+    converted = _pixel_bytes(mode) if mode != image.mode else 0
+    return pixels * (source + converted + _pixel_bytes(mode))
+
+def set_max_pixels(max_pixels):
+    """设置Pillow的解压炸弹保护阈值（像素数），0表示不限制，None保持Pillow默认值"""
+    if max_pixels is not None:
+        Image.MAX_IMAGE_PIXELS = max_pixels or None
+
+# 进程的文件创建掩码，读取后立即恢复
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def atomic_write(output_path, write):
+    """原子地写入文件：先写入同目录下的临时文件，再重命名为目标文件
+
+    进程在写入过程中被终止时不会留下写了一半的输出文件。
+
+    参数:
+        output_path: 输出路径
+        write: 写入函数 write(f)，f 为以二进制方式打开的临时文件
+    """
+    directory, filename = os.path.split(output_path)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{filename}.", suffix='.tmp', dir=directory or '.')
+    try:
+        # mkstemp 创建的文件只有所有者可读写，改为与普通文件相同的权限
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def save_image(image, output_path, encoder=None):
+    """原子地保存图片
+
+    参数:
+        image: 要保存的图片
+        output_path: 输出路径，未指定输出格式时根据扩展名确定图片格式
+        encoder: 可选的Encoder，决定输出格式和编码参数，默认使用Pillow默认参数
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    image_format = encoder.format_for(output_path)
+    image = encoder.prepare(image, image_format)
+    atomic_write(output_path, lambda f: encoder.write(image, f, image_format))
+
+def encode_image(image, output_path, encoder=None):
+    """把图片编码为输出文件的数据，output_path 只用于确定输出格式"""
+    encoder = encoder or DEFAULT_ENCODER
+    image_format = encoder.format_for(output_path)
+    buffer = io.BytesIO()
+    encoder.write(encoder.prepare(image, image_format), buffer, image_format)
+    return buffer.getvalue()
+
+def watermark_image(image, plan, position='bottom-right', margins=20, bg_color=(0, 0, 0, 0), corner_radius=0, clock=None):
+    """在已解码的图片上合成水印，直接修改 image
+
+    参数:
+        image: open_image 返回的图片
+        plan: WatermarkPlan 或 TextWatermarkPlan
+        position, margins, bg_color, corner_radius: 同 add_watermark
+        clock: 可选的StageClock，分别记录准备水印和合成的耗时
+    """
+    width, height = image.size
+    if isinstance(plan, TextWatermarkPlan):
+        # 文字贴图已包含背景
+        sprite, offset, text_size = plan.prepare(width, height)
+        if clock is not None:
+            clock.lap('prepare')
+        position = calculate_position(position, (width, height), text_size, margins)
+        paste_sprite(image, sprite, (position[0] + offset[0], position[1] + offset[1]))
+    else:
+        watermark = plan.prepare(width, height)
+        if clock is not None:
+            clock.lap('prepare')
+        position = calculate_position(position, (width, height), watermark.size, margins)
+        paste_watermark(image, watermark, position, bg_color, corner_radius)
+    if clock is not None:
+        clock.lap('composite')
+
+def watermark_bytes(data, output_path, watermark_path=None, position='bottom-right', margins=20, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, plan=None, font_path=None, encoder=None, timings=None):
+    """给内存中的图片数据添加水印，返回编码后的输出数据
+
+    供分阶段的流水线使用：读写文件由I/O线程完成，这里只做解码、合成和编码。
+    参数与 add_watermark 相同，output_path 只用于确定输出格式；出错时抛出异常。
+    """
+    clock = StageClock(timings) if timings is not None else None
+    image = open_image(io.BytesIO(data))
+    if clock is not None:
+        clock.lap('decode')
+    if plan is None:
+        plan = make_plan(watermark_path, scale, text, font_size, font_color, bg_color, corner_radius, font_path)
+    watermark_image(image, plan, position, margins, bg_color, corner_radius, clock)
+    encoded = encode_image(image, output_path, encoder)
+    if clock is not None:
+        clock.lap('encode')
+    return encoded
+
+def watermark_file(input_path, output_path, plan, position='bottom-right', margins=20, bg_color=(0, 0, 0, 0), corner_radius=0, encoder=None, timings=None):
+    """解码图片、合成水印并原子地保存，出错时抛出异常
+
+    timings 为字典时按阶段累加耗时（秒）。计时时先把文件读入内存再解码、
+    先编码到内存再写入，读取、解码、编码和写入分别计时，输出内容不变。
+    """
+    if timings is None:
+        image = open_image(input_path)
+        watermark_image(image, plan, position, margins, bg_color, corner_radius)
+        save_image(image, output_path, encoder)
+        return
+
+    clock = StageClock(timings)
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    clock.lap('read')
+    encoded = watermark_bytes(data, output_path, position=position, margins=margins, bg_color=bg_color,
+                              corner_radius=corner_radius, plan=plan, encoder=encoder, timings=timings)
+    clock = StageClock(timings)
+    atomic_write(output_path, lambda f: f.write(encoded))
+    clock.lap('write')
+
+def add_text_watermark(input_path, output_path, text, font_size=40, font_color=(255, 255, 255, 128), position='bottom-right', margins=20, scale=0.2, bg_color=(0, 0, 0, 0), corner_radius=0, font_path=None, plan=None, encoder=None, timings=None):
+    """
+    给图片添加文字水印
+    
+    参数：
+        input_path: 输入图片路径
+        output_path: 输出图片路径
+        text: 水印文字内容
+        font_size: 字体大小
+        font_color: 字体颜色，RGBA格式
+        position: 水印位置，可选值：'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'
+        margins: 水印边距，可以是整数（所有边距相同）或字典（指定不同方向的边距）
+        scale: 水印缩放比例，0-1之间的小数
+        bg_color: 水印背景颜色，RGBA格式
+        corner_radius: 背景矩形的圆角半径（像素）
+        font_path: 字体文件路径、文件名或字体族名，默认自动选择系统字体
+        plan: 可选的TextWatermarkPlan，批量处理时复用已渲染好的文字贴图
+        encoder: 可选的Encoder，决定输出格式和编码参数
+        timings: 可选的字典，按阶段累加处理耗时（秒）
+    """
+    try:
+        # 文字贴图（批量处理时由共享的文字水印计划缓存）
+        if plan is None:
+            plan = TextWatermarkPlan(text, font_size, font_color, scale, bg_color, corner_radius, font_path)
+        
+        # 解码原图，计算位置并合并图层，保存结果
+        watermark_file(input_path, output_path, plan, position, margins, encoder=encoder, timings=timings)
+        print(f"已添加文字水印: {os.path.basename(input_path)} -> {os.path.basename(output_path)}")
+        return True
+    except Exception as e:
+        print(f"处理 {input_path} 时出错: {e}")
+        return False
+
+def add_watermark(input_path, output_path, watermark_path, position='bottom-right', margins=20, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, plan=None, font_path=None, encoder=None, timings=None):
+    """
+    给图片添加水印
+    
+    参数：
+        input_path: 输入图片路径
+        output_path: 输出图片路径
+        watermark_path: 水印图片路径
+        position: 水印位置，可选值：'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'
+        margins: 水印边距，可以是整数（所有边距相同）或字典（指定不同方向的边距）
+        scale: 水印缩放比例，0-1之间的小数
+        text: 文字水印内容，如果指定则使用文字水印，忽略watermark_path
+        font_size: 字体大小
+        font_color: 字体颜色，RGBA格式
+        bg_color: 水印背景颜色，RGBA格式
+        corner_radius: 背景矩形的圆角半径（像素）
+        plan: 可选的WatermarkPlan或TextWatermarkPlan，批量处理时复用已准备好的水印
+        font_path: 文字水印使用的字体，默认自动选择系统字体
+        encoder: 可选的Encoder，决定输出格式和编码参数
+        timings: 可选的字典，按阶段累加处理耗时（秒），见 watermark_metrics
+    """
+    # 如果提供了文本，使用文字水印
+    if text:
+        return add_text_watermark(input_path, output_path, text, font_size, font_color, position, margins, scale, bg_color, corner_radius, font_path, plan, encoder, timings)
+    
+    try:
+        # 准备缩放后的水印（批量处理时由共享的水印计划缓存）
+        if plan is None:
+            plan = WatermarkPlan(watermark_path, scale, font_color, bg_color, corner_radius)
+        
+        # 解码原图，计算位置并合成水印及背景，保存结果
+        watermark_file(input_path, output_path, plan, position, margins, bg_color, corner_radius, encoder, timings)
+        print(f"已添加水印: {os.path.basename(input_path)} -> {os.path.basename(output_path)}")
+        return True
+    except Exception as e:
+        print(f"处理 {input_path} 时出错: {e}")
+        return False
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""保存阶段的编码设置
+
+每种输出格式有几套预设的编码参数（编码配置），在编码耗时和输出文件大小之间
+显式取舍；也可以把所有输出统一转换为指定格式，例如全部输出WebP。
+默认配置不传任何编码参数，输出与Pillow的默认保存结果相同。
+"""
+
+import io
+import os
+from PIL import Image
+
+# 可转换的输出格式: 名称 -> (Pillow格式名, 扩展名)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp')
+}
+
+# 编码配置: 名称 -> {Pillow格式名: Image.save 参数}，未列出的格式使用Pillow默认参数
+PROFILES = {
+    # Pillow默认参数
+    'default': {},
+    # 编码最快，文件较大
+    'fast': {
+        'JPEG': {'quality': 85},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'quality': 80, 'method': 0}
+    },
+    # 耗时与大小折中，JPEG使用渐进式编码并优化哈夫曼表
+    'balanced': {
+        'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'quality': 80, 'method': 4}
+    },
+    # 文件最小，编码最慢
+    'small': {
+        'JPEG': {'quality': 75, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'WEBP': {'quality': 75, 'method': 6}
+    },
+    # 画质优先：高质量且不做色度抽样
+    'quality': {
+        'JPEG': {'quality': 92, 'optimize': True, 'subsampling': '4:4:4'},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'quality': 92, 'method': 4}
+    }
+}
+
+# 支持 quality 参数的有损格式
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+
+# 编码配置未指定质量时Pillow使用的默认质量
+DEFAULT_QUALITY = {'JPEG': 75, 'WEBP': 80}
+
+# 限制文件大小时搜索的最低质量，低于此质量仍超出限制则视为失败
+MIN_QUALITY = 10
+
+# 各格式可以直接保存的图片模式，其他模式保存前转换
+_SAVE_MODES = {
+    'JPEG': ('L', 'RGB', 'CMYK'),
+    'PNG': ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16'),
+    'WEBP': ('RGB', 'RGBA')
+}
+
+class Encoder:
+    """输出图片的编码器
+
+    参数:
+        profile: 编码配置名称，见 PROFILES
+        output_format: 输出格式名称（见 OUTPUT_FORMATS），None表示保持输入的扩展名和格式
+        quality: 覆盖编码配置中有损格式的质量（1-100）
+        lossless: 为True时WebP使用无损编码
+        max_bytes: 输出文件大小上限（字节），有损格式会搜索不超过上限的最高质量
+    """
+
+    def __init__(self, profile='default', output_format=None, quality=None, lossless=False, max_bytes=None):
+        if profile not in PROFILES:
+            raise ValueError(f"未知的编码配置: {profile}")
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {output_format}")
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError(f"质量必须在1-100之间: {quality}")
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError(f"文件大小上限必须大于0: {max_bytes}")
+        self.profile = profile
+        self.output_format = output_format
+        self.quality = quality
+        self.lossless = lossless
+        self.max_bytes = max_bytes
+        # 每个尺寸档位上一张图片找到的质量，作为下一张图片的搜索起点
+        self._seeds = {}
+        # 质量搜索的统计
+        self.searches = 0
+        self.encodes = 0
+
+    def __repr__(self):
+        # 设置指纹使用repr，必须只由设置决定
+        return (f"Encoder(profile={self.profile!r}, output_format={self.output_format!r}, "
+                f"quality={self.quality!r}, lossless={self.lossless!r}, max_bytes={self.max_bytes!r})")
+
+    @property
+    def extension(self):
+        """转换格式时输出文件的扩展名，保持原格式时为None"""
+        if self.output_format is None:
+            return None
+        return OUTPUT_FORMATS[self.output_format][1]
+
+    def format_for(self, output_path):
+        """输出文件的Pillow格式名"""
+        if self.output_format is not None:
+            return OUTPUT_FORMATS[self.output_format][0]
+        ext = os.path.splitext(output_path)[1].lower()
+        image_format = Image.registered_extensions().get(ext)
+        if image_format is None:
+            raise ValueError(f"无法根据扩展名确定图片格式: {output_path}")
+        return image_format
+
+    def params(self, image_format):
+        """指定格式的 Image.save 参数"""
+        params = dict(PROFILES[self.profile].get(image_format, {}))
+        if self.quality is not None and image_format in LOSSY_FORMATS:
+            params['quality'] = self.quality
+        if self.lossless and image_format == 'WEBP':
+            params['lossless'] = True
+        return params
+
+    def prepare(self, image, image_format):
+        """把图片转换为目标格式可以保存的模式
+
+        保存为不支持透明的JPEG时，透明区域合成到白色背景上。
+        """
+        modes = _SAVE_MODES.get(image_format)
+        if modes is None or image.mode in modes:
+            return image
+        if image_format == 'JPEG' and 'A' in image.mode:
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba)
+            return background
+        if image_format == 'WEBP' and ('A' in image.mode or 'transparency' in image.info):
+            return image.convert('RGBA')
+        return image.convert('RGB')
+
+    def write(self, image, f, image_format):
+        """把图片编码写入文件对象，设置了大小上限时先在内存中找到合适的质量"""
+        if self.max_bytes is None:
+            image.save(f, format=image_format, **self.params(image_format))
+        else:
+            f.write(self.encode_to_fit(image, image_format))
+
+    def _encode(self, image, image_format, params):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **params)
+        self.encodes += 1
+        return buffer.getvalue()
+
+    def encode_to_fit(self, image, image_format):
+        """编码为不超过 max_bytes 的数据，返回编码结果
+
+        有损格式在 [MIN_QUALITY, 配置质量] 区间内二分查找满足上限的最高质量。
+        同一尺寸档位上一张图片的结果作为第一次尝试的质量，相似的图片通常
+        一到两次编码即可确定结果；没有记录时先尝试配置质量本身。
+        无损格式或最低质量仍超出上限时抛出 ValueError。
+        """
+        params = self.params(image_format)
+        if image_format not in LOSSY_FORMATS or params.get('lossless'):
+            data = self._encode(image, image_format, params)
+            if len(data) > self.max_bytes:
+                raise ValueError(f"输出 {len(data)} 字节，超出大小上限 {self.max_bytes} 字节（无损格式无法降低质量）")
+            return data
+
+        self.searches += 1
+        top = params.get('quality', DEFAULT_QUALITY[image_format])
+        bucket = (image_format, (image.width * image.height).bit_length())
+        seed = self._seeds.get(bucket)
+        guess = seed if seed is not None and MIN_QUALITY <= seed <= top else top
+
+        low, high = MIN_QUALITY, top
+        best = None
+        while low <= high:
+            quality = guess if guess is not None else (low + high + 1) // 2
+            data = self._encode(image, image_format, dict(params, quality=quality))
+            if len(data) <= self.max_bytes:
+                best = (quality, data)
+                low = quality + 1
+                # 起点满足上限时先验证高一级的质量，通常即可结束搜索
+                guess = quality + 1 if quality == seed else None
+            else:
+                high = quality - 1
+                guess = None
+
+        if best is None:
+            raise ValueError(f"质量降到 {MIN_QUALITY} 仍超出大小上限 {self.max_bytes} 字节")
+        self._seeds[bucket] = best[0]
+        return best[1]
+
+DEFAULT_ENCODER = Encoder()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""输入图片的查找
+
+基于 os.scandir 的生成器，边遍历边产出文件，处理可以在遍历完成前开始。
+支持递归子目录、glob 包含/排除规则和文件大小过滤，并在输出目录中
+按相同的相对路径生成输出文件路径。
+"""
+
+import os
+import fnmatch
+
+# 支持的图片格式
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+_SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(value):
+    """解析文件大小参数，支持 K/M/G 后缀，例如 500K、20M"""
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in _SIZE_UNITS:
+        return int(float(value[:-1]) * _SIZE_UNITS[value[-1]])
+    return int(value)
+
+def _matches(rel_path, patterns):
+    """相对路径或文件名是否匹配任意一个glob规则"""
+    name = rel_path.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+def is_image(rel_path, include=None, exclude=None):
+    """按扩展名和包含/排除规则判断文件是否需要处理，规则与 iter_images 相同"""
+    if os.path.splitext(rel_path)[1].lower() not in IMAGE_EXTENSIONS:
+        return False
+    if include and not _matches(rel_path, include):
+        return False
+    return not (exclude and _matches(rel_path, exclude))
+
+def is_excluded_dir(rel_path, exclude=None):
+    """是否为隐藏目录或被排除规则匹配的目录"""
+    return rel_path.rsplit('/', 1)[-1].startswith('.') or bool(exclude and _matches(rel_path, exclude))
+
+def is_walked_dir(path, rel_path, exclude=None, skip=None):
+    """递归时是否进入该目录：不进入隐藏目录、被排除的目录和 skip（realpath 集合）中的目录"""
+    return not is_excluded_dir(rel_path, exclude) and os.path.realpath(path) not in (skip or ())
+
+def iter_images(input_dir, recursive=False, include=None, exclude=None, min_size=None, max_size=None, skip_dirs=None, sort=False):
+    """逐个产出输入目录中的图片文件
+
+    参数:
+        input_dir: 输入目录
+        recursive: 是否递归子目录
+        include: glob规则列表，指定时只保留匹配的文件（匹配相对路径或文件名）
+        exclude: glob规则列表，排除匹配的文件和目录
+        min_size: 文件大小下限（字节）
+        max_size: 文件大小上限（字节）
+        skip_dirs: 不进入的目录列表，例如位于输入目录内的输出目录
+        sort: 是否按文件名排序每个目录的内容，使每次查找的顺序都相同（见 watermark_queue）
+    产出:
+        (文件路径, 相对于输入目录的路径)，相对路径使用 / 分隔
+    """
+    include = include or []
+    exclude = exclude or []
+    skip = {os.path.realpath(d) for d in (skip_dirs or [])}
+    check_size = min_size is not None or max_size is not None
+
+    # 用栈代替递归，避免目录层级很深时超出递归深度
+    stack = [(input_dir, '')]
+    while stack:
+        directory, prefix = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                # 默认不对目录内容排序，文件边遍历边产出
+                if sort:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+                for entry in entries:
+                    rel_path = prefix + entry.name
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+
+                    # 跳过目录和不支持的文件格式，递归时不进入隐藏目录
+                    if is_dir:
+                        if recursive and is_walked_dir(entry.path, rel_path, exclude, skip):
+                            subdirs.append((entry.path, rel_path + '/'))
+                        continue
+
+                    if not is_image(rel_path, include, exclude):
+                        continue
+                    if check_size:
+                        try:
+                            size = entry.stat().st_size
+                        except OSError:
+                            continue
+                        if min_size is not None and size < min_size:
+                            continue
+                        if max_size is not None and size > max_size:
+                            continue
+
+                    yield entry.path, rel_path
+        except OSError:
+            pass
+
+        stack.extend(subdirs)
+
+def image_stems(rel_paths):
+    """被多个图片共用的主干（去掉扩展名的相对路径），例如 a.png 和 a.jpg 的 a"""
+    counts = {}
+    for rel_path in rel_paths:
+        stem, ext = os.path.splitext(rel_path)
+        if ext.lower() in IMAGE_EXTENSIONS:
+            counts[stem] = counts.get(stem, 0) + 1
+    return {stem for stem, count in counts.items() if count > 1}
+
+class SharedStems:
+    """输入目录中被多个图片共用的主干，按目录列出并缓存最近一个目录的结果
+
+    与 image_stems 返回的集合一样支持 in 判断，传给 output_path_for。
+    同一目录的图片通常连续处理，每个目录只列出一次。
+    """
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self._rel_dir = None
+        self._stems = set()
+
+    def __contains__(self, stem):
+        rel_dir = stem.rpartition('/')[0]
+        if rel_dir != self._rel_dir:
+            prefix = rel_dir + '/' if rel_dir else ''
+            try:
+                names = os.listdir(os.path.join(self.input_dir, *rel_dir.split('/')) if rel_dir else self.input_dir)
+            except OSError:
+                names = []
+            self._stems = image_stems(prefix + name for name in names)
+            self._rel_dir = rel_dir
+        return stem in self._stems
+
+def output_path_for(output_dir, rel_path, output_ext=None, shared_stems=None):
+    """输入文件的相对路径对应的输出路径，output_ext 指定时替换扩展名
+
+    转换输出格式时 a.png 和 a.jpg 都会得到 a.webp；主干在 shared_stems（image_stems 或
+    SharedStems）中的图片保留原扩展名（a.png.webp、a.jpg.webp），输出路径只取决于
+    同一目录中有哪些图片，与处理顺序无关。
+    """
+    output_path = os.path.join(output_dir, *rel_path.split('/'))
+    if output_ext:
+        if shared_stems is None or os.path.splitext(rel_path)[0] not in shared_stems:
+            output_path = os.path.splitext(output_path)[0]
+        output_path += output_ext
+    return output_path
+
+def iter_tasks(input_dir, output_dir, output_ext=None, **filters):
+    """产出 (输入路径, 输出路径) 任务，输出目录按输入的子目录结构创建
+
+    output_ext 指定时输出文件使用该扩展名（转换输出格式），否则与输入相同；
+    同一目录中只有扩展名不同的图片在输出文件名中保留原扩展名，见 output_path_for。
+    filters 为 iter_images 的过滤参数。
+    """
+    created = set()
+    skip_dirs = list(filters.pop('skip_dirs', None) or []) + [output_dir]
+    shared_stems = SharedStems(input_dir) if output_ext else None
+    for input_path, rel_path in iter_images(input_dir, skip_dirs=skip_dirs, **filters):
+        output_path = output_path_for(output_dir, rel_path, output_ext, shared_stems)
+        output_subdir = os.path.dirname(output_path)
+        if output_subdir not in created:
+            os.makedirs(output_subdir, exist_ok=True)
+            created.add(output_subdir)
+        yield input_path, output_path
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""文字水印的字体查找与缓存
+
+首次使用时扫描系统字体目录，把每个字体文件的路径、字体族名和是否支持中文
+保存为磁盘上的索引文件，之后的运行直接读取索引。已加载的 FreeTypeFont
+按 (字体路径, 字号) 缓存在进程内的LRU中，批量处理时每种字号只加载一次。
+"""
+
+import os
+import sys
+import json
+from functools import lru_cache
+from PIL import ImageFont
+
+# 索引文件格式版本，格式变化时递增以触发重新扫描
+INDEX_VERSION = 1
+
+FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf')
+
+# 优先使用的常见中文字体
+PREFERRED_FONTS = [
+    # macOS 常见中文字体
+    '/System/Library/Fonts/PingFang.ttc',
+    '/Library/Fonts/Arial Unicode.ttf',
+    # Windows 常见中文字体
+    'C:\\Windows\\Fonts\\simhei.ttf',
+    'C:\\Windows\\Fonts\\msyh.ttc',
+    # Linux 常见中文字体
+    '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc'
+]
+
+def user_cache_dir():
+    """本工具的用户缓存目录，可通过环境变量 WATERMARK_CACHE_DIR 指定"""
+    path = os.environ.get('WATERMARK_CACHE_DIR')
+    if path:
+        return path
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'batch-watermark-tool')
+
+def system_font_dirs():
+    """当前平台的系统字体目录"""
+    if sys.platform == 'win32':
+        windir = os.environ.get('WINDIR', 'C:\\Windows')
+        dirs = [os.path.join(windir, 'Fonts')]
+        local = os.environ.get('LOCALAPPDATA')
+        if local:
+            dirs.append(os.path.join(local, 'Microsoft', 'Windows', 'Fonts'))
+    elif sys.platform == 'darwin':
+        dirs = ['/System/Library/Fonts', '/Library/Fonts', os.path.expanduser('~/Library/Fonts')]
+    else:
+        dirs = ['/usr/share/fonts', '/usr/local/share/fonts',
+                os.path.expanduser('~/.fonts'), os.path.expanduser('~/.local/share/fonts')]
+    return [d for d in dirs if os.path.isdir(d)]
+
+def _iter_font_files(directory):
+    """递归列出目录下的字体文件"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _iter_font_files(entry.path)
+                elif entry.name.lower().endswith(FONT_EXTENSIONS):
+                    yield entry.path
+    except OSError:
+        return
+
+def _iter_dirs(directory):
+    """列出目录本身及其所有子目录"""
+    yield directory
+    try:
+        with os.scandir(directory) as entries:
+            subdirs = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return
+    for subdir in subdirs:
+        yield from _iter_dirs(subdir)
+
+def _covers_cjk(font):
+    """判断字体是否包含中文字形
+
+    缺失的字符会渲染为同一个占位字形，与私用区字符的渲染结果相同。
+    """
+    try:
+        cjk = font.getmask('中')
+        missing = font.getmask('\ue000')
+        if cjk.getbbox() is None:
+            return False
+        return cjk.size != missing.size or bytes(cjk) != bytes(missing)
+    except Exception:
+        return False
+
+def describe_font(path):
+    """读取字体文件的字体族名、样式和中文支持情况，无法读取时返回None"""
+    try:
+        font = ImageFont.truetype(path, 24)
+        family, style = font.getname()
+    except Exception:
+        return None
+    return {
+        'path': path,
+        'family': family or os.path.splitext(os.path.basename(path))[0],
+        'style': style or '',
+        'cjk': _covers_cjk(font)
+    }
+
+def _style_rank(info):
+    """排序用：常规样式排在粗体、斜体等样式之前"""
+    return info['style'].lower() not in ('regular', 'book', 'normal', '')
+
+class FontIndex:
+    """系统字体索引
+
+    参数:
+        index_path: 索引文件路径，默认保存在用户缓存目录
+        font_dirs: 要扫描的字体目录，默认为系统字体目录
+    """
+
+    def __init__(self, index_path=None, font_dirs=None):
+        self.index_path = index_path or os.path.join(user_cache_dir(), 'fonts.json')
+        self.font_dirs = font_dirs if font_dirs is not None else system_font_dirs()
+        self.fonts = []
+        if not self._load():
+            self.rebuild()
+
+    def _signature(self):
+        """字体目录及其子目录的修改时间，任一目录内容变化时索引失效
+
+        字体通常安装在已有的子目录中（如 /usr/share/fonts/truetype/<包名>/），
+        只比较顶层目录的修改时间无法发现新字体。
+        """
+        signature = {}
+        for font_dir in self.font_dirs:
+            for directory in _iter_dirs(font_dir):
+                try:
+                    signature[directory] = os.stat(directory).st_mtime
+                except OSError:
+                    pass
+        return signature
+
+    def _load(self):
+        """读取磁盘上的索引，索引不存在或已过期时返回False"""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != INDEX_VERSION or data.get('dirs') != self._signature():
+            return False
+        self.fonts = data.get('fonts', [])
+        return True
+
+    def rebuild(self):
+        """重新扫描字体目录并保存索引"""
+        paths = set()
+        for directory in self.font_dirs:
+            paths.update(_iter_font_files(directory))
+        self.fonts = [info for info in map(describe_font, sorted(paths)) if info is not None]
+
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': INDEX_VERSION, 'dirs': self._signature(), 'fonts': self.fonts},
+                          f, ensure_ascii=False)
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            # 缓存目录不可写时只在内存中使用索引
+            pass
+
+    def find(self, name):
+        """按文件名或字体族名查找字体，找不到时返回None"""
+        lowered = name.lower()
+        matches = [info for info in self.fonts
+                   if info['family'].lower() == lowered
+                   or os.path.basename(info['path']).lower() == lowered
+                   or os.path.splitext(os.path.basename(info['path']))[0].lower() == lowered]
+        if not matches:
+            return None
+        # 同一字体族优先使用常规样式
+        matches.sort(key=_style_rank)
+        return matches[0]['path']
+
+    def default_font(self, text=''):
+        """从索引中选择默认字体：支持中文的字体优先，文字全部为ASCII字符时不要求支持中文"""
+        need_cjk = any(ord(ch) > 127 for ch in text) or not text
+        candidates = [info for info in self.fonts if info['cjk']] if need_cjk else []
+        candidates = sorted(candidates or self.fonts, key=_style_rank)
+        return candidates[0]['path'] if candidates else None
+
+_font_index = None
+
+def get_font_index():
+    """进程内共享的字体索引，首次调用时加载"""
+    global _font_index
+    if _font_index is None:
+        _font_index = FontIndex()
+    return _font_index
+
+@lru_cache(maxsize=256)
+def resolve_font(font=None, text=''):
+    """把 --font 参数（路径、文件名或字体族名）解析为字体文件路径
+
+    未指定字体时根据文字内容选择默认字体；没有可用字体时返回None，
+    此时使用PIL默认字体。
+    """
+    if font:
+        if os.path.isfile(font):
+            return font
+        path = get_font_index().find(font)
+        if path is None:
+            raise ValueError(f"找不到字体: {font}")
+        return path
+    # 优先检查常见字体路径，避免在已有中文字体时扫描系统字体
+    for path in PREFERRED_FONTS:
+        if os.path.exists(path):
+            return path
+    return get_font_index().default_font(text)
+
+@lru_cache(maxsize=64)
+def load_font(path, size):
+    """加载指定字号的字体，同一 (路径, 字号) 只加载一次"""
+    if path is not None and size > 0:
+        try:
+            return ImageFont.truetype(path, size)
+        except Exception:
+            pass
+    # 如果找不到系统字体，使用PIL默认字体
+    return ImageFont.load_default()
+
+def measure_text(font, text):
+    """计算文字绘制后的宽高，兼容不同版本的Pillow"""
+    if hasattr(font, 'getbbox'):
+        left, top, right, bottom = font.getbbox(text)
+        return right, bottom
+    return font.getsize(text)
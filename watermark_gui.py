@@ -5,9 +5,222 @@ import os
 import sys
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, colorchooser
-from PIL import Image, ImageTk
+from PIL import ImageTk
+import time
+import queue
 import threading
-from watermark import add_watermark
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from watermark_core import make_plan
+from watermark_batch import BatchControl, run_batch, resolve_workers, create_executor, safe_mp_context, default_memory_limit
+from watermark_files import iter_images, iter_tasks
+from watermark_preview import PreviewRenderer
+from watermark_thumbs import THUMBNAIL_SIZE, ThumbnailCache
+
+# 设置变化后刷新预览的延迟（毫秒）
+PREVIEW_DELAY_MS = 50
+
+# 输入文件夹变化后重新加载缩略图的延迟（毫秒），避免输入路径时每个字符都触发查找
+GALLERY_DELAY_MS = 300
+
+# 缩略图条的布局、后台解码线程数和内存中保留的缩略图数量
+THUMBNAIL_CELL = THUMBNAIL_SIZE[0] + 8
+THUMBNAIL_WORKERS = 4
+THUMBNAIL_MEMORY = 500
+
+# 批量处理时刷新进度的间隔（毫秒）
+PROGRESS_INTERVAL_MS = 100
+
+def format_duration(seconds):
+    """把秒数格式化为 时:分:秒 或 分:秒"""
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+class ThumbnailStrip:
+    """输入文件夹的缩略图条
+
+    文件列表在后台线程中边查找边追加，缩略图只为可见范围内的图片创建；
+    解码在后台线程池中进行并缓存到磁盘，结果通过队列交给Tk主线程显示。
+    打开包含大量图片的文件夹时界面不会卡住。
+
+    参数:
+        parent: 父控件
+        on_select: 点击缩略图时的回调 on_select(图片路径)
+    """
+    
+    def __init__(self, parent, on_select):
+        self.on_select = on_select
+        self.frame = ttk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, height=THUMBNAIL_CELL, bg="white", highlightthickness=0,
+                                xscrollincrement=THUMBNAIL_CELL)
+        scrollbar = ttk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.xview)
+        self.canvas.configure(xscrollcommand=scrollbar.set)
+        self.canvas.pack(fill=tk.X)
+        scrollbar.pack(fill=tk.X)
+        
+        self.canvas.bind("<Configure>", lambda event: self.update_visible())
+        self.canvas.bind("<Button-1>", self.on_click)
+        # Windows/macOS 的滚轮事件和 Linux 的按键4/5
+        self.canvas.bind("<MouseWheel>", lambda event: self.xview('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.canvas.bind("<Button-4>", lambda event: self.xview('scroll', -1, 'units'))
+        self.canvas.bind("<Button-5>", lambda event: self.xview('scroll', 1, 'units'))
+        
+        self.cache = ThumbnailCache()
+        self.executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        self.results = queue.Queue()
+        self.generation = 0
+        self.files = []
+        self.items = {}          # 可见缩略图的画布元素
+        self.photos = {}         # 可见缩略图的PhotoImage，保存引用以防止垃圾回收
+        self.thumbnails = OrderedDict()  # 已解码的缩略图（LRU）
+        self.pending = {}        # 正在解码的缩略图
+        self.selected = None
+        
+        self.poll()
+    
+    def load(self, input_dir, recursive=False, skip_dirs=None):
+        """在后台查找输入文件夹中的图片并重新填充缩略图条，skip_dirs 中的文件夹不显示"""
+        self.generation += 1
+        generation = self.generation
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.items.clear()
+        self.photos.clear()
+        self.thumbnails.clear()
+        self.files = []
+        self.selected = None
+        self.canvas.delete("all")
+        self.canvas.configure(scrollregion=(0, 0, 0, THUMBNAIL_CELL))
+        self.canvas.xview_moveto(0)
+        
+        def scan():
+            # 第一批较小，尽快显示最前面的缩略图
+            batch = []
+            batch_size = 50
+            for input_path, _ in iter_images(input_dir, recursive, skip_dirs=skip_dirs):
+                # 已切换到其他文件夹时停止查找
+                if generation != self.generation:
+                    return
+                batch.append(input_path)
+                if len(batch) >= batch_size:
+                    self.results.put(('files', generation, batch))
+                    batch = []
+                    batch_size = 500
+            self.results.put(('files', generation, batch))
+        
+        threading.Thread(target=scan, daemon=True).start()
+    
+    def xview(self, *args):
+        self.canvas.xview(*args)
+        self.update_visible()
+    
+    def visible_range(self):
+        """可见范围内（两侧各多一些）的缩略图序号"""
+        left = self.canvas.canvasx(0)
+        width = self.canvas.winfo_width()
+        first = max(0, int(left // THUMBNAIL_CELL) - 2)
+        last = min(len(self.files), int((left + width) // THUMBNAIL_CELL) + 3)
+        return range(first, last)
+    
+    def update_visible(self):
+        """只为可见范围内的图片创建画布元素，滚出范围的元素和未开始的解码任务被丢弃"""
+        visible = self.visible_range()
+        for index in [index for index in self.items if index not in visible]:
+            self.canvas.delete(self.items.pop(index))
+            self.photos.pop(index, None)
+        for index in [index for index in self.pending if index not in visible]:
+            if self.pending[index].cancel():
+                del self.pending[index]
+        
+        for index in visible:
+            if index in self.items:
+                continue
+            thumbnail = self.thumbnails.get(index)
+            if thumbnail is not None:
+                self.thumbnails.move_to_end(index)
+                self.draw(index, thumbnail)
+                continue
+            # 解码完成前显示占位框
+            x = index * THUMBNAIL_CELL + 4
+            self.items[index] = self.canvas.create_rectangle(
+                x, 4, x + THUMBNAIL_SIZE[0], 4 + THUMBNAIL_SIZE[1], outline="#DDDDDD")
+            if index not in self.pending:
+                self.pending[index] = self.executor.submit(
+                    self.decode, self.generation, index, self.files[index])
+    
+    def decode(self, generation, index, input_path):
+        """后台线程：读取或生成缩略图"""
+        if generation != self.generation:
+            return
+        try:
+            thumbnail = self.cache.get(input_path)
+        except Exception:
+            thumbnail = None
+        self.results.put(('thumbnail', generation, (index, thumbnail)))
+    
+    def draw(self, index, thumbnail):
+        """在缩略图的格子中居中显示"""
+        if index in self.items:
+            self.canvas.delete(self.items.pop(index))
+        photo = ImageTk.PhotoImage(thumbnail)
+        x = index * THUMBNAIL_CELL + THUMBNAIL_CELL // 2
+        self.items[index] = self.canvas.create_image(x, THUMBNAIL_CELL // 2, image=photo, anchor=tk.CENTER)
+        self.photos[index] = photo
+        self.canvas.tag_raise("selection")
+    
+    def poll(self):
+        """在Tk主线程中定时处理后台线程的结果"""
+        changed = False
+        try:
+            for _ in range(200):
+                kind, generation, payload = self.results.get_nowait()
+                if generation != self.generation:
+                    continue
+                if kind == 'files':
+                    first = not self.files
+                    self.files.extend(payload)
+                    changed = True
+                    if first and self.files:
+                        self.select(0)
+                else:
+                    index, thumbnail = payload
+                    self.pending.pop(index, None)
+                    if thumbnail is None:
+                        continue
+                    self.thumbnails[index] = thumbnail
+                    if len(self.thumbnails) > THUMBNAIL_MEMORY:
+                        self.thumbnails.popitem(last=False)
+                    if index in self.visible_range():
+                        self.draw(index, thumbnail)
+        except queue.Empty:
+            pass
+        if changed:
+            self.canvas.configure(scrollregion=(0, 0, len(self.files) * THUMBNAIL_CELL, THUMBNAIL_CELL))
+            self.update_visible()
+        self.canvas.after(50, self.poll)
+    
+    def on_click(self, event):
+        index = int(self.canvas.canvasx(event.x) // THUMBNAIL_CELL)
+        if 0 <= index < len(self.files):
+            self.select(index)
+    
+    def select(self, index):
+        """选中缩略图并通知预览"""
+        self.selected = index
+        self.canvas.delete("selection")
+        x = index * THUMBNAIL_CELL
+        self.canvas.create_rectangle(x + 1, 1, x + THUMBNAIL_CELL - 1, THUMBNAIL_CELL - 1,
+                                     outline="#3070E0", width=2, tags="selection")
+        self.on_select(self.files[index])
+    
+    def close(self):
+        """停止后台任务"""
+        self.generation += 1
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 class WatermarkApp:
     def __init__(self, root):
@@ -28,6 +241,8 @@ class WatermarkApp:
         self.watermark_type = tk.StringVar(value="image")
         self.watermark_text = tk.StringVar(value="水印文字")
         self.font_size = tk.IntVar(value=40)
+        self.workers = tk.IntVar(value=os.cpu_count() or 1)  # 并行处理进程数
+        self.recursive = tk.BooleanVar(value=False)  # 是否包含子文件夹
         
         # 颜色相关变量
         self.font_color = (255, 255, 255, 255)  # RGBA，默认完全不透明
@@ -47,6 +262,21 @@ class WatermarkApp:
         self.opacity = 255  # 实际Alpha值，0-255
         self.corner_radius = tk.IntVar(value=0)  # 圆角半径
         
+        # 实时预览：缓存底图，设置变化后延迟一段时间再重新合成
+        self.preview_renderer = PreviewRenderer()
+        self.preview_file = None
+        self.preview_job = None
+        self.gallery_job = None
+        
+        # 批量处理：后台线程把进度事件放入队列，主线程定时读取并刷新界面
+        self.batch_control = None
+        self.progress_queue = None
+        self.batch_total = None
+        self.batch_completed = 0
+        self.batch_started = 0
+        self.paused_since = None
+        self.paused_time = 0
+        
         # UI元素引用
         self.type_frame = None
         self.image_watermark_frame = None
@@ -70,6 +300,16 @@ class WatermarkApp:
         
         # 更新UI初始状态
         self.update_ui_for_watermark_type()
+        
+        # 设置变化时自动刷新预览
+        for var in (self.watermark_path, self.position, self.margin_bottom, self.margin_right, self.scale,
+                    self.watermark_type, self.watermark_text, self.font_size, self.opacity_percent,
+                    self.corner_radius, self.font_r, self.font_g, self.font_b, self.bg_r, self.bg_g, self.bg_b):
+            var.trace_add('write', self.schedule_preview)
+        
+        # 输入文件夹变化时重新选择预览图片；输出文件夹中的图片不参与预览
+        for var in (self.input_dir, self.recursive, self.output_dir):
+            var.trace_add('write', self.reset_preview_file)
     
     def create_widgets(self):
         main_frame = ttk.Frame(self.root, padding="10")
@@ -85,6 +325,7 @@ class WatermarkApp:
         ttk.Label(input_frame, text="输入文件夹:").pack(side=tk.LEFT)
         ttk.Entry(input_frame, textvariable=self.input_dir).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
         ttk.Button(input_frame, text="浏览...", command=self.select_input_dir).pack(side=tk.LEFT)
+        ttk.Checkbutton(input_frame, text="包含子文件夹", variable=self.recursive).pack(side=tk.LEFT, padx=(5, 0))
         
         # 输出目录
         output_frame = ttk.Frame(settings_frame)
@@ -195,11 +436,23 @@ class WatermarkApp:
         scale_entry = tk.Spinbox(scale_frame, from_=0.01, to=1.0, increment=0.01, textvariable=self.scale, width=10)
         scale_entry.pack(side=tk.LEFT, padx=5)
         
+        # 并行进程数
+        workers_frame = ttk.Frame(settings_frame)
+        workers_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(workers_frame, text="并行进程:").pack(side=tk.LEFT)
+        workers_entry = tk.Spinbox(workers_frame, from_=1, to=max(64, os.cpu_count() or 1), textvariable=self.workers, width=10)
+        workers_entry.pack(side=tk.LEFT, padx=5)
+        
         # 预览和运行按钮
         self.button_frame = ttk.Frame(settings_frame)
         self.button_frame.pack(fill=tk.X, pady=10)
         ttk.Button(self.button_frame, text="预览效果", command=self.preview_watermark).pack(side=tk.LEFT, padx=5)
-        ttk.Button(self.button_frame, text="批量处理", command=self.process_images).pack(side=tk.LEFT, padx=5)
+        self.process_button = ttk.Button(self.button_frame, text="批量处理", command=self.process_images)
+        self.process_button.pack(side=tk.LEFT, padx=5)
+        self.pause_button = ttk.Button(self.button_frame, text="暂停", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(self.button_frame, text="取消", command=self.cancel_processing, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
         
         # 右侧预览区域
         preview_frame = ttk.LabelFrame(main_frame, text="预览", padding="10")
@@ -207,6 +460,11 @@ class WatermarkApp:
         
         self.preview_canvas = tk.Canvas(preview_frame, bg="white")
         self.preview_canvas.pack(fill=tk.BOTH, expand=True)
+        self.preview_canvas.bind("<Configure>", self.schedule_preview)
+        
+        # 输入文件夹的缩略图条，点击缩略图切换预览的图片
+        self.thumbnail_strip = ThumbnailStrip(preview_frame, self.select_preview_file)
+        self.thumbnail_strip.frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(5, 0), before=self.preview_canvas)
         
         # 状态栏
         self.status_var = tk.StringVar(value="就绪")
@@ -346,33 +604,76 @@ class WatermarkApp:
         if not self.validate_inputs(preview=True):
             return
         
-        # 获取第一张图片进行预览
-        image_files = []
-        for filename in os.listdir(self.input_dir.get()):
-            ext = os.path.splitext(filename)[1].lower()
-            if ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp']:
-                image_files.append(os.path.join(self.input_dir.get(), filename))
-                break
-        
-        if not image_files:
+        if self.find_preview_file() is None:
             messagebox.showinfo("提示", "输入文件夹中没有图片文件")
             return
         
-        # 创建临时目录
-        temp_dir = os.path.join(os.path.dirname(image_files[0]), ".temp")
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-        else:
-            # 清除上一次的预览
-            for file in os.listdir(temp_dir):
-                try:
-                    os.remove(os.path.join(temp_dir, file))
-                except:
-                    pass
-        
-        # 生成预览图
-        temp_output = os.path.join(temp_dir, "preview.png")
-        
+        try:
+            self.refresh_preview()
+        except Exception as e:
+            messagebox.showerror("错误", f"预览生成失败: {e}")
+            self.status_var.set("预览生成失败")
+            return
+        self.status_var.set("预览生成成功")
+    
+    def find_preview_file(self):
+        """用于预览的图片，默认为输入文件夹中找到的第一张图片"""
+        if self.preview_file is None:
+            input_dir = self.input_dir.get()
+            if not input_dir or not os.path.isdir(input_dir):
+                return None
+            for input_path, _ in iter_images(input_dir, self.recursive.get(), skip_dirs=self.skip_dirs()):
+                self.preview_file = input_path
+                break
+        return self.preview_file
+    
+    def reset_preview_file(self, *args):
+        """输入文件夹变化后重新选择预览图片，并延迟重新加载缩略图条"""
+        self.preview_file = None
+        self.schedule_preview()
+        if self.gallery_job is not None:
+            self.root.after_cancel(self.gallery_job)
+        self.gallery_job = self.root.after(GALLERY_DELAY_MS, self.load_gallery)
+    
+    def load_gallery(self):
+        """加载输入文件夹的缩略图"""
+        self.gallery_job = None
+        input_dir = self.input_dir.get()
+        if input_dir and os.path.isdir(input_dir):
+            self.thumbnail_strip.load(input_dir, self.recursive.get(), self.skip_dirs())
+    
+    def skip_dirs(self):
+        """查找输入图片时跳过的文件夹：输出文件夹可能位于输入文件夹中"""
+        output_dir = self.output_dir.get()
+        return [output_dir] if output_dir else None
+    
+    def select_preview_file(self, input_path):
+        """在缩略图条中选中图片后预览该图片"""
+        self.preview_file = input_path
+        self.schedule_preview()
+    
+    def schedule_preview(self, *args):
+        """设置变化后延迟刷新预览，连续变化（如拖动滑块）时只渲染最后一次"""
+        if self.preview_job is not None:
+            self.root.after_cancel(self.preview_job)
+        self.preview_job = self.root.after(PREVIEW_DELAY_MS, self.live_preview)
+    
+    def live_preview(self):
+        """实时预览：设置不完整或暂时无效（如正在输入数字）时保持上一次的预览"""
+        self.preview_job = None
+        if self.find_preview_file() is None:
+            return
+        if self.watermark_type.get() == "image" and not os.path.isfile(self.watermark_path.get()):
+            return
+        if self.watermark_type.get() == "text" and not self.watermark_text.get():
+            return
+        try:
+            self.refresh_preview()
+        except Exception:
+            pass
+    
+    def refresh_preview(self):
+        """在缓存的底图上按当前设置重新合成水印并显示"""
         watermark_type = self.watermark_type.get()
         
         # 处理不同的水印类型
@@ -381,37 +682,25 @@ class WatermarkApp:
             text = None
             # 图片水印不使用背景色，但支持圆角
             bg_color = (0, 0, 0, 0)
-            corner_radius = self.corner_radius.get()
         else:
             watermark_path = None
             text = self.watermark_text.get()
             bg_color = self.bg_color
-            corner_radius = self.corner_radius.get()
-        
-        # 获取水印位置对应的边距
-        margins = self.get_position_margins()
         
-        result = add_watermark(
-            image_files[0], 
-            temp_output, 
+        preview = self.preview_renderer.render(
+            self.find_preview_file(),
+            self.get_canvas_size(),
             watermark_path,
             self.position.get(),
-            margins,
+            self.get_position_margins(),
             self.scale.get(),
             text,
             self.font_size.get(),
             self.font_color,
             bg_color,
-            corner_radius
+            self.corner_radius.get()
         )
-        
-        if result:
-            # 显示预览图
-            self.display_preview(temp_output)
-            self.status_var.set("预览生成成功")
-        else:
-            messagebox.showerror("错误", "预览生成失败")
-            self.status_var.set("预览生成失败")
+        self.display_preview(preview)
     
     def get_position_margins(self):
         """根据位置返回合适的边距"""
@@ -426,27 +715,24 @@ class WatermarkApp:
             # 注意：后续可以扩展此功能，为每个位置提供独立的边距调整
             return self.margin_bottom.get()
     
-    def display_preview(self, image_path):
+    def get_canvas_size(self):
+        """预览画布的当前尺寸"""
+        canvas_width = self.preview_canvas.winfo_width()
+        canvas_height = self.preview_canvas.winfo_height()
+        
+        if canvas_width <= 1:  # 如果画布尚未完全初始化
+            canvas_width = 300
+            canvas_height = 300
+        return canvas_width, canvas_height
+    
+    def display_preview(self, img):
         try:
-            # 打开图片
-            img = Image.open(image_path)
-            
-            # 调整图片大小以适应画布
-            canvas_width = self.preview_canvas.winfo_width()
-            canvas_height = self.preview_canvas.winfo_height()
+            # 预览图已按画布大小缩小
+            canvas_width, canvas_height = self.get_canvas_size()
             
-            if canvas_width <= 1:  # 如果画布尚未完全初始化
-                canvas_width = 300
-                canvas_height = 300
-            
-            # 计算缩放比例
-            img_width, img_height = img.size
-            ratio = min(canvas_width / img_width, canvas_height / img_height)
-            new_width = int(img_width * ratio)
-            new_height = int(img_height * ratio)
-            
-            # 缩放图片
-            img = img.resize((new_width, new_height), Image.LANCZOS)
+            # Tkinter 只能显示RGB、RGBA等模式
+            if img.mode not in ('RGB', 'RGBA', 'L'):
+                img = img.convert('RGB')
             
             # 转换为Tkinter可用的格式
             photo_img = ImageTk.PhotoImage(img)
@@ -532,90 +818,212 @@ class WatermarkApp:
     
     def process_images(self):
         # 验证输入
-        if not self.validate_inputs():
+        if self.batch_control is not None or not self.validate_inputs():
             return
         
-        # 在新线程中处理图片，避免界面冻结
+        # 在主线程中读取所有设置，后台线程不访问Tk变量
+        watermark_type = self.watermark_type.get()
+        if watermark_type == "image":
+            watermark_path = self.watermark_path.get()
+            text = None
+            # 图片水印不使用背景色，但支持圆角
+            bg_color = (0, 0, 0, 0)
+        else:
+            watermark_path = None
+            text = self.watermark_text.get()
+            bg_color = self.bg_color
+        
+        settings = {
+            'input_dir': self.input_dir.get(),
+            'output_dir': self.output_dir.get(),
+            'watermark_path': watermark_path,
+            'position': self.position.get(),
+            'margins': self.get_position_margins(),
+            'scale': self.scale.get(),
+            'text': text,
+            'font_size': self.font_size.get(),
+            'font_color': self.font_color,
+            'bg_color': bg_color,
+            'corner_radius': self.corner_radius.get(),
+            'workers': self.workers.get(),
+            'recursive': self.recursive.get()
+        }
+        
+        # 每次运行使用新的队列，上一次运行的计数线程不会影响本次进度
+        self.batch_control = BatchControl()
+        self.progress_queue = queue.Queue()
+        self.batch_total = None
+        self.batch_completed = 0
+        self.batch_started = time.monotonic()
+        self.paused_since = None
+        self.paused_time = 0
+        self.set_processing(True)
+        self.progress_var.set(0)
         self.status_var.set("正在处理...")
-        threading.Thread(target=self._process_images_thread).start()
+        
+        # 在新线程中处理图片，避免界面冻结
+        threading.Thread(target=self._process_images_thread,
+                         args=(settings, self.batch_control, self.progress_queue)).start()
+        self.root.after(PROGRESS_INTERVAL_MS, self.drain_progress)
+    
+    def set_processing(self, processing):
+        """切换批量处理、暂停和取消按钮的可用状态"""
+        self.process_button.config(state=tk.DISABLED if processing else tk.NORMAL)
+        self.pause_button.config(text="暂停", state=tk.NORMAL if processing else tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL if processing else tk.DISABLED)
+    
+    def active_time(self):
+        """本次批量处理除去暂停时间的耗时（秒）"""
+        elapsed = time.monotonic() - self.batch_started - self.paused_time
+        if self.paused_since is not None:
+            elapsed -= time.monotonic() - self.paused_since
+        return elapsed
+    
+    def toggle_pause(self):
+        """暂停或继续批量处理，暂停在两张图片之间生效"""
+        control = self.batch_control
+        if control is None or control.cancelled:
+            return
+        if control.paused:
+            self.paused_time += time.monotonic() - self.paused_since
+            self.paused_since = None
+            control.resume()
+            self.pause_button.config(text="暂停")
+        else:
+            self.paused_since = time.monotonic()
+            control.pause()
+            self.pause_button.config(text="继续")
+        self.update_progress()
+    
+    def cancel_processing(self):
+        """取消批量处理，正在处理的图片处理完后停止"""
+        control = self.batch_control
+        if control is None or control.cancelled:
+            return
+        if self.paused_since is not None:
+            self.paused_time += time.monotonic() - self.paused_since
+            self.paused_since = None
+        control.cancel()
+        self.pause_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.update_progress()
     
-    def _process_images_thread(self):
+    def drain_progress(self):
+        """在主线程中读取后台线程的进度事件并刷新界面，按固定间隔重复"""
+        finished = None
+        latest = None
         try:
-            input_dir = self.input_dir.get()
-            output_dir = self.output_dir.get()
-            watermark_type = self.watermark_type.get()
-            
-            # 处理不同的水印类型
-            if watermark_type == "image":
-                watermark_path = self.watermark_path.get()
-                text = None
-                # 图片水印不使用背景色，但支持圆角
-                bg_color = (0, 0, 0, 0)
-                corner_radius = self.corner_radius.get()
-            else:
-                watermark_path = None
-                text = self.watermark_text.get()
-                bg_color = self.bg_color
-                corner_radius = self.corner_radius.get()
-            
-            position = self.position.get()
-            margins = self.get_position_margins()
-            scale = self.scale.get()
-            font_size = self.font_size.get()
-            font_color = self.font_color
+            while True:
+                event = self.progress_queue.get_nowait()
+                if event[0] == 'total':
+                    self.batch_total = event[1]
+                elif event[0] == 'result':
+                    self.batch_completed += 1
+                    latest = event[1]
+                else:
+                    finished = event
+        except queue.Empty:
+            pass
+        
+        if finished is not None:
+            self.finish_processing(finished)
+            return
+        self.update_progress(latest)
+        self.root.after(PROGRESS_INTERVAL_MS, self.drain_progress)
+    
+    def update_progress(self, latest=None):
+        """显示已处理数量、处理速度和预计剩余时间"""
+        control = self.batch_control
+        completed = self.batch_completed
+        total = self.batch_total
+        
+        if control.cancelled:
+            state = "正在取消"
+        elif control.paused:
+            state = "已暂停"
+        else:
+            state = "处理中"
+        parts = [f"{state}: {completed}/{total}" if total else f"{state}: {completed}"]
+        
+        elapsed = self.active_time()
+        if completed and elapsed > 0:
+            rate = completed / elapsed
+            parts.append(f"{rate:.1f} 张/秒")
+            if total and total > completed:
+                parts.append(f"剩余约 {format_duration((total - completed) / rate)}")
+        if latest is not None:
+            parts.append(os.path.basename(latest))
+        self.status_var.set(" - ".join(parts))
+        
+        if total:
+            self.progress_var.set(min(completed / total * 100, 100))
+    
+    def finish_processing(self, event):
+        """批量处理结束后恢复按钮状态并显示结果"""
+        control = self.batch_control
+        self.batch_control = None
+        self.set_processing(False)
+        
+        if event[0] == 'error':
+            self.status_var.set(f"处理出错: {event[1]}")
+            messagebox.showerror("错误", f"处理过程中发生错误: {event[1]}")
+            return
+        
+        _, processed, successful, output_dir = event
+        failed = processed - successful
+        if control.cancelled:
+            self.status_var.set(f"已取消！成功: {successful}, 失败: {failed}")
+            messagebox.showinfo("已取消", f"批量处理已取消！\n成功: {successful}\n失败: {failed}\n处理后的图片保存在: {output_dir}")
+            return
+        
+        self.progress_var.set(100)
+        self.status_var.set(f"处理完成！成功: {successful}, 失败: {failed}，用时 {format_duration(self.active_time())}")
+        messagebox.showinfo("完成", f"图片处理完成！\n成功: {successful}\n失败: {failed}\n处理后的图片保存在: {output_dir}")
+    
+    def _process_images_thread(self, settings, control, progress):
+        """后台处理线程：只通过 progress 队列与界面通信"""
+        try:
+            input_dir = settings['input_dir']
+            output_dir = settings['output_dir']
+            recursive = settings['recursive']
             
             # 确保输出目录存在
             if not os.path.exists(output_dir):
                 os.makedirs(output_dir)
             
-            # 支持的图片格式
-            image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp']
+            # 水印在整个批次中只准备一次
+            plan = make_plan(settings['watermark_path'], settings['scale'], settings['text'], settings['font_size'],
+                             settings['font_color'], settings['bg_color'], settings['corner_radius'])
             
-            # 获取所有图片文件
-            image_files = []
-            for filename in os.listdir(input_dir):
-                input_path = os.path.join(input_dir, filename)
-                if os.path.isdir(input_path):
-                    continue
-                ext = os.path.splitext(filename)[1].lower()
-                if ext in image_extensions:
-                    image_files.append((filename, input_path))
+            options = {key: settings[key] for key in ('watermark_path', 'position', 'margins', 'scale', 'text',
+                                                        'font_size', 'font_color', 'bg_color', 'corner_radius')}
             
-            # 统计信息
-            total = len(image_files)
-            successful = 0
-            failed = 0
+            # 界面进程中始终有其他线程在运行，进程池不能用 fork 创建，否则子进程可能继承被持有的锁而死锁
+            workers = resolve_workers(settings['workers'])
+            executor = create_executor(options, plan, workers, mp_context=safe_mp_context()) if workers > 1 else None
             
-            # 更新进度条范围
-            self.progress_var.set(0)
+            # 总数由后台计数线程得出，处理不必等待计数完成
+            def count_images():
+                progress.put(('total', sum(1 for _ in iter_images(input_dir, recursive, skip_dirs=[output_dir]))))
             
-            # 处理每个图片
-            for i, (filename, input_path) in enumerate(image_files):
-                # 更新状态
-                self.status_var.set(f"处理中: {i+1}/{total} - {filename}")
-                
-                output_path = os.path.join(output_dir, filename)
-                
-                # 添加水印
-                if add_watermark(input_path, output_path, watermark_path, position, margins, scale, text, font_size, font_color, bg_color, corner_radius):
-                    successful += 1
-                else:
-                    failed += 1
-                
-                # 更新进度条
-                progress = (i + 1) / total * 100
-                self.progress_var.set(progress)
-                
-                # 更新UI
-                self.root.update_idletasks()
+            threading.Thread(target=count_images, daemon=True).start()
             
-            # 完成处理
-            self.status_var.set(f"处理完成！成功: {successful}, 失败: {failed}")
-            messagebox.showinfo("完成", f"图片处理完成！\n成功: {successful}\n失败: {failed}\n处理后的图片保存在: {output_dir}")
+            def on_result(input_path, output_path, ok):
+                progress.put(('result', input_path, ok))
             
+            # 边查找边处理图片，结果按完成顺序返回
+            tasks = iter_tasks(input_dir, output_dir, recursive=recursive)
+            try:
+                # 与命令行相同，同时处理的图片估计内存之和不超过物理内存的一半
+                processed, successful = run_batch(tasks, options, plan, workers, on_result, default_memory_limit(),
+                                                  control=control, executor=executor)
+            finally:
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            progress.put(('done', processed, successful, output_dir))
+        
         except Exception as e:
-            self.status_var.set(f"处理出错: {e}")
-            messagebox.showerror("错误", f"处理过程中发生错误: {e}")
+            progress.put(('error', e))
     
     def update_color_from_hex(self, color_type):
         """根据十六进制颜色值更新颜色"""
@@ -694,4 +1102,8 @@ class WatermarkApp:
 if __name__ == "__main__":
     root = tk.Tk()
     app = WatermarkApp(root)
-    root.mainloop() 
\ No newline at end of file
+    root.mainloop()
+    app.thumbnail_strip.close()
+    # 关闭窗口时取消未完成的批量处理，正在处理的图片处理完后退出
+    if app.batch_control is not None:
+        app.batch_control.cancel() 
\ No newline at end of file
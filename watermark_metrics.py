@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""批量处理的分阶段计时与运行报告
+
+开启后记录每张图片在各阶段的耗时：
+
+    discover  查找文件（包括增量和断点续传的检查）
+    read      读取原始数据
+    decode    解码为工作模式
+    prepare   准备水印（缓存命中时几乎为0）
+    composite 合成水印
+    encode    编码为输出格式
+    write     原子地写入磁盘
+
+每个阶段的耗时记录在按对数分桶的直方图中，内存占用与图片数量无关，
+p50/p95/p99 的相对误差不超过约2.5%。运行结束后可以写出JSON报告和
+Prometheus textfile（供 node_exporter 的 textfile collector 采集）。
+"""
+
+import sys
+import math
+import json
+import time
+import heapq
+import itertools
+import threading
+import unicodedata
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，不报告峰值内存
+    resource = None
+
+STAGES = ('discover', 'read', 'decode', 'prepare', 'composite', 'encode', 'write')
+
+# 报告的分位数
+QUANTILES = (0.5, 0.95, 0.99)
+
+# print_summary 各列的显示宽度，第一列左对齐，其余右对齐
+SUMMARY_COLUMNS = (10, 8, 10, 10, 10, 12)
+
+def _display_width(text):
+    """终端中的显示宽度，中文等全角字符占两列"""
+    return sum(2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1 for char in text)
+
+def _format_row(cells):
+    """按 SUMMARY_COLUMNS 对齐一行，表头和数据行使用同一组宽度"""
+    parts = []
+    for index, (cell, width) in enumerate(zip(cells, SUMMARY_COLUMNS)):
+        padding = ' ' * max(width - _display_width(cell), 0)
+        parts.append(cell + padding if index == 0 else padding + cell)
+    return ''.join(parts)
+
+class StageClock:
+    """把两次 lap 之间的耗时累加到 timings[阶段]"""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+        self.last = now
+
+class Histogram:
+    """按对数分桶的耗时直方图
+
+    参数:
+        ratio: 相邻桶边界的比例，决定分位数的相对误差
+        smallest: 最小的桶边界（秒），更短的耗时计入第一个桶
+    """
+
+    def __init__(self, ratio=1.05, smallest=1e-6):
+        self.ratio = ratio
+        self.smallest = smallest
+        self._log_ratio = math.log(ratio)
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        index = 0
+        if seconds > self.smallest:
+            index = int(math.log(seconds / self.smallest) / self._log_ratio) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        """估计分位数：取所在桶的几何中点，并限制在实际的最小值和最大值之间"""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                if index == 0:
+                    value = self.smallest
+                else:
+                    value = self.smallest * self.ratio ** (index - 0.5)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+def peak_rss():
+    """当前进程和已结束子进程中最大的峰值常驻内存（字节），无法获取时返回None"""
+    if resource is None:
+        return None
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {'self': self_rss * unit, 'children': children_rss * unit}
+
+class RunMetrics:
+    """一次批量处理的计时统计
+
+    查找和读写阶段在主进程的各个线程中通过 add 记录，解码到编码阶段由处理
+    图片的进程计时后通过 record 一并提交。
+
+    参数:
+        slowest: 报告中保留的最慢文件数量
+    """
+
+    def __init__(self, slowest=10):
+        self.slowest_count = slowest
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.file_histogram = Histogram()
+        self.successful = 0
+        self.failed = 0
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.elapsed = None
+        self.cache = None
+        self._pending = {}
+        self._slowest = []
+        # 耗时相同时按记录顺序比较，不会比较到路径和各阶段耗时
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def timed_tasks(self, tasks):
+        """包装任务迭代器，把产出每个任务所用的时间记为该文件的查找耗时"""
+        tasks = iter(tasks)
+        while True:
+            start = time.perf_counter()
+            task = next(tasks, None)
+            if task is None:
+                return
+            self.add(task[0], 'discover', time.perf_counter() - start)
+            yield task
+
+    def add(self, input_path, stage, seconds):
+        """记录一张图片在某个阶段的耗时，record 时合并"""
+        with self._lock:
+            timings = self._pending.setdefault(input_path, {})
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def record(self, input_path, ok, timings=None):
+        """一张图片处理完成，合并各阶段的耗时"""
+        with self._lock:
+            merged = self._pending.pop(input_path, {})
+            for stage, seconds in (timings or {}).items():
+                merged[stage] = merged.get(stage, 0.0) + seconds
+            for stage, seconds in merged.items():
+                self.histograms[stage].add(seconds)
+            total = sum(merged.values())
+            self.file_histogram.add(total)
+            if ok:
+                self.successful += 1
+            else:
+                self.failed += 1
+            # 小顶堆只保留最慢的若干个文件
+            entry = (total, next(self._sequence), input_path, merged)
+            if len(self._slowest) < self.slowest_count:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest and total > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def finish(self, plan=None):
+        """结束计时，记录水印缓存的命中情况"""
+        self.elapsed = time.perf_counter() - self._start
+        if plan is not None:
+            self.cache = {'hits': plan.hits, 'misses': plan.misses, 'hit_rate': round(plan.hit_rate, 4)}
+
+    def summary(self):
+        """报告内容，耗时以毫秒为单位"""
+        def stats(histogram):
+            data = {'count': histogram.count, 'total_ms': round(histogram.sum * 1000, 3),
+                    'mean_ms': round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+                    'max_ms': round((histogram.max or 0.0) * 1000, 3)}
+            for q in QUANTILES:
+                data[f"p{int(q * 100)}_ms"] = round(histogram.quantile(q) * 1000, 3)
+            return data
+
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self._start
+        processed = self.successful + self.failed
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed_seconds': round(elapsed, 3),
+            'files': {'successful': self.successful, 'failed': self.failed},
+            'throughput': round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+            'stages': {stage: stats(histogram) for stage, histogram in self.histograms.items() if histogram.count},
+            'per_file': stats(self.file_histogram),
+            'cache': self.cache,
+            'peak_rss_bytes': peak_rss(),
+            'slowest': [
+                {'input': input_path, 'total_ms': round(total * 1000, 3),
+                 'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}}
+                for total, _, input_path, timings in sorted(self._slowest, reverse=True)
+            ]
+        }
+
+    def print_summary(self):
+        """打印各阶段的分位数"""
+        stages = self.summary()['stages']
+        print(f"\n各阶段耗时（毫秒）:")
+        print(_format_row(('阶段', '次数', 'p50', 'p95', 'p99', '合计(s)')))
+        for stage, data in stages.items():
+            print(_format_row((stage, str(data['count']), f"{data['p50_ms']:.2f}", f"{data['p95_ms']:.2f}",
+                               f"{data['p99_ms']:.2f}", f"{data['total_ms'] / 1000:.2f}")))
+
+    def write_report(self, path, extra=None):
+        """写出JSON报告，extra 为附加的运行信息（如输入输出目录）"""
+        from watermark_core import atomic_write
+        report = dict(extra or {})
+        report.update(self.summary())
+        data = json.dumps(report, ensure_ascii=False, indent=2).encode('utf-8')
+        atomic_write(path, lambda f: f.write(data))
+
+    def write_prometheus(self, path):
+        """写出Prometheus textfile，原子替换，采集时不会读到写了一半的文件"""
+        from watermark_core import atomic_write
+        summary = self.summary()
+        lines = [
+            '# HELP watermark_stage_seconds 每张图片在各处理阶段的耗时',
+            '# TYPE watermark_stage_seconds summary'
+        ]
+        for stage, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            for q in QUANTILES:
+                lines.append(f'watermark_stage_seconds{{stage="{stage}",quantile="{q}"}} {histogram.quantile(q):.6f}')
+            lines.append(f'watermark_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'watermark_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines += [
+            '# HELP watermark_files_total 处理的图片数量',
+            '# TYPE watermark_files_total counter',
+            f'watermark_files_total{{status="successful"}} {self.successful}',
+            f'watermark_files_total{{status="failed"}} {self.failed}',
+            '# HELP watermark_run_duration_seconds 批量处理的总耗时',
+            '# TYPE watermark_run_duration_seconds gauge',
+            f"watermark_run_duration_seconds {summary['elapsed_seconds']}",
+            '# HELP watermark_last_run_timestamp_seconds 批量处理开始的时间',
+            '# TYPE watermark_last_run_timestamp_seconds gauge',
+            f"watermark_last_run_timestamp_seconds {self.started:.3f}"
+        ]
+        if self.cache is not None:
+            lines += [
+                '# HELP watermark_cache_hits_total 水印缓存命中次数',
+                '# TYPE watermark_cache_hits_total counter',
+                f"watermark_cache_hits_total {self.cache['hits']}",
+                '# HELP watermark_cache_misses_total 水印缓存未命中次数',
+                '# TYPE watermark_cache_misses_total counter',
+                f"watermark_cache_misses_total {self.cache['misses']}"
+            ]
+        rss = summary['peak_rss_bytes']
+        if rss is not None:
+            lines += [
+                '# HELP watermark_peak_rss_bytes 峰值常驻内存，children 为最大的子进程',
+                '# TYPE watermark_peak_rss_bytes gauge',
+                f'watermark_peak_rss_bytes{{process="self"}} {rss["self"]}',
+                f'watermark_peak_rss_bytes{{process="children"}} {rss["children"]}'
+            ]
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        atomic_write(path, lambda f: f.write(data))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""图形界面的预览渲染
+
+预览完全在内存中完成：JPEG 用 draft 按 1/2、1/4、1/8 的比例直接解码为小图，
+其他格式解码后先用 reduce 按整数倍缩小，再缩放到预览尺寸；水印按同样的
+比例缩放边距和圆角后合成到小图上，不写入任何临时文件。
+
+实时预览使用 PreviewRenderer：缩小后的底图按 (文件, 修改时间, 预览尺寸) 缓存，
+设置变化时只重新合成水印，拖动滑块时也不会重新解码原图。
+"""
+
+import os
+from PIL import Image
+
+from watermark_core import working_mode, make_plan, watermark_image
+
+def load_preview_base(input_path, max_size):
+    """以不超过 max_size 的尺寸解码图片
+
+    参数:
+        input_path: 图片路径
+        max_size: 预览区域的最大尺寸 (width, height)
+    返回:
+        (缩小后的工作模式图片, 相对原图的缩放比例)
+    """
+    with Image.open(input_path) as image:
+        full_width = image.width
+        mode = working_mode(image)
+        # JPEG按不小于预览尺寸的最小比例解码，其他格式忽略
+        image.draft(None, max_size)
+        base = image.convert(mode) if image.mode != mode else image.copy()
+    # reducing_gap 使大图先用 reduce 整数倍缩小，再用LANCZOS缩放到预览尺寸
+    base.thumbnail(max_size, Image.LANCZOS, reducing_gap=2.0)
+    return base, base.width / full_width
+
+def scale_margins(margins, ratio):
+    """按预览的缩放比例换算边距"""
+    if isinstance(margins, dict):
+        return {key: int(round(value * ratio)) for key, value in margins.items()}
+    return int(round(margins * ratio))
+
+def preview_plan(ratio, watermark_path=None, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, font_path=None):
+    """创建预览用的水印计划，圆角半径按 ratio 换算"""
+    corner_radius = int(round(corner_radius * ratio))
+    return make_plan(watermark_path, scale, text, font_size, font_color, bg_color, corner_radius, font_path)
+
+def render_preview(base, ratio, watermark_path=None, position='bottom-right', margins=20, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, font_path=None, plan=None):
+    """在缩小后的底图副本上合成按比例缩放的水印
+
+    水印尺寸本身按图片宽度的比例计算，边距和圆角半径按 ratio 换算，
+    预览与处理原图的结果在比例上一致。plan 为可选的 preview_plan 结果，
+    其余参数与 add_watermark 相同。
+    """
+    if plan is None:
+        plan = preview_plan(ratio, watermark_path, scale, text, font_size, font_color, bg_color, corner_radius, font_path)
+    image = base.copy()
+    watermark_image(image, plan, position, scale_margins(margins, ratio), bg_color, int(round(corner_radius * ratio)))
+    return image
+
+class PreviewRenderer:
+    """实时预览渲染器
+
+    底图每个 (文件, 修改时间, 预览尺寸) 只解码一次；水印计划在水印设置不变时复用，
+    只改变位置或边距时直接重新合成。
+    """
+
+    def __init__(self):
+        self._base_key = None
+        self._base = None
+        self._ratio = 1.0
+        self._plan_key = None
+        self._plan = None
+
+    def load(self, input_path, max_size):
+        """返回缓存的 (底图, 缩放比例)，文件或预览尺寸变化时重新解码"""
+        key = (input_path, os.stat(input_path).st_mtime_ns, tuple(max_size))
+        if key != self._base_key:
+            self._base, self._ratio = load_preview_base(input_path, max_size)
+            self._base_key = key
+        return self._base, self._ratio
+
+    def render(self, input_path, max_size, watermark_path=None, position='bottom-right', margins=20, scale=0.2, text=None, font_size=40, font_color=(255, 255, 255, 128), bg_color=(0, 0, 0, 0), corner_radius=0, font_path=None):
+        """渲染预览图，参数与 add_watermark 相同"""
+        base, ratio = self.load(input_path, max_size)
+        plan_key = (ratio, watermark_path, scale, text, font_size, tuple(font_color), tuple(bg_color), corner_radius, font_path)
+        if plan_key != self._plan_key:
+            self._plan = preview_plan(ratio, watermark_path, scale, text, font_size, font_color, bg_color, corner_radius, font_path)
+            self._plan_key = plan_key
+        return render_preview(base, ratio, position=position, margins=margins, bg_color=bg_color,
+                              corner_radius=corner_radius, plan=self._plan)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""多个节点共享同一个输入输出目录时的分布式任务队列
+
+多台机器（或同一台机器上的多个进程）使用相同的参数处理同一个共享目录时，
+通过队列目录（默认为输出目录中的 .watermark-queue）中的租约文件协调：
+
+    queue.json        队列设置，设置不同的节点不能加入
+    plan.lock         正在查找图片、划分任务块的节点的租约
+    plan.json         划分完成后写入，记录任务块数量
+    chunks/N.json     任务块：按固定顺序查找到的若干个图片的相对路径
+    leases/N.lease    正在处理任务块的节点的租约，处理期间定期更新修改时间
+    done/N.json       已完成的任务块，记录处理节点和失败的图片
+    nodes/节点名      各节点的心跳文件，同时用来读取共享文件系统的当前时间
+
+第一个节点按文件名顺序查找图片并划分任务块，划分出的任务块立即可以被领取。
+每个任务块同一时间只有一个节点持有租约；租约超过 lease 秒没有更新时视为过期，
+由其他节点重新领取，原节点在下一次更新租约时发现租约已失去，停止处理该任务块。
+划分任务块的节点中断时，其他节点接管后按相同的顺序重新划分，已有的任务块不变。
+
+有图片处理失败的任务块同样标记为已完成，重新运行时不会重试；失败的图片列在
+done/N.json 的 failed 中，删除该文件后重新运行即可重新处理整个任务块。
+
+文件都先写入临时文件再用硬链接发布：目标已存在时 os.link 失败，同一个租约只有
+一个节点能获得，其他节点读到的内容总是完整的。过期的租约通过 os.rename 接管，
+同样只有一个节点成功。时间都以共享文件系统上的修改时间为准，不受各节点时钟偏差影响。
+这里只依赖 link/rename 的原子性，不使用SQLite：SQLite的文件锁在NFS等网络文件系统上不可靠。
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+
+from watermark_files import iter_images, output_path_for, SharedStems
+
+# 队列目录保存在输出目录中，以点开头以免被递归查找当作输入
+QUEUE_DIR_NAME = '.watermark-queue'
+
+# 默认的租约时长（秒）和每个任务块的图片数
+DEFAULT_LEASE = 300
+DEFAULT_CHUNK_SIZE = 500
+
+def _read_json(path):
+    """读取JSON文件，文件不存在或内容无效时返回None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _publish(path, data):
+    """原子地创建内容为 data 的JSON文件，文件已存在时返回False"""
+    directory, filename = os.path.split(path)
+    temp_path = os.path.join(directory, f".{filename}.{uuid.uuid4().hex}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    try:
+        os.link(temp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(temp_path)
+
+class WorkQueue:
+    """共享文件系统上基于租约的任务队列
+
+    参数:
+        queue_dir: 队列目录，所有节点必须指向同一个目录
+        lease: 租约时长（秒），节点每隔 lease/3 秒更新一次租约
+        node_id: 节点名，默认为 主机名-进程号
+    """
+
+    def __init__(self, queue_dir, lease=DEFAULT_LEASE, node_id=None):
+        self.queue_dir = queue_dir
+        self.lease = lease
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = min(lease / 10, 2.0)
+        for name in ('chunks', 'leases', 'done', 'nodes'):
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+        self._node_path = os.path.join(queue_dir, 'nodes', self.node_id)
+        self._plan_path = os.path.join(queue_dir, 'plan.json')
+        self._plan_lock = os.path.join(queue_dir, 'plan.lock')
+        # 已知完成的任务块，不再检查
+        self.finished = set()
+        self._cursor = 0
+
+    def _path(self, kind, index, ext='.json'):
+        return os.path.join(self.queue_dir, kind, f"{index:08d}{ext}")
+
+    def lease_path(self, index):
+        return self._path('leases', index, '.lease')
+
+    def now(self):
+        """共享文件系统的当前时间：更新本节点心跳文件的修改时间后读取"""
+        with open(self._node_path, 'a'):
+            pass
+        os.utime(self._node_path)
+        return os.stat(self._node_path).st_mtime
+
+    def join(self, settings):
+        """加入队列：第一个节点写入队列设置，之后的节点检查设置是否相同"""
+        path = os.path.join(self.queue_dir, 'queue.json')
+        _publish(path, settings)
+        existing = _read_json(path)
+        if existing != settings:
+            raise ValueError(f"队列 {self.queue_dir} 使用不同的水印设置或查找条件创建，"
+                             f"请使用相同的参数，或删除该目录后重新开始")
+
+    def acquire(self, path):
+        """领取租约，租约已过期时接管，返回租约令牌；已被其他节点持有时返回None"""
+        token = f"{self.node_id}/{uuid.uuid4().hex}"
+        if _publish(path, token):
+            return token
+        try:
+            if self.now() - os.stat(path).st_mtime <= self.lease:
+                return None
+        except FileNotFoundError:
+            # 租约刚好被释放
+            return token if _publish(path, token) else None
+
+        # 租约已过期：先重命名，多个节点同时接管时只有一个成功
+        expired = f"{path}.{uuid.uuid4().hex}.expired"
+        try:
+            os.rename(path, expired)
+        except FileNotFoundError:
+            return None
+        if self.now() - os.stat(expired).st_mtime <= self.lease:
+            # 重命名的是其他节点刚刚接管的新租约，还给它
+            try:
+                os.link(expired, path)
+            except FileExistsError:
+                pass
+            os.remove(expired)
+            return None
+        os.remove(expired)
+        print(f"租约已过期，重新领取: {os.path.basename(path)}")
+        return token if _publish(path, token) else None
+
+    def renew(self, path, token):
+        """更新租约的修改时间，租约已被其他节点接管时返回False"""
+        if _read_json(path) != token:
+            return False
+        os.utime(path)
+        return True
+
+    def release(self, path, token):
+        """释放仍由本节点持有的租约"""
+        if _read_json(path) == token:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def chunk_count(self):
+        """任务块总数，仍在划分时返回None"""
+        plan = _read_json(self._plan_path)
+        return plan['chunks'] if plan is not None else None
+
+    def acquire_plan(self):
+        """领取划分任务块的租约，已经划分完成或其他节点正在划分时返回None"""
+        if self.chunk_count() is not None:
+            return None
+        return self.acquire(self._plan_lock)
+
+    def plan(self, files, chunk_size, token):
+        """按顺序把 files 中的相对路径划分为任务块，每个任务块写入后立即可以领取
+
+        files 的顺序必须每次都相同，接管划分的节点写出的任务块与已有的任务块一致，
+        已存在的任务块不会被覆盖。
+        """
+        index = 0
+        chunk = []
+        renewed = time.monotonic()
+        try:
+            for rel_path in files:
+                chunk.append(rel_path)
+                if len(chunk) >= chunk_size:
+                    _publish(self._path('chunks', index), {'files': chunk})
+                    index += 1
+                    chunk = []
+                if time.monotonic() - renewed > self.lease / 3:
+                    if not self.renew(self._plan_lock, token):
+                        print("划分任务块的租约已被其他节点接管，停止划分")
+                        return
+                    renewed = time.monotonic()
+            if chunk:
+                _publish(self._path('chunks', index), {'files': chunk})
+                index += 1
+            _publish(self._plan_path, {'chunks': index})
+            print(f"已划分 {index} 个任务块")
+        except OSError as e:
+            print(f"划分任务块时出错: {e}")
+        finally:
+            self.release(self._plan_lock, token)
+
+    def _try_claim(self, index):
+        """尝试领取一个任务块，返回 (令牌, 相对路径列表)，已完成或被其他节点持有时返回None"""
+        if os.path.exists(self._path('done', index)):
+            self.finished.add(index)
+            return None
+        token = self.acquire(self.lease_path(index))
+        if token is None:
+            return None
+        # 领取前的一瞬间可能刚被其他节点完成
+        chunk = _read_json(self._path('chunks', index))
+        if chunk is None or os.path.exists(self._path('done', index)):
+            self.finished.add(index)
+            self.release(self.lease_path(index), token)
+            return None
+        return token, chunk['files']
+
+    def claim(self, on_idle=None):
+        """领取下一个未完成的任务块，没有可领取的任务块时等待
+
+        参数:
+            on_idle: 可选的回调，等待期间调用，例如接管中断的任务块划分
+        返回:
+            (序号, 租约令牌, 相对路径列表)，所有任务块都已完成时返回None
+        """
+        while True:
+            count = self.chunk_count()
+            # 先从上次领取的位置向后查找，没有时再从头查找被跳过或租约过期的任务块
+            for start, stop in ((self._cursor, None), (0, self._cursor)):
+                index = start
+                while (stop is None or index < stop) and (count is None or index < count):
+                    if index not in self.finished:
+                        if not os.path.exists(self._path('chunks', index)):
+                            break
+                        claimed = self._try_claim(index)
+                        if claimed is not None:
+                            self._cursor = index + 1
+                            return (index,) + claimed
+                    index += 1
+
+            count = self.chunk_count()
+            if count is not None and len(self.finished) >= count:
+                return None
+            if on_idle is not None:
+                on_idle()
+            time.sleep(self.poll_interval)
+
+    def complete(self, index, token, result):
+        """标记任务块已完成并释放租约，result 记录在完成标记中
+
+        返回是否已标记；租约已被其他节点接管时不标记，由接管的节点完成。
+        """
+        try:
+            owned = self.renew(self.lease_path(index), token)
+        except OSError:
+            owned = False
+        if not owned:
+            return False
+        _publish(self._path('done', index), dict(result, node=self.node_id))
+        self.finished.add(index)
+        self.release(self.lease_path(index), token)
+        return True
+
+class LeaseKeeper(threading.Thread):
+    """处理任务块期间在后台定期更新租约，租约失去时调用 on_lost"""
+
+    def __init__(self, queue, path, token, on_lost):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.path = path
+        self.token = token
+        self.on_lost = on_lost
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.queue.lease / 3):
+            try:
+                owned = self.queue.renew(self.path, self.token)
+            except OSError:
+                owned = False
+            if not owned:
+                self.on_lost()
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def run_node(input_dir, output_dir, run, fingerprint, filters=None, output_ext=None, queue_dir=None, lease=DEFAULT_LEASE, chunk_size=DEFAULT_CHUNK_SIZE, node_id=None):
+    """作为一个节点参与共享队列的处理，直到队列中的所有任务块都已完成
+
+    参数:
+        input_dir: 输入目录，所有节点指向同一个共享目录（挂载路径可以不同）
+        output_dir: 输出目录，所有节点指向同一个共享目录
+        run: 处理函数 run(tasks, control, on_result)，返回 (total, successful)，
+            应把 control 和 on_result 传给批量处理引擎；租约失去时 control 被取消
+        fingerprint: 水印设置的指纹，与文件查找条件一起写入队列设置
+        filters: iter_images 的过滤参数（recursive、include、exclude、min_size、max_size）
+        output_ext: 输出文件的扩展名，None表示与输入相同
+        queue_dir: 队列目录，默认为输出目录中的 QUEUE_DIR_NAME
+        lease: 租约时长（秒）
+        chunk_size: 每个任务块的图片数
+        node_id: 节点名，默认为 主机名-进程号
+    返回:
+        (total, successful)，只包含本节点处理的图片
+    """
+    from watermark_batch import BatchControl
+
+    filters = dict(filters or {})
+    queue = WorkQueue(queue_dir or os.path.join(output_dir, QUEUE_DIR_NAME), lease, node_id)
+    queue.join({'fingerprint': fingerprint, 'chunk_size': chunk_size, 'output_ext': output_ext,
+                'filters': {key: value for key, value in filters.items() if value}})
+    print(f"节点 {queue.node_id} 已加入队列 {queue.queue_dir}")
+
+    planner = None
+
+    def start_planning():
+        # 没有节点在划分任务块、或划分的节点已中断时，由本节点划分
+        nonlocal planner
+        if planner is not None and planner.is_alive():
+            return
+        token = queue.acquire_plan()
+        if token is None:
+            return
+        files = (rel_path for _, rel_path in iter_images(
+            input_dir, skip_dirs=[output_dir, queue.queue_dir], sort=True, **filters))
+        planner = threading.Thread(target=queue.plan, args=(files, chunk_size, token), daemon=True)
+        planner.start()
+
+    start_planning()
+    # 输出文件名只取决于输入目录的内容，与任务块的划分无关
+    shared_stems = SharedStems(input_dir) if output_ext else None
+    total = 0
+    successful = 0
+    created = set()
+    while True:
+        claimed = queue.claim(on_idle=start_planning)
+        if claimed is None:
+            break
+        index, token, rel_paths = claimed
+
+        tasks = []
+        names = {}
+        for rel_path in rel_paths:
+            input_path = os.path.join(input_dir, *rel_path.split('/'))
+            output_path = output_path_for(output_dir, rel_path, output_ext, shared_stems)
+            output_subdir = os.path.dirname(output_path)
+            if output_subdir not in created:
+                os.makedirs(output_subdir, exist_ok=True)
+                created.add(output_subdir)
+            tasks.append((input_path, output_path))
+            names[input_path] = rel_path
+
+        failed = []
+
+        def on_result(input_path, output_path, ok):
+            if not ok:
+                failed.append(names[input_path])
+
+        control = BatchControl()
+        keeper = LeaseKeeper(queue, queue.lease_path(index), token, control.cancel)
+        keeper.start()
+        try:
+            chunk_total, chunk_successful = run(tasks, control, on_result)
+        except BaseException:
+            # 中断时立即释放租约，其他节点不必等待租约过期
+            queue.release(queue.lease_path(index), token)
+            raise
+        finally:
+            keeper.stop()
+        total += chunk_total
+        successful += chunk_successful
+        result = {'total': chunk_total, 'successful': chunk_successful, 'failed': failed}
+        if control.cancelled or not queue.complete(index, token, result):
+            print(f"任务块 {index} 的租约已被其他节点接管，停止处理该任务块")
+
+    print(f"队列中的所有任务块都已完成，本节点处理 {total} 张，成功 {successful} 张")
+    return total, successful
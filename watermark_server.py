@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""本地HTTP水印服务
+
+常驻进程接收图片数据，按指定的水印配置添加水印后直接返回结果，省去每次请求
+启动解释器和导入Pillow的开销。水印配置从JSON文件读取，每个子进程启动时
+为所有配置准备好水印素材；解码、合成和编码在进程池中进行，HTTP连接保持长连接。
+
+接口:
+    POST /watermark?profile=名称[&format=webp]  请求体为图片数据，返回添加水印后的图片
+    GET  /profiles                              可用的水印配置名称
+    GET  /metrics                               Prometheus格式的服务指标
+    GET  /healthz                               健康检查
+
+用法:
+    python watermark_server.py --profiles profiles.json --port 8080
+    python watermark_server.py --watermark logo.png --port 8080
+    curl --data-binary @photo.jpg "http://127.0.0.1:8080/watermark?profile=default" -o out.jpg
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image
+
+from watermark_core import set_max_pixels
+from watermark_api import Watermarker, WatermarkError, InvalidSettingsError, DecodeError, ImageTooLargeError
+from watermark_batch import resolve_workers, safe_mp_context
+from watermark_encode import Encoder, OUTPUT_FORMATS
+from watermark_files import parse_size
+from watermark_metrics import Histogram, QUANTILES
+
+# 默认的请求体大小上限
+DEFAULT_MAX_REQUEST_BYTES = 50 * 1024 * 1024
+
+# 配置文件中可用的键，与命令行参数同名
+PROFILE_KEYS = ('watermark', 'text', 'font', 'font_size', 'position', 'margin_bottom', 'margin_right', 'scale',
+                'opacity', 'bg_color', 'corner_radius', 'output_format', 'profile', 'quality', 'lossless', 'max_bytes')
+
+# 处理错误对应的HTTP状态码，按顺序匹配
+ERROR_STATUS = ((ImageTooLargeError, 413), (DecodeError, 400), (WatermarkError, 422), (BrokenProcessPool, 503))
+
+def parse_hex_color(value, alpha):
+    """把 #RRGGBB 转换为RGBA元组"""
+    value = value.lstrip('#')
+    if len(value) != 6:
+        raise ValueError(f"无效的颜色: #{value}")
+    return (int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16), alpha)
+
+def profile_options(settings, base_dir='.'):
+    """把一个水印配置转换为 Watermarker 的参数
+
+    参数:
+        settings: 配置字典，键与命令行参数相同（见 PROFILE_KEYS）
+        base_dir: 水印图片和字体的相对路径相对于该目录
+    """
+    unknown = sorted(set(settings) - set(PROFILE_KEYS))
+    if unknown:
+        raise ValueError(f"未知的配置项: {', '.join(unknown)}")
+
+    def resolve(path):
+        return os.path.join(base_dir, path) if path and not os.path.isabs(path) else path
+
+    opacity = settings.get('opacity', 128)
+    max_bytes = settings.get('max_bytes')
+    font = settings.get('font')
+    if font and os.path.exists(resolve(font)):
+        font = resolve(font)
+    return {
+        'watermark_path': resolve(settings.get('watermark')),
+        'text': settings.get('text'),
+        'position': settings.get('position', 'bottom-right'),
+        'margins': {'bottom': settings.get('margin_bottom', 20), 'right': settings.get('margin_right', 20)},
+        'scale': settings.get('scale', 0.2),
+        'font_size': settings.get('font_size', 40),
+        'font_color': (255, 255, 255, opacity),
+        'bg_color': parse_hex_color(settings.get('bg_color', '#000000'), opacity),
+        'corner_radius': settings.get('corner_radius', 0),
+        'font_path': font,
+        'encoder': Encoder(settings.get('profile', 'default'), settings.get('output_format'), settings.get('quality'),
+                           settings.get('lossless', False),
+                           parse_size(max_bytes) if max_bytes is not None else None)
+    }
+
+def load_profiles(path):
+    """读取水印配置文件: {名称: 配置}，返回 {名称: Watermarker 参数}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        profiles = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return {name: profile_options(settings, base_dir) for name, settings in profiles.items()}
+
+# 子进程中按配置名称准备好的水印处理器，由 _init_worker 设置
+_watermarkers = {}
+
+def _init_worker(profiles, max_pixels=None):
+    """进程池初始化函数：每个子进程为所有配置准备一次水印"""
+    global _watermarkers
+    set_max_pixels(max_pixels)
+    _watermarkers = {name: Watermarker(**options) for name, options in profiles.items()}
+
+def _apply(name, data, output_format=None):
+    """在子进程中给图片数据添加水印，返回 (输出数据, 输出格式)"""
+    output = _watermarkers[name].apply_bytes(data, output_format)
+    if output_format is None:
+        # 输出格式由配置或输入格式决定，只读取文件头即可得到
+        output_format = Image.open(io.BytesIO(output)).format
+    return output, output_format
+
+class ServerMetrics:
+    """服务的请求计数和耗时统计"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.in_flight = 0
+        self.latency = Histogram()
+        self.compute = Histogram()
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, profile, status, seconds, bytes_in=0, bytes_out=0, compute_seconds=None):
+        with self._lock:
+            self.in_flight -= 1
+            key = (profile or '', status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.latency.add(seconds)
+            if compute_seconds is not None:
+                self.compute.add(compute_seconds)
+
+    def prometheus(self, workers):
+        """Prometheus文本格式的指标"""
+        with self._lock:
+            lines = [
+                '# HELP watermark_http_requests_total 按水印配置和状态码统计的请求数',
+                '# TYPE watermark_http_requests_total counter'
+            ]
+            for (profile, status), count in sorted(self.requests.items()):
+                lines.append(f'watermark_http_requests_total{{profile="{profile}",status="{status}"}} {count}')
+            for name, histogram, text in (('watermark_http_request_seconds', self.latency, '请求的总耗时'),
+                                          ('watermark_http_compute_seconds', self.compute, '进程池中添加水印的耗时（含排队）')):
+                lines += [f'# HELP {name} {text}', f'# TYPE {name} summary']
+                for q in QUANTILES:
+                    lines.append(f'{name}{{quantile="{q}"}} {histogram.quantile(q):.6f}')
+                lines += [f'{name}_sum {histogram.sum:.6f}', f'{name}_count {histogram.count}']
+            lines += [
+                '# HELP watermark_http_received_bytes_total 收到的图片数据字节数',
+                '# TYPE watermark_http_received_bytes_total counter',
+                f'watermark_http_received_bytes_total {self.bytes_in}',
+                '# HELP watermark_http_sent_bytes_total 返回的图片数据字节数',
+                '# TYPE watermark_http_sent_bytes_total counter',
+                f'watermark_http_sent_bytes_total {self.bytes_out}',
+                '# HELP watermark_http_in_flight 正在处理的请求数',
+                '# TYPE watermark_http_in_flight gauge',
+                f'watermark_http_in_flight {self.in_flight}',
+                '# HELP watermark_http_workers 进程池的进程数',
+                '# TYPE watermark_http_workers gauge',
+                f'watermark_http_workers {workers}',
+                '# HELP watermark_http_uptime_seconds 服务运行时间',
+                '# TYPE watermark_http_uptime_seconds gauge',
+                f'watermark_http_uptime_seconds {time.time() - self.started:.3f}'
+            ]
+        return '\n'.join(lines) + '\n'
+
+class WatermarkServer(ThreadingHTTPServer):
+    """水印HTTP服务
+
+    参数:
+        address: (主机, 端口)，端口为0时由系统分配
+        profiles: {名称: Watermarker 参数}，见 load_profiles
+        workers: 进程池的进程数，0表示使用全部CPU核心
+        max_request_bytes: 请求体大小上限（字节）
+        max_pixels: Pillow的解压炸弹保护阈值（像素数），0表示不限制，None保持默认值
+        quiet: 为True时不打印每个请求的日志
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, profiles, workers=0, max_request_bytes=DEFAULT_MAX_REQUEST_BYTES, max_pixels=None, quiet=False):
+        # 启动前在主进程中检查所有配置，配置有误时立即报错
+        for name, options in profiles.items():
+            try:
+                Watermarker(**options)
+            except InvalidSettingsError as e:
+                raise InvalidSettingsError(f"水印配置 {name}: {e}") from e
+
+        # 注册全部格式插件，返回结果时按格式查找 Content-Type
+        Image.init()
+        self.profiles = profiles
+        self.workers = resolve_workers(workers)
+        self.max_request_bytes = max_request_bytes
+        self.max_pixels = max_pixels
+        self.quiet = quiet
+        self.metrics = ServerMetrics()
+        self._executor_lock = threading.Lock()
+        self.executor = self._create_executor()
+        super().__init__(address, WatermarkRequestHandler)
+
+    def _create_executor(self):
+        # 处理请求的线程随时可能持有锁，fork 出的子进程可能因此死锁
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=safe_mp_context(), initializer=_init_worker,
+                                       initargs=(self.profiles, self.max_pixels))
+        # 提前启动子进程并准备好水印，第一个请求不必等待
+        executor.submit(os.getpid).result()
+        return executor
+
+    def apply(self, name, data, output_format=None):
+        """在进程池中添加水印，子进程异常退出时重建进程池"""
+        executor = self.executor
+        try:
+            return executor.submit(_apply, name, data, output_format).result()
+        except BrokenProcessPool:
+            with self._executor_lock:
+                if self.executor is executor:
+                    print("处理进程异常退出，重建进程池", file=sys.stderr)
+                    self.executor = self._create_executor()
+                    # 释放已损坏的进程池的管理线程和管道
+                    executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    """处理水印服务的HTTP请求，使用HTTP/1.1长连接"""
+
+    protocol_version = 'HTTP/1.1'
+    # 空闲连接的超时时间（秒）
+    timeout = 60
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_body(status, body, 'application/json; charset=utf-8')
+
+    def check_length(self):
+        """检查请求体长度，不合法时返回 (状态码, 错误信息)"""
+        length = self.headers.get('Content-Length')
+        if length is None:
+            # 不支持分块传输，必须给出请求体长度
+            return 411, "缺少 Content-Length"
+        if not length.isdigit():
+            return 400, f"无效的 Content-Length: {length}"
+        if int(length) > self.server.max_request_bytes:
+            return 413, f"请求体 {length} 字节，超出上限 {self.server.max_request_bytes} 字节"
+        return None
+
+    def reject(self, status, message):
+        """拒绝请求并关闭连接，未读取的请求体不再接收"""
+        self.close_connection = True
+        self.send_json(status, {'error': message})
+
+    def handle_expect_100(self):
+        # 客户端发送 Expect: 100-continue 时，在上传请求体之前就拒绝过大的请求
+        error = self.check_length()
+        if error is not None and urlsplit(self.path).path == '/watermark':
+            self.server.metrics.begin()
+            self.reject(*error)
+            self.server.metrics.end(None, error[0], 0.0)
+            return False
+        return super().handle_expect_100()
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            body = self.server.metrics.prometheus(self.server.workers).encode('utf-8')
+            self.send_body(200, body, 'text/plain; version=0.0.4; charset=utf-8')
+        elif path == '/healthz':
+            self.send_body(200, b'ok\n', 'text/plain; charset=utf-8')
+        elif path == '/profiles':
+            self.send_json(200, {'profiles': sorted(self.server.profiles)})
+        else:
+            self.send_json(404, {'error': f"未知的路径: {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/watermark':
+            self.reject(404, f"未知的路径: {url.path}")
+            return
+
+        query = parse_qs(url.query)
+        name = query.get('profile', ['default'])[0]
+        output_format = query.get('format', [None])[0]
+        metrics = self.server.metrics
+        metrics.begin()
+        start = time.perf_counter()
+        status, bytes_in, bytes_out, compute_seconds = 500, 0, 0, None
+        try:
+            error = self.check_length()
+            if error is not None:
+                status = error[0]
+                self.reject(*error)
+                return
+
+            data = self.rfile.read(int(self.headers['Content-Length']))
+            bytes_in = len(data)
+            if name not in self.server.profiles:
+                status = 404
+                self.send_json(status, {'error': f"未知的水印配置: {name}"})
+                return
+            if output_format is not None and output_format.lower() not in OUTPUT_FORMATS:
+                status = 400
+                self.send_json(status, {'error': f"不支持的输出格式: {output_format}"})
+                return
+            if output_format is not None:
+                output_format = OUTPUT_FORMATS[output_format.lower()][0]
+
+            compute_start = time.perf_counter()
+            try:
+                output, image_format = self.server.apply(name, data, output_format)
+            except (WatermarkError, BrokenProcessPool) as e:
+                status = next(code for error_type, code in ERROR_STATUS if isinstance(e, error_type))
+                message = "处理进程异常退出，请重试" if isinstance(e, BrokenProcessPool) else str(e)
+                self.send_json(status, {'error': message})
+                return
+            compute_seconds = time.perf_counter() - compute_start
+
+            status = 200
+            bytes_out = len(output)
+            self.send_body(status, output, Image.MIME.get(image_format, 'application/octet-stream'),
+                           {'X-Watermark-Profile': name})
+        except Exception as e:
+            # 未预料的错误也回复500，服务继续处理其他请求；与 --quiet 无关，总是记录
+            status = 500
+            print(f"处理请求 {self.path} 时出错: {e!r}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            self.close_connection = True
+            try:
+                self.send_json(status, {'error': f"服务内部错误: {e}"})
+            except OSError:
+                pass
+        finally:
+            metrics.end(name, status, time.perf_counter() - start, bytes_in, bytes_out, compute_seconds)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地HTTP水印服务', prog=None if argv is None else 'watermark.py serve')
+    parser.add_argument('--profiles', help='水印配置文件（JSON），格式为 {名称: {参数: 值}}，参数与 watermark.py 的命令行参数同名')
+    parser.add_argument('--watermark', help='不使用配置文件时，以该水印图片作为 default 配置')
+    parser.add_argument('--text', help='不使用配置文件时，以该文字水印作为 default 配置')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认只接受本机连接')
+    parser.add_argument('--port', type=int, default=8080, help='监听端口')
+    parser.add_argument('--workers', type=int, default=0, help='处理图片的进程数，0表示使用全部CPU核心')
+    parser.add_argument('--max_request_bytes', type=parse_size, default=DEFAULT_MAX_REQUEST_BYTES,
+                        help='请求体大小上限，支持K/M/G后缀，默认50M')
+    parser.add_argument('--max_pixels', type=int, help='单张图片的最大像素数（Pillow解压炸弹保护），0表示不限制')
+    parser.add_argument('--quiet', action='store_true', help='不打印每个请求的日志')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.profiles:
+            profiles = load_profiles(args.profiles)
+        elif args.watermark or args.text:
+            profiles = {'default': profile_options({'watermark': args.watermark, 'text': args.text})}
+        else:
+            print("错误: 必须指定 --profiles，或指定 --watermark / --text 作为默认配置")
+            return 1
+        server = WatermarkServer((args.host, args.port), profiles, args.workers, args.max_request_bytes,
+                                 args.max_pixels, args.quiet)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        return 1
+
+    host, port = server.server_address[:2]
+    print(f"水印服务已启动: http://{host}:{port}  配置: {', '.join(sorted(profiles))}  进程数: {server.workers}")
+    # 收到 SIGTERM（如 systemd 停止服务）时与 Ctrl+C 一样正常关闭进程池
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
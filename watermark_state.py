@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""批量处理的持久化状态
+
+Manifest 记录每个已处理输入文件的大小、修改时间、内容哈希和水印设置指纹，
+增量模式下源文件和水印设置都没有变化、且输出文件存在时跳过该文件。
+Journal 是只追加的处理日志，长时间的批量任务中断后可以从日志继续。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 清单文件保存在输出目录中，以点开头以免被递归查找当作输入
+MANIFEST_NAME = '.watermark-manifest.sqlite'
+
+# 断点续传日志同样保存在输出目录中
+JOURNAL_NAME = '.watermark-journal.jsonl'
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """计算文件内容的哈希值"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def settings_fingerprint(options, plan=None):
+    """水印设置的指纹，任何设置或水印素材变化都会得到不同的指纹
+
+    参数:
+        options: 传给 add_watermark 的关键字参数
+        plan: 可选的水印计划，其 asset_digest() 描述水印图片或字体文件本身
+    """
+    data = {key: value for key, value in options.items() if value is not None}
+    if plan is not None:
+        data['asset'] = plan.asset_digest()
+    encoded = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=20).hexdigest()
+
+class Manifest:
+    """增量处理清单
+
+    流水线模式下读取线程调用 check、主线程调用 record，连接由锁保护。
+
+    参数:
+        path: 清单数据库路径
+        commit_every: 每记录多少个文件提交一次，减少磁盘同步次数
+    """
+
+    def __init__(self, path, commit_every=500):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = 0
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' input_path TEXT PRIMARY KEY,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' digest TEXT NOT NULL,'
+            ' fingerprint TEXT NOT NULL)'
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def _key(input_path):
+        return os.path.abspath(input_path)
+
+    def check(self, input_path, output_path, fingerprint):
+        """检查源文件是否需要重新处理
+
+        源文件的大小、修改时间和内容摘要在这里读取一次，处理成功后原样交给
+        record，不再重新读取；处理期间被修改的文件下次运行时会重新处理。
+
+        参数:
+            input_path: 源文件路径
+            output_path: 输出文件路径
+            fingerprint: 水印设置的指纹
+
+        返回:
+            (current, state)：current 为True表示输出文件存在，且源文件和水印设置
+            自上次处理以来都没有变化；state 为 (size, mtime_ns, digest)，源文件
+            无法读取时为None
+        """
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return False, None
+
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT size, mtime_ns, digest, fingerprint FROM files WHERE input_path = ?',
+                (self._key(input_path),)
+            ).fetchone()
+        if row is not None and os.path.exists(output_path):
+            size, mtime_ns, digest, recorded_fingerprint = row
+            if recorded_fingerprint == fingerprint and size == stat.st_size:
+                if mtime_ns == stat.st_mtime_ns:
+                    return True, (size, mtime_ns, digest)
+                # 修改时间变了但大小相同时比较内容，内容未变只更新修改时间
+                current_digest = file_digest(input_path)
+                if current_digest == digest:
+                    with self._lock:
+                        self.connection.execute(
+                            'UPDATE files SET mtime_ns = ? WHERE input_path = ?',
+                            (stat.st_mtime_ns, self._key(input_path))
+                        )
+                        self._count_pending()
+                    return True, (stat.st_size, stat.st_mtime_ns, digest)
+                return False, (stat.st_size, stat.st_mtime_ns, current_digest)
+
+        try:
+            digest = file_digest(input_path)
+        except OSError:
+            return False, None
+        return False, (stat.st_size, stat.st_mtime_ns, digest)
+
+    def record(self, input_path, fingerprint, state):
+        """记录处理成功的文件
+
+        参数:
+            input_path: 源文件路径
+            fingerprint: 水印设置的指纹
+            state: check 返回的 (size, mtime_ns, digest)
+        """
+        size, mtime_ns, digest = state
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files (input_path, size, mtime_ns, digest, fingerprint) VALUES (?, ?, ?, ?, ?)',
+                (self._key(input_path), size, mtime_ns, digest, fingerprint)
+            )
+            self._count_pending()
+
+    def _count_pending(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        """把尚未提交的记录写入磁盘"""
+        with self._lock:
+            self.connection.commit()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class Journal:
+    """只追加的处理日志，记录每个已完成和失败的文件
+
+    每行一条JSON记录。记录先缓存在内存中，达到条数或时间间隔后批量写入并
+    同步到磁盘；进程被杀死时最多丢失最后一批记录，这些文件在续传时会重新处理。
+
+    参数:
+        path: 日志文件路径
+        resume: 为True时读取已有日志并继续追加，否则清空重新开始
+        flush_every: 缓存多少条记录后写入磁盘
+        flush_interval: 距上次写入超过多少秒后写入磁盘
+    """
+
+    def __init__(self, path, resume=False, flush_every=200, flush_interval=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.completed = set()
+        self.failed = set()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+        if resume:
+            self._load()
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self._file.tell() > 0 and not self._ends_with_newline():
+            # 上次中断时最后一行没写完，另起一行继续追加
+            self._buffer.append('\n')
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _load(self):
+        """读取已有日志，忽略进程中断时写了一半的最后一行"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    key = entry.get('input')
+                    if entry.get('status') == 'done':
+                        self.completed.add(key)
+                        self.failed.discard(key)
+                    else:
+                        self.failed.add(key)
+        except OSError:
+            pass
+
+    def is_done(self, input_path, output_path):
+        """该文件在之前的运行中已成功处理，且输出文件存在"""
+        return os.path.abspath(input_path) in self.completed and os.path.exists(output_path)
+
+    def record(self, input_path, output_path, ok):
+        """记录一个文件的处理结果"""
+        entry = {'status': 'done' if ok else 'failed', 'input': os.path.abspath(input_path), 'output': output_path}
+        self._buffer.append(json.dumps(entry, ensure_ascii=False) + '\n')
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """把缓存的记录写入并同步到磁盘"""
+        if self._buffer:
+            self._file.writelines(self._buffer)
+            self._buffer = []
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""缩略图的生成与磁盘缓存
+
+图形界面的缩略图条使用这里生成的缩略图：JPEG 用 draft 按缩小的比例解码，
+缩略图按 (文件路径, 修改时间, 尺寸) 的哈希保存在用户缓存目录中，
+再次打开同一文件夹时直接读取缓存，原图修改后自动重新生成。
+"""
+
+import os
+import hashlib
+from PIL import Image
+
+from watermark_core import atomic_write
+from watermark_fonts import user_cache_dir
+from watermark_preview import load_preview_base
+
+# 缩略图的最大尺寸
+THUMBNAIL_SIZE = (96, 96)
+
+def make_thumbnail(input_path, size=THUMBNAIL_SIZE):
+    """生成RGB缩略图，透明区域合成到白色背景上"""
+    image, _ = load_preview_base(input_path, size)
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image)
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+class ThumbnailCache:
+    """缩略图的磁盘缓存
+
+    参数:
+        cache_dir: 缓存目录，默认为用户缓存目录下的 thumbnails
+        size: 缩略图的最大尺寸
+    """
+
+    def __init__(self, cache_dir=None, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir or os.path.join(user_cache_dir(), 'thumbnails')
+        self.size = tuple(size)
+
+    def cache_path(self, input_path, mtime_ns):
+        """缓存文件路径，按哈希的前两位分目录，避免单个目录中文件过多"""
+        key = f"{os.path.abspath(input_path)}\0{mtime_ns}\0{self.size[0]}x{self.size[1]}"
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.jpg')
+
+    def get(self, input_path):
+        """返回缩略图，缓存中没有时生成并写入缓存"""
+        cache_path = self.cache_path(input_path, os.stat(input_path).st_mtime_ns)
+        try:
+            with Image.open(cache_path) as cached:
+                cached.load()
+                return cached
+        except (OSError, ValueError):
+            pass
+
+        thumbnail = make_thumbnail(input_path, self.size)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            atomic_write(cache_path, lambda f: thumbnail.save(f, 'JPEG', quality=85))
+        except OSError:
+            # 缓存目录不可写时只在内存中使用缩略图
+            pass
+        return thumbnail
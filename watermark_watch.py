@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""监视输入目录，新增或修改的图片写入完成后立即处理
+
+Linux上使用inotify（通过ctypes调用libc，不需要第三方库）接收文件事件；
+其他平台、inotify不可用，或输入目录位于网络文件系统（其他机器写入的文件
+不会产生inotify事件）时，用 os.scandir 定期扫描并比较文件大小和修改时间。
+
+文件的大小和修改时间在 settle 秒内都没有变化时才认为写入完成，
+避免处理还在复制中的图片。写入完成的图片分批交给批量处理引擎。
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+from watermark_files import iter_images, is_image, is_walked_dir
+from watermark_batch import cancel_on_signals
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# inotify 事件掩码，见 <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct('iIII')
+
+# 默认的扫描间隔（秒）
+DEFAULT_POLL_INTERVAL = 1.0
+
+def _signature(path):
+    """文件的 (大小, 修改时间)，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class PollingWatcher:
+    """用 os.scandir 定期扫描输入目录，比较文件大小和修改时间
+
+    参数:
+        input_dir: 输入目录
+        recursive: 是否递归子目录
+        include, exclude: glob规则列表，见 watermark_files.iter_images
+        skip_dirs: 不扫描的目录，例如位于输入目录内的输出目录
+        interval: 扫描间隔（秒）
+    """
+
+    name = '定期扫描'
+
+    def __init__(self, input_dir, recursive=False, include=None, exclude=None, skip_dirs=None, interval=DEFAULT_POLL_INTERVAL):
+        self.input_dir = input_dir
+        self.filters = {'recursive': recursive, 'include': include, 'exclude': exclude, 'skip_dirs': skip_dirs}
+        self.interval = interval
+        self.snapshot = self._scan()
+        self._last_scan = time.monotonic()
+
+    def _scan(self):
+        snapshot = {}
+        for path, rel_path in iter_images(self.input_dir, **self.filters):
+            signature = _signature(path)
+            if signature is not None:
+                snapshot[path] = (rel_path, signature)
+        return snapshot
+
+    def poll(self, timeout):
+        """等待至多 timeout 秒，返回自上次扫描以来新增或修改的 {路径: 相对路径}"""
+        remaining = self.interval - (time.monotonic() - self._last_scan)
+        if remaining > 0:
+            time.sleep(min(remaining, timeout))
+            if remaining > timeout:
+                return {}
+
+        snapshot = self._scan()
+        self._last_scan = time.monotonic()
+        changed = {path: rel_path for path, (rel_path, signature) in snapshot.items()
+                   if self.snapshot.get(path, (None, None))[1] != signature}
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """使用Linux inotify接收文件事件，参数与 PollingWatcher 相同（没有扫描间隔）
+
+    递归时为每个子目录添加监视，新建或移入的子目录会立即扫描一次，
+    不会漏掉添加监视之前写入的文件。事件队列溢出时重新扫描整个目录。
+    """
+
+    name = 'inotify'
+
+    def __init__(self, input_dir, recursive=False, include=None, exclude=None, skip_dirs=None):
+        if ctypes is None or not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "当前平台不支持inotify")
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self.input_dir = input_dir
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.skip = {os.path.realpath(d) for d in (skip_dirs or [])}
+        # 监视描述符 -> (目录路径, 相对路径前缀)
+        self.watches = {}
+        try:
+            self._add_tree(input_dir, '')
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory, prefix):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"无法监视 {directory}: {os.strerror(error)}")
+        self.watches[wd] = (directory, prefix)
+
+    def _add_tree(self, directory, prefix):
+        """监视目录及其子目录，返回其中已有的图片 {路径: 相对路径}"""
+        self._add_watch(directory, prefix)
+        found = {}
+        if not self.recursive:
+            return found
+        # 与 iter_images 相同，不进入隐藏目录、被排除的目录和输出目录
+        stack = [(directory, prefix)]
+        while stack:
+            current, current_prefix = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        rel_path = current_prefix + entry.name
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            continue
+                        if is_dir:
+                            if is_walked_dir(entry.path, rel_path, self.exclude, self.skip):
+                                self._add_watch(entry.path, rel_path + '/')
+                                stack.append((entry.path, rel_path + '/'))
+                        elif is_image(rel_path, self.include, self.exclude):
+                            found[entry.path] = rel_path
+            except FileNotFoundError:
+                pass
+        return found
+
+    def _rescan(self):
+        """事件队列溢出后，把所有图片当作已修改"""
+        return dict((path, rel_path) for path, rel_path in iter_images(
+            self.input_dir, self.recursive, self.include, self.exclude, skip_dirs=list(self.skip)))
+
+    def poll(self, timeout):
+        """等待至多 timeout 秒，返回期间新增或修改的 {路径: 相对路径}"""
+        changed = {}
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(self._rescan())
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches or not name:
+                    continue
+                directory, prefix = self.watches[wd]
+                path = os.path.join(directory, name)
+                rel_path = prefix + name
+                if mask & IN_ISDIR:
+                    if (self.recursive and mask & (IN_CREATE | IN_MOVED_TO)
+                            and is_walked_dir(path, rel_path, self.exclude, self.skip)):
+                        try:
+                            changed.update(self._add_tree(path, rel_path + '/'))
+                        except OSError as e:
+                            print(f"警告: {e}")
+                elif is_image(rel_path, self.include, self.exclude):
+                    changed[path] = rel_path
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def create_watcher(input_dir, recursive=False, include=None, exclude=None, skip_dirs=None, poll_interval=None):
+    """创建文件监视器：未指定 poll_interval 时优先使用inotify，不可用时定期扫描"""
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(input_dir, recursive, include, exclude, skip_dirs)
+        except OSError as e:
+            print(f"无法使用inotify（{e}），改为每 {DEFAULT_POLL_INTERVAL:g} 秒扫描一次")
+            poll_interval = DEFAULT_POLL_INTERVAL
+    return PollingWatcher(input_dir, recursive, include, exclude, skip_dirs, poll_interval)
+
+class SettleTracker:
+    """等待文件写入完成：大小和修改时间在 settle 秒内都没有变化
+
+    参数:
+        settle: 文件保持不变多少秒后认为写入完成
+    """
+
+    def __init__(self, settle=1.0):
+        self.settle = settle
+        # 路径 -> [相对路径, (大小, 修改时间), 最后一次变化的时间]
+        self.pending = {}
+
+    def add(self, changed):
+        """记录新增或修改的文件，重新开始等待"""
+        now = time.monotonic()
+        for path, rel_path in changed.items():
+            self.pending[path] = [rel_path, _signature(path), now]
+
+    def ready(self):
+        """返回已写入完成的 [(路径, 相对路径)]，按路径排序；已删除的文件不再等待"""
+        now = time.monotonic()
+        ready = []
+        for path, entry in list(self.pending.items()):
+            signature = _signature(path)
+            if signature is None:
+                del self.pending[path]
+            elif signature != entry[1]:
+                entry[1] = signature
+                entry[2] = now
+            elif now - entry[2] >= self.settle:
+                del self.pending[path]
+                ready.append((path, entry[0]))
+        return sorted(ready)
+
+def watch_directory(watcher, process, control, settle=1.0):
+    """监视输入目录，把写入完成的图片交给 process 处理，直到取消
+
+    参数:
+        watcher: create_watcher 创建的文件监视器
+        process: 处理函数 process([(路径, 相对路径)])，返回 (total, successful)，
+            应把 control 传给批量处理引擎
+        control: BatchControl，取消后停止监视；在主线程中调用时 Ctrl+C 和 SIGTERM
+            会取消它，正在处理的图片处理完后退出
+        settle: 文件保持不变多少秒后认为写入完成
+    返回:
+        (total, successful)
+    """
+    tracker = SettleTracker(settle)
+    total = 0
+    successful = 0
+
+    print(f"\n正在监视 {watcher.input_dir}（{watcher.name}），按 Ctrl+C 停止")
+    try:
+        with cancel_on_signals(control):
+            while not control.cancelled:
+                # 有等待中的文件时频繁检查是否写入完成，否则每秒检查一次停止信号
+                timeout = min(settle / 2, 1.0) if tracker.pending else 1.0
+                tracker.add(watcher.poll(timeout))
+                ready = tracker.ready()
+                if ready and not control.cancelled:
+                    batch_total, batch_successful = process(ready)
+                    total += batch_total
+                    successful += batch_successful
+    finally:
+        watcher.close()
+    print(f"已停止监视，监视期间处理 {total} 张，成功 {successful} 张")
+    return total, successful